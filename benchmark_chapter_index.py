@@ -0,0 +1,89 @@
+"""章节文件查找性能测试
+
+在临时目录中生成500章（其中一部分是带零的旧文件名和带小说标题的旧文件名，另有润色结果等
+无关文件），检查第1-600章哪些已存在：
+- 原来的方式：每章依次对第X章.txt、第00X章.txt做exists，再glob带小说标题的旧格式
+- ChapterIndex：一次os.scandir建立索引，之后全部在内存中查找
+
+同时校验两种方式找到的章节一致，并统计原来的方式做了多少次文件系统调用。
+
+运行：python benchmark_chapter_index.py
+"""
+import glob
+import os
+import tempfile
+import time
+
+from novel_project import ChapterIndex
+
+TITLE = "测试小说"
+CHAPTERS = 500
+CHECK_RANGE = range(1, 601)
+
+
+def build_directory(path):
+    for chapter in range(1, CHAPTERS + 1):
+        if chapter % 10 == 0:
+            name = f"第{chapter:03d}章.txt"
+        elif chapter % 10 == 1:
+            name = f"第{chapter}章_{TITLE}.txt"
+        else:
+            name = f"第{chapter}章.txt"
+        with open(os.path.join(path, name), "w", encoding="utf-8") as f:
+            f.write("内容。" * 100)
+        if chapter % 7 == 0:
+            with open(os.path.join(path, f"第{chapter}章新.txt"), "w", encoding="utf-8") as f:
+                f.write("润色。")
+
+
+def legacy_existing(save_path, chapters, title, calls):
+    """原来各处的查找方式：逐个格式exists，最后glob旧格式"""
+    existing = []
+    for chapter in chapters:
+        found = False
+        for name in (f"第{chapter}章.txt", f"第{chapter:03d}章.txt", f"第{chapter}章_{title}.txt"):
+            calls[0] += 1
+            if os.path.exists(os.path.join(save_path, name)):
+                found = True
+                break
+        if not found:
+            calls[0] += 1
+            found = bool(glob.glob(os.path.join(save_path, f"第{chapter}章*_{title}.txt")))
+        if found:
+            existing.append(chapter)
+    return existing
+
+
+def measure(func, rounds=5):
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as path:
+        build_directory(path)
+        calls = [0]
+        legacy_seconds, legacy_result = measure(lambda: legacy_existing(path, CHECK_RANGE, TITLE, calls))
+        print(f"原来的方式: {legacy_seconds * 1000:8.2f} ms, 找到 {len(legacy_result)} 章, "
+              f"每轮文件系统调用 {calls[0] // 5} 次")
+
+        # 每轮新建索引，包含扫描目录的时间
+        index_seconds, index_result = measure(lambda: ChapterIndex(path).existing(CHECK_RANGE, TITLE))
+        print(f"ChapterIndex: {index_seconds * 1000:8.2f} ms, 找到 {len(index_result)} 章, 每轮扫描目录 1 次"
+              f"  (提升 {legacy_seconds / index_seconds:.1f}x)")
+
+        index = ChapterIndex(path)
+        index.existing(CHECK_RANGE, TITLE)
+        cached_seconds, _ = measure(lambda: index.existing(CHECK_RANGE, TITLE))
+        print(f"已建立的索引: {cached_seconds * 1000:8.2f} ms  (只检查目录修改时间)")
+        print("结果一致" if legacy_result == index_result else "结果不一致!")
+
+
+if __name__ == "__main__":
+    main()
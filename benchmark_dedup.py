@@ -0,0 +1,146 @@
+"""重复句子去除性能测试
+
+在1万字和10万字的模拟章节上对比：
+- 原来的方式：逐句与前面保留的句子比较，相似度为两句字符集合的Jaccard
+- novel_text：二字组集合，最近的句子直接比较，更早的句子通过MinHash + LSH查找，一遍扫描
+两种方式都分别测试只比较前4句和比较整章。原来的方式比较整章时是两两比较，只测1万字。
+
+模拟章节中按5%的比例插入近似重复句（前几句中某句改一个字），
+同时统计各方式删掉的句子里有多少是插入的重复句、有多少是误删的正常句子。
+
+运行：python benchmark_dedup.py
+"""
+import random
+import re
+import time
+from collections import Counter
+
+from novel_text import remove_near_duplicate_sentences, split_sentences
+
+# 常用字排在前面；模拟文本按Zipf分布取字，高频字（的、了、他……）在不相关的句子里也经常同时出现
+COMMON_CHARS = "的了是他她着一不在人有这我们来到时大地为子中你说道出也就那要下以会可过看"
+ENDINGS = "。。。！？"
+
+
+def build_char_pool(size=2500, seed=7):
+    """常用字加上随机抽取的汉字，组成按使用频率排序的字表"""
+    rng = random.Random(seed)
+    pool = list(COMMON_CHARS)
+    seen = set(pool)
+    while len(pool) < size:
+        char = chr(rng.randint(0x4E00, 0x9FA5))
+        if char not in seen:
+            seen.add(char)
+            pool.append(char)
+    return pool
+
+
+def build_chapter(target_chars, duplicate_rate=0.05, seed=42):
+    """生成模拟章节，返回(文本, 插入的重复句列表)"""
+    rng = random.Random(seed)
+    pool = build_char_pool()
+    weights = [1 / (rank + 1) for rank in range(len(pool))]
+    sentences = []
+    injected = []
+    length = 0
+    while length < target_chars:
+        if sentences and rng.random() < duplicate_rate:
+            # 取前1~3句中的一句，改掉其中一个字
+            source = sentences[-rng.randint(1, min(3, len(sentences)))].rstrip("\n")
+            pos = rng.randrange(len(source) - 1)
+            sentence = source[:pos] + rng.choice("的了着过也又") + source[pos + 1:]
+            injected.append(sentence)
+        else:
+            body = "".join(rng.choices(pool, weights, k=rng.randint(8, 30)))
+            sentence = body + rng.choice(ENDINGS)
+            if rng.random() < 0.15:
+                sentence += "\n"
+        sentences.append(sentence)
+        length += len(sentence)
+    return "".join(sentences), injected
+
+
+def legacy_calculate_similarity(text1, text2):
+    """原来的_calculate_similarity"""
+    words1 = set(text1)
+    words2 = set(text2)
+    if not words1 or not words2:
+        return 0
+    return len(words1 & words2) / len(words1 | words2)
+
+
+def legacy_remove_duplicate_sentences(text, window=4):
+    """原来的_remove_duplicate_sentences，window为None时与所有保留的句子比较"""
+    sentences = re.split(r'([。！？])', text)
+    processed_sentences = []
+    i = 0
+    while i < len(sentences):
+        if i + 1 < len(sentences):
+            sentence = sentences[i] + sentences[i + 1]
+            i += 2
+        else:
+            sentence = sentences[i]
+            i += 1
+        if not sentence.strip():
+            continue
+        is_duplicate = False
+        oldest = -1 if window is None else max(-1, len(processed_sentences) - window - 1)
+        for j in range(len(processed_sentences) - 1, oldest, -1):
+            if legacy_calculate_similarity(sentence, processed_sentences[j]) > 0.8:
+                is_duplicate = True
+                break
+        if not is_duplicate:
+            processed_sentences.append(sentence)
+    return ''.join(processed_sentences)
+
+
+def measure(func, text, rounds=3):
+    """取多轮中最快的一次，返回(秒, 结果)"""
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def removed_stats(text, result, injected):
+    """返回(删除句数, 其中插入的重复句数, 误删的正常句数)"""
+    removed = (Counter(sentence.strip() for sentence in split_sentences(text))
+               - Counter(sentence.strip() for sentence in split_sentences(result)))
+    removed_count = sum(removed.values())
+    true_positives = sum((removed & Counter(injected)).values())
+    return removed_count, true_positives, removed_count - true_positives
+
+
+def main():
+    methods = [
+        ("原来的方式(前4句)", lambda text: legacy_remove_duplicate_sentences(text), "前4句"),
+        ("MinHash(前4句)", lambda text: remove_near_duplicate_sentences(text, window=4), "前4句"),
+        ("原来的方式(整章)", lambda text: legacy_remove_duplicate_sentences(text, window=None), "整章"),
+        ("MinHash(整章)", lambda text: remove_near_duplicate_sentences(text, window=None), "整章"),
+    ]
+    for target_chars in (10000, 100000):
+        text, injected = build_chapter(target_chars)
+        print(f"[{len(text)}字] 句子数: {len(split_sentences(text))}, 插入的重复句: {len(injected)}")
+        legacy_seconds = {}
+        for name, func, scope in methods:
+            if name == "原来的方式(整章)" and target_chars > 10000:
+                # 两两比较，10万字要几分钟
+                print(f"  {name:<14} 跳过")
+                continue
+            seconds, result = measure(func, text)
+            removed, hits, false_removed = removed_stats(text, result, injected)
+            speedup = ""
+            if scope not in legacy_seconds:
+                legacy_seconds[scope] = seconds
+            else:
+                speedup = f"  (提升 {legacy_seconds[scope] / seconds:.2f}x)"
+            print(f"  {name:<14} {seconds * 1000:8.1f} ms  删除 {removed:5d} 句, "
+                  f"命中重复 {hits:5d}, 误删 {false_removed:5d}{speedup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""章节版本历史存储测试
+
+模拟一章（约4500字）的修改过程，统计版本历史占用的空间，并与最终正文的大小比较：
+- 重新生成30次：每次都是新写的正文，只有人名、常用词与之前的版本相同；
+- 润色10次：每次改写约五分之一的句子；
+- 手动修改60次：每次改一两个字（每次都单独记录，不做合并）。
+同时对比每个版本单独压缩（不以上一个版本为字典）时的大小，以及恢复最早版本和最新版本的耗时。
+
+运行：python benchmark_history.py
+"""
+import os
+import random
+import tempfile
+import time
+
+import novel_history
+from novel_history import ChapterHistory, KIND_EDIT, KIND_GENERATE, KIND_POLISH, _compress
+
+NAMES = ["林晚", "顾沉舟", "苏婉", "陈叔", "老宅", "江城"]
+WORDS = ["他", "她", "说", "看着", "窗外", "的", "了", "雨", "没有", "回答", "慢慢地", "走进", "院子", "心里",
+         "有些", "不安", "远处", "传来", "钟声", "轻轻", "推开", "门", "灯光", "沉默", "许久", "终于", "开口",
+         "目光", "落在", "脸上", "转身", "离开", "想起", "那天", "夜里", "风", "吹过", "树叶", "声音", "低声"]
+
+
+def sentence(rng):
+    words = [rng.choice(NAMES)] + rng.choices(WORDS, k=rng.randint(6, 14))
+    return "".join(words) + rng.choice("。。。！？")
+
+
+def new_chapter(rng, chars=4500):
+    sentences = []
+    length = 0
+    while length < chars:
+        sentences.append(sentence(rng))
+        length += len(sentences[-1])
+    return "\n".join(sentences)
+
+
+def polish(rng, text):
+    lines = text.split("\n")
+    for i in rng.sample(range(len(lines)), len(lines) // 5):
+        lines[i] = sentence(rng)
+    return "\n".join(lines)
+
+
+def edit(rng, text):
+    pos = rng.randrange(len(text))
+    return text[:pos] + rng.choice(WORDS) + text[pos + 1:]
+
+
+def main():
+    rng = random.Random(3)
+    # 手动修改每次单独记录
+    novel_history.EDIT_MERGE_SECONDS = 0
+    with tempfile.TemporaryDirectory() as path:
+        history = ChapterHistory(os.path.join(path, "history.db"))
+        texts = []
+        text = None
+        steps = [(KIND_GENERATE, 30), (KIND_POLISH, 10), (KIND_EDIT, 60)]
+        for kind, count in steps:
+            for _ in range(count):
+                if kind == KIND_GENERATE:
+                    text = new_chapter(rng)
+                elif kind == KIND_POLISH:
+                    text = polish(rng, text)
+                else:
+                    text = edit(rng, text)
+                history.record(1, text, kind)
+                texts.append(text)
+
+        final_size = len(text.encode("utf-8"))
+        raw_size = sum(len(t.encode("utf-8")) for t in texts)
+        independent_size = sum(len(_compress(t)) for t in texts)
+        stored_size = history.storage_size(1)
+        print(f"版本数: {len(history.versions(1))}, 最终正文: {final_size / 1024:.1f} KB, "
+              f"全部版本原文: {raw_size / 1024:.1f} KB")
+        print(f"每个版本单独压缩: {independent_size / 1024:.1f} KB ({independent_size / final_size:.1f}倍最终正文)")
+        print(f"版本历史: {stored_size / 1024:.1f} KB ({stored_size / final_size:.1f}倍最终正文)")
+        for kind, _ in steps:
+            sizes = [v["size"] for v in history.versions(1) if v["kind"] == kind]
+            print(f"  {novel_history.KIND_LABELS[kind]}: 平均每个版本 {sum(sizes) / len(sizes):.0f} 字节")
+
+        for version in (1, len(texts) // 2, len(texts)):
+            fresh = ChapterHistory(history.db_path)  # 不使用最新版本缓存
+            start = time.perf_counter()
+            restored = fresh.text(1, version)
+            elapsed = time.perf_counter() - start
+            assert restored == texts[version - 1]
+            print(f"恢复版本{version}: {elapsed * 1000:.2f} ms")
+            fresh.close()
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
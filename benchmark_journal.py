@@ -0,0 +1,77 @@
+"""生成日志写盘开销测试
+
+模拟一次流式生成：约3秒内收到3000个片段（每个2-3个字），比较两种落盘方式：
+- 逐片段追加：每收到一个片段就追加到文件并fsync；
+- GenerationJournal：片段只放进内存，后台线程每FLUSH_INTERVAL秒批量写一次。
+统计写盘次数、生成线程中append()的总耗时，并校验日志中的内容与生成的内容一致。
+
+运行：python benchmark_journal.py
+"""
+import os
+import random
+import tempfile
+import time
+
+from novel_journal import FLUSH_INTERVAL, KIND_CHAPTER, close_journal_writer, open_generation_journal, read_journal
+from novel_perf import perf
+
+CHUNKS = 3000
+CHUNK_INTERVAL = 0.001  # 秒，片段之间的间隔
+WORDS = "他说她看着窗外的雨没有回答慢慢地走进院子心里有些不安远处传来钟声"
+
+
+def make_chunks(rng):
+    return ["".join(rng.choices(WORDS, k=rng.randint(2, 3))) for _ in range(CHUNKS)]
+
+
+def per_chunk_append(path, chunks):
+    """每个片段单独追加并fsync，返回(append总耗时, 写盘次数)"""
+    spent = 0.0
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            start = time.perf_counter()
+            f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+            spent += time.perf_counter() - start
+            time.sleep(CHUNK_INTERVAL)
+    return spent, len(chunks)
+
+
+def journaled_append(save_path, chunks):
+    """通过GenerationJournal记录，返回(append总耗时, 写盘次数, 日志路径)"""
+    perf.reset("journal_writes")
+    journal = open_generation_journal(save_path, KIND_CHAPTER, 1, prompt="测试")
+    spent = 0.0
+    for chunk in chunks:
+        start = time.perf_counter()
+        journal.append(chunk)
+        spent += time.perf_counter() - start
+        time.sleep(CHUNK_INTERVAL)
+    # 模拟出错中断：保留日志
+    journal.mark_failed("测试")
+    journal.finish()
+    return spent, perf.get("journal_writes"), journal.path
+
+
+def main():
+    chunks = make_chunks(random.Random(5))
+    expected = "".join(chunks)
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        spent, writes = per_chunk_append(os.path.join(path, "naive.part"), chunks)
+        elapsed = time.perf_counter() - start
+        print(f"逐片段追加: 生成耗时 {elapsed:.2f} s, append耗时 {spent * 1000:8.1f} ms, 写盘 {writes} 次")
+
+        start = time.perf_counter()
+        spent, writes, journal_path = journaled_append(path, chunks)
+        elapsed = time.perf_counter() - start
+        print(f"生成日志:   生成耗时 {elapsed:.2f} s, append耗时 {spent * 1000:8.1f} ms, 写盘 {writes} 次"
+              f"（上限 {int(elapsed / FLUSH_INTERVAL) + 2} 次）")
+        meta, text = read_journal(journal_path)
+        print("日志内容一致" if text == expected else "日志内容不一致!")
+    close_journal_writer()
+
+
+if __name__ == "__main__":
+    main()
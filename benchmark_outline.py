@@ -0,0 +1,64 @@
+"""大纲分节测试
+
+构造一份带有100章"每章内容概要"的大纲（格式与generate_outline生成的相同），统计：
+- 每章提示词中的大纲部分：整份大纲与全局部分加前后章节概要的token数；
+- 第一次解析和之后命中缓存的耗时；
+- 每一章都能在提示词中找到自己的概要。
+
+运行：python benchmark_outline.py
+"""
+import random
+import time
+
+from benchmark_history import sentence
+from novel_memory import estimate_tokens
+from novel_outline import get_outline_sections, outline_for_chapter
+from novel_perf import perf
+from novel_prompts import build_chapter_prompt
+
+CHAPTERS = 100
+
+
+def make_outline(rng):
+    parts = ["# 《雨夜》大纲", "## 一、故事梗概", "".join(sentence(rng) for _ in range(12)),
+             "## 二、主要人物介绍", "".join(sentence(rng) for _ in range(8)),
+             "## 三、故事结构", "".join(sentence(rng) for _ in range(8)),
+             "## 四、主要情节线", "".join(sentence(rng) for _ in range(6)),
+             "## 五、每章内容概要"]
+    for chapter in range(1, CHAPTERS + 1):
+        parts.append(f"**第{chapter}章：标题{chapter}**")
+        parts.append("".join(sentence(rng) for _ in range(5)))
+    return "\n".join(parts)
+
+
+def main():
+    outline = make_outline(random.Random(13))
+    start = time.perf_counter()
+    sections = get_outline_sections(outline)
+    print(f"大纲: {len(outline)}字, 约{estimate_tokens(outline)} tokens, 章节条目 {len(sections.entries)} 个, "
+          f"第一次解析 {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    full_tokens = 0
+    sliced_tokens = 0
+    missing = []
+    for chapter in range(1, CHAPTERS + 1):
+        text = outline_for_chapter(outline, chapter)
+        full_tokens += estimate_tokens(outline)
+        sliced_tokens += estimate_tokens(text)
+        if f"第{chapter}章：标题{chapter}" not in text:
+            missing.append(chapter)
+    elapsed = time.perf_counter() - start
+    print(f"{CHAPTERS}章的大纲部分: 整份大纲 {full_tokens // CHAPTERS} tokens/章, "
+          f"分节后 {sliced_tokens // CHAPTERS} tokens/章（{sliced_tokens / full_tokens:.0%}）")
+    print(f"分节耗时: {elapsed / CHAPTERS * 1000:.3f} ms/章, 解析 {perf.get('outline_parses')} 次, "
+          f"命中缓存 {perf.get('outline_cache_hits')} 次")
+    print("每章都包含自己的概要" if not missing else f"缺少概要的章节: {missing}")
+
+    prompt = build_chapter_prompt("雨夜", 50, outline, "顾沉舟", "林晚", "第三人称", "简洁", "紧凑", 3000)
+    print(f"第50章完整提示词: 约{estimate_tokens(prompt)} tokens "
+          f"（整份大纲时约{estimate_tokens(prompt) - estimate_tokens(outline_for_chapter(outline, 50)) + estimate_tokens(outline)} tokens）")
+
+
+if __name__ == "__main__":
+    main()
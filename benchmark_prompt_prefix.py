@@ -0,0 +1,58 @@
+"""章节提示词前缀共享测试
+
+用benchmark_outline的100章大纲，模拟批量生成第1-100章（每章随机目标字数，附上前文上下文），
+统计相邻两章的提示词共享的前缀字节数：
+- 原来的布局：开头就是"生成第N章"，章节号、前文上下文和目标字数夹在大纲与写作要求之间；
+- 现在的布局：build_chapter_prompt，不随章节变化的部分在前。
+服务商和Ollama的前缀缓存只能复用共享的这一段。
+
+运行：python benchmark_prompt_prefix.py
+"""
+import random
+
+from benchmark_history import sentence
+from benchmark_outline import CHAPTERS, make_outline
+from novel_prompts import build_chapter_prompt, prefix_report, prompt_prefix_stats
+from novel_perf import perf
+
+POV, LANGUAGE, RHYTHM = "第三人称", "简洁", "紧凑"
+
+
+def old_layout(title, chapter, outline, hero_name, heroine_name, target_length, story_context):
+    """原来build_chapter_prompt的布局（整份大纲）"""
+    prompt = f"请根据以下小说大纲生成《{title}》的第{chapter}章内容：\n"
+    prompt += outline + "\n\n"
+    prompt += f"【重要角色信息】\n男主角：{hero_name}\n女主角：{heroine_name}\n"
+    prompt += f"请确保在章节内容中正确使用以上角色名字，不要混淆男女主角的名字。\n\n"
+    prompt += f"【前文回顾】\n{story_context}\n\n"
+    prompt += f"章节具体要求：\n- 保持{POV}视角\n- 使用{LANGUAGE}风格\n- 节奏：{RHYTHM}\n- 字数：约{target_length}字\n"
+    prompt += f"- 必须在章节开头添加一个吸引人的章节标题，格式为'第{chapter}章：[章节标题]'\n"
+    prompt += f"- 重要：不要在章节内容中添加小说标题'《{title}》'，章节内容直接从章节标题开始\n"
+    prompt += f"- 特别注意：必须正确使用角色名字，男主角是{hero_name}，女主角是{heroine_name}，不要混淆\n"
+    return prompt
+
+
+def measure(name, prompts):
+    start = perf.snapshot()
+    for prompt in prompts:
+        prompt_prefix_stats.record(name, prompt)
+    print(f"{name}: {prefix_report(start)}")
+
+
+def main():
+    rng = random.Random(17)
+    outline = make_outline(rng)
+    old_prompts = []
+    new_prompts = []
+    for chapter in range(1, CHAPTERS + 1):
+        target_length = rng.randint(2000, 4000)
+        story_context = "".join(sentence(rng) for _ in range(20)) if chapter > 1 else ""
+        old_prompts.append(old_layout("雨夜", chapter, outline, "顾沉舟", "林晚", target_length, story_context))
+        new_prompts.append(build_chapter_prompt("雨夜", chapter, outline, "顾沉舟", "林晚", POV, LANGUAGE, RHYTHM,
+                                                target_length, story_context=story_context))
+    measure("原来的布局", old_prompts)
+    measure("现在的布局", new_prompts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""章节全文检索测试
+
+在临时目录中生成260章（每章约4500字，共约117万字），其中几章埋下带专有名词的伏笔句，统计：
+- 第一次查询前建立索引的耗时和索引规模；
+- 按大纲概要和人物查询的耗时，以及埋下伏笔的章节是否排在结果中；
+- 保存一章后增量更新索引的耗时，以及只改动一章时sync()的耗时。
+
+运行：python benchmark_search.py
+"""
+import os
+import random
+import tempfile
+import time
+
+from benchmark_history import new_chapter
+from novel_io import close_write_queue
+from novel_project import record_chapter_write
+from novel_search import get_search_index, related_passages
+
+CHAPTERS = 260
+QUERIES = 200
+# (埋下伏笔的章节, 伏笔句, 查询用的大纲概要)
+CLUES = [
+    (12, "林晚在青石巷的旧书摊上买到一枚刻着梅花的铜钥匙。", "第{n}章：林晚用梅花铜钥匙打开了老宅的暗格"),
+    (57, "顾沉舟在码头仓库见到了左手缺一根手指的账房先生。", "第{n}章：缺指的账房先生再次出现在码头"),
+    (143, "苏婉把那封没有署名的信藏进了祠堂的香炉底下。", "第{n}章：祠堂香炉下的匿名信被人发现"),
+]
+
+
+def main():
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as path:
+        total = 0
+        for chapter in range(1, CHAPTERS + 1):
+            text = f"第{chapter}章：标题\n" + new_chapter(rng)
+            for clue_chapter, clue, _ in CLUES:
+                if chapter == clue_chapter:
+                    lines = text.split("\n")
+                    lines.insert(len(lines) // 2, clue)
+                    text = "\n".join(lines)
+            total += len(text)
+            with open(os.path.join(path, f"第{chapter}章.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+        print(f"章节数: {CHAPTERS}, 正文总字数: {total / 10000:.0f}万")
+
+        start = time.perf_counter()
+        search_index = get_search_index(path)
+        stats = search_index.stats()
+        print(f"建立索引: {(time.perf_counter() - start) * 1000:.0f} ms, 片段 {stats['passages']} 个, "
+              f"检索词 {stats['terms']} 个")
+
+        chapter = CHAPTERS + 1
+        for clue_chapter, _, entry in CLUES:
+            outline = entry.format(n=chapter)
+            start = time.perf_counter()
+            for _ in range(QUERIES):
+                context = related_passages(path, chapter, outline, ("林晚", "顾沉舟"))
+            elapsed = (time.perf_counter() - start) / QUERIES
+            found = f"第{clue_chapter}章：" in context
+            print(f"查询\"{outline}\": {elapsed * 1000:.2f} ms/次（含sync），"
+                  f"第{clue_chapter}章的伏笔{'在' if found else '不在'}结果中")
+
+        start = time.perf_counter()
+        for _ in range(QUERIES):
+            search_index.search("林晚顾沉舟", before=chapter - 1)
+        print(f"只查人物名（常见词被跳过）: {(time.perf_counter() - start) / QUERIES * 1000:.2f} ms/次")
+
+        new_text = f"第{chapter}章：标题\n" + new_chapter(rng)
+        chapter_path = os.path.join(path, f"第{chapter}章.txt")
+        with open(chapter_path, "w", encoding="utf-8") as f:
+            f.write(new_text)
+        start = time.perf_counter()
+        record_chapter_write(chapter_path, new_text)
+        print(f"保存一章后增量更新索引: {(time.perf_counter() - start) * 1000:.1f} ms")
+        start = time.perf_counter()
+        get_search_index(path)
+        print(f"随后的sync（只有1章改动）: {(time.perf_counter() - start) * 1000:.1f} ms")
+    close_write_queue()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""故事记忆上下文测试
+
+在临时目录中生成300章（每章约4500字），模拟逐章生成时为第N章构建前文上下文：
+- 原来的方式：上一章最后1000字，只覆盖1章；
+- 故事记忆：前情提要、最近章节概要和上一章结尾，统计上下文的token数和覆盖的章节数。
+同时统计第一次构建（需要为已有的章节补摘要）和之后每次构建的耗时。
+
+运行：python benchmark_story_memory.py
+"""
+import os
+import random
+import re
+import tempfile
+import time
+
+from benchmark_history import new_chapter
+from novel_memory import build_story_context, close_story_memories, estimate_tokens
+from novel_perf import perf
+
+CHAPTERS = 300
+
+
+def covered_chapters(context, chapter):
+    """上下文中涉及的章节数（前情提要按章节范围计）"""
+    covered = set()
+    for first, last in re.findall(r'第(\d+)(?:-(\d+))?章', context):
+        covered.update(range(int(first), int(last or first) + 1))
+    return len([c for c in covered if c < chapter])
+
+
+def main():
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as path:
+        texts = {}
+        for chapter in range(1, CHAPTERS + 1):
+            texts[chapter] = f"第{chapter}章：标题\n" + new_chapter(rng)
+            with open(os.path.join(path, f"第{chapter}章.txt"), "w", encoding="utf-8") as f:
+                f.write(texts[chapter])
+
+        start = time.perf_counter()
+        build_story_context(path, CHAPTERS)
+        print(f"第一次构建（为{CHAPTERS - 1}章补摘要）: {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"生成摘要 {perf.get('story_memory_summaries')} 次")
+
+        print(f"{'章节':>6} {'原来token':>10} {'原来覆盖':>8} {'记忆token':>10} {'记忆覆盖':>8} {'耗时':>8}")
+        for chapter in (2, 10, 50, 100, 200, 300):
+            old = texts[chapter - 1][-1000:]
+            start = time.perf_counter()
+            context = build_story_context(path, chapter, texts[chapter - 1])
+            elapsed = time.perf_counter() - start
+            print(f"{chapter:>6} {estimate_tokens(old):>10} {1:>8} {estimate_tokens(context):>10} "
+                  f"{covered_chapters(context, chapter):>8} {elapsed * 1000:>6.1f}ms")
+        close_story_memories()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""流式解码器性能测试
+
+对比两种处理流式响应的方式在相同字节块序列上的吞吐量（字节/秒）：
+- 逐行方式：原来的response.iter_lines() + 整行decode + json.loads
+- 增量解码器：novel_stream.StreamDecoder直接处理原始字节块
+
+运行：python benchmark_stream_decoder.py [事件数]
+"""
+import json
+import random
+import sys
+import time
+
+from novel_stream import StreamDecoder
+
+SAMPLE_TOKENS = ["林风", "缓缓", "抬起头，", "望向", "远处的", "山峦。", "“你终于来了。”", "她轻声说道，", "\n\n", "风吹过", "竹林"]
+
+
+def build_stream(stream_format, events):
+    """生成模拟的服务商流式响应字节，返回(字节, 期望的完整文本)"""
+    rng = random.Random(42)
+    tokens = [rng.choice(SAMPLE_TOKENS) for _ in range(events)]
+    parts = []
+    for token in tokens:
+        if stream_format == "sse":
+            event = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1700000000,
+                     "model": "Qwen/Qwen2.5-7B-Instruct",
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            parts.append(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        else:
+            event = {"model": "qwen2.5:7b", "created_at": "2024-01-01T00:00:00.000000Z",
+                     "response": token, "done": False}
+            parts.append(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+    if stream_format == "sse":
+        parts.append(b"data: [DONE]\n\n")
+    else:
+        parts.append(json.dumps({"model": "qwen2.5:7b", "response": "", "done": True,
+                                 "context": list(range(2000))}).encode("utf-8") + b"\n")
+    return b"".join(parts), "".join(tokens)
+
+
+def split_chunks(data, seed=7):
+    """按网络收包的大小（几十字节到几KB不等）切分字节流"""
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        size = rng.choice((64, 200, 512, 1400, 4096))
+        chunks.append(data[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def iter_lines(chunks):
+    """与requests.Response.iter_lines相同的分行逻辑"""
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def legacy_decode(chunks, stream_format):
+    """原来ApiCallThread中的逐行解析方式"""
+    output = []
+    for line in iter_lines(chunks):
+        if not line:
+            continue
+        if stream_format == "sse":
+            line_str = line.decode('utf-8')
+            if line_str.startswith("data: "):
+                line_str = line_str[6:]
+            if line_str == "[DONE]":
+                break
+            try:
+                chunk = json.loads(line_str)
+                if 'choices' in chunk and len(chunk['choices']) > 0:
+                    choice = chunk['choices'][0]
+                    if 'delta' in choice and 'content' in choice['delta']:
+                        content = choice['delta']['content']
+                        if content is not None:
+                            output.append(content)
+            except json.JSONDecodeError:
+                pass
+        else:
+            try:
+                chunk = json.loads(line.decode('utf-8'))
+                if 'response' in chunk and chunk['response'] is not None:
+                    output.append(chunk['response'])
+            except json.JSONDecodeError:
+                pass
+    return "".join(output)
+
+
+def decoder_decode(chunks, stream_format):
+    """增量解码器方式"""
+    decoder = StreamDecoder(stream_format)
+    output = []
+    for data in chunks:
+        output.extend(decoder.feed(data))
+        if decoder.done:
+            break
+    output.extend(decoder.close())
+    return "".join(output)
+
+
+def measure(func, chunks, stream_format, total_bytes, rounds=5):
+    """取多轮中最快的一次，返回(字节/秒, 解析结果)"""
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(chunks, stream_format)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return total_bytes / best, result
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"事件数: {events}")
+    for stream_format in ("sse", "ndjson"):
+        data, expected = build_stream(stream_format, events)
+        chunks = split_chunks(data)
+        legacy_speed, legacy_text = measure(legacy_decode, chunks, stream_format, len(data))
+        decoder_speed, decoder_text = measure(decoder_decode, chunks, stream_format, len(data))
+        assert legacy_text == expected, "逐行方式解析结果不一致"
+        assert decoder_text == expected, "增量解码器解析结果不一致"
+        print(f"[{stream_format}] 数据量: {len(data) / 1024:.0f}KB, 字节块: {len(chunks)}")
+        print(f"  逐行方式:   {legacy_speed / 1024 / 1024:8.1f} MB/s")
+        print(f"  增量解码器: {decoder_speed / 1024 / 1024:8.1f} MB/s  (提升 {decoder_speed / legacy_speed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""保存前分行性能测试
+
+对比format_text_for_save原来逐字符分行的方式和novel_text.wrap_text（正则），
+测试1万字和10万字的模拟章节，以及对已经分好行的文本再分一次。
+两种方式对不含换行、标点后没有右引号的文本输出完全相同，这里同时做校验。
+
+运行：python benchmark_wrap.py
+"""
+import random
+import time
+
+from novel_text import wrap_text
+
+WORDS = ["他", "她", "说", "看着", "窗外", "的", "了", "雨", "没有", "回答", "慢慢地", "走进", "院子",
+         "心里", "有些", "不安", "远处", "传来", "钟声", "，", "，", "，"]
+ENDINGS = "。。。！？"
+
+
+def legacy_wrap(text):
+    """原来format_text_for_save中的分行循环"""
+    formatted_lines = []
+    current_line = []
+    current_length = 0
+    line_limit = 30
+    for char in text:
+        current_line.append(char)
+        current_length += 1
+        if char in '。！？' or current_length >= line_limit:
+            formatted_lines.append(''.join(current_line))
+            current_line = []
+            current_length = 0
+    if current_line:
+        formatted_lines.append(''.join(current_line))
+    return "\n".join(formatted_lines)
+
+
+def build_text(target_chars, seed=42):
+    """生成不含换行的模拟章节"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < target_chars:
+        sentence = "".join(rng.choice(WORDS) for _ in range(rng.randint(3, 25))) + rng.choice(ENDINGS)
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def measure(func, text, rounds=5):
+    """取多轮中最快的一次，返回(秒, 结果)"""
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    for target_chars in (10000, 100000):
+        text = build_text(target_chars)
+        legacy_seconds, legacy_result = measure(legacy_wrap, text)
+        seconds, result = measure(wrap_text, text)
+        again_seconds, again = measure(wrap_text, result)
+        print(f"[{len(text)}字]")
+        print(f"  原来的方式        {legacy_seconds * 1000:8.2f} ms")
+        print(f"  wrap_text        {seconds * 1000:8.2f} ms  (提升 {legacy_seconds / seconds:.1f}x), "
+              f"输出{'相同' if result == legacy_result else '不同'}")
+        print(f"  再次分行          {again_seconds * 1000:8.2f} ms  结果{'不变' if again == result else '改变'}")
+
+
+if __name__ == "__main__":
+    main()
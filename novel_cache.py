@@ -0,0 +1,121 @@
+"""按内容哈希缓存的处理结果和写盘状态
+
+自动保存每次都会对整章做去重、分行，再把结果写回文件。内容没有变化时这些都是重复劳动：
+- processed()按“产物+处理步骤”记住上次输入的哈希和处理结果，输入不变直接返回结果；
+- write_text()记住每个文件上次写入内容的哈希和写入后的文件状态，内容相同且文件没有被
+  其他程序改动时跳过写盘；需要写盘时交给novel_io的后台写盘队列（临时文件替换）。
+
+命中/未命中次数累加到novel_perf的计数器（content_cache_*），也可以通过stats()查看。
+"""
+import hashlib
+import os
+import threading
+
+from novel_io import get_write_queue
+from novel_perf import perf
+
+_PENDING = "pending"  # 已提交给写盘队列、还没有写完
+
+
+def content_hash(text):
+    """文本内容的哈希，用于判断内容是否变化"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def _file_state(path):
+    """文件的(大小, 修改时间)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ContentCache:
+    """按产物记录处理结果和磁盘内容哈希，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processed = {}  # (产物, 处理步骤) -> (输入哈希, 处理结果)
+        self._written = {}  # 规范化的文件路径 -> (内容哈希, 写入后的文件状态或_PENDING)
+        self._stats = {"process_hits": 0, "process_misses": 0, "write_skips": 0, "writes": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        perf.incr("content_cache_" + name)
+
+    def processed(self, artifact, step, content, func):
+        """返回func(content)，同一产物同一步骤的输入与上次相同时直接返回上次的结果"""
+        digest = content_hash(content)
+        key = (artifact, step)
+        with self._lock:
+            cached = self._processed.get(key)
+        if cached is not None and cached[0] == digest:
+            self._count("process_hits")
+            return cached[1]
+        self._count("process_misses")
+        result = func(content)
+        with self._lock:
+            self._processed[key] = (digest, result)
+        return result
+
+    def is_current(self, path, text):
+        """文件内容是否就是text（上次由本缓存写入，之后没有被改动）"""
+        path = os.path.normpath(os.path.abspath(path))
+        with self._lock:
+            written = self._written.get(path)
+        if written is None or written[0] != content_hash(text):
+            return False
+        return written[1] == _PENDING or written[1] == _file_state(path)
+
+    def remember(self, path, text):
+        """记录text已经写入path，供外部自行写文件后调用"""
+        path = os.path.normpath(os.path.abspath(path))
+        state = _file_state(path)
+        with self._lock:
+            self._written[path] = (content_hash(text), state)
+
+    def write_text(self, path, text, fsync=False, on_done=None):
+        """内容变化时才提交给写盘队列，返回是否提交了写入
+
+        on_done(error)与写盘队列的回调相同，只在提交了写入时调用。
+        """
+        if self.is_current(path, text):
+            self._count("write_skips")
+            return False
+        key = os.path.normpath(os.path.abspath(path))
+        digest = content_hash(text)
+        with self._lock:
+            self._written[key] = (digest, _PENDING)
+
+        def on_written(error):
+            with self._lock:
+                if self._written.get(key) == (digest, _PENDING):  # 之后没有再提交别的内容
+                    if error is None:
+                        self._written[key] = (digest, _file_state(key))
+                    else:
+                        self._written.pop(key, None)
+            if on_done is not None:
+                on_done(error)
+
+        get_write_queue().write(path, text, fsync=fsync, on_done=on_written)
+        self._count("writes")
+        return True
+
+    def forget(self, path=None):
+        """丢弃某个文件（不指定时为全部）的写盘记录，下次写入时不再跳过"""
+        with self._lock:
+            if path is None:
+                self._written.clear()
+            else:
+                self._written.pop(os.path.normpath(os.path.abspath(path)), None)
+
+    def stats(self):
+        """返回命中/未命中计数的副本"""
+        with self._lock:
+            return dict(self._stats)
+
+
+# 进程级共享实例
+content_cache = ContentCache()
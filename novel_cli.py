@@ -0,0 +1,474 @@
+"""命令行批量生成（不需要图形界面）
+
+读取novel_params.json（小说设定）、user_params.json（API配置、保存路径、字数范围）
+和已保存的大纲，在没有桌面环境的服务器上生成大纲、批量生成章节、批量润色章节，
+进度直接输出到标准输出。不导入PyQt5。
+
+用法：
+  python novel_cli.py outline                         生成大纲并保存到 保存目录/outlines/
+  python novel_cli.py chapters 1 20                   依次生成第1到20章（读取上一章结尾作为上下文）
+  python novel_cli.py chapters 1 20 --no-previous -j 4
+                                                      不读取上一章，最多同时生成4章
+  python novel_cli.py polish 1 20 --preset 综合全面优化  润色第1到20章，保存为 第X章新.txt
+  python novel_cli.py store import                    把保存目录中的章节、大纲和参数文件导入项目数据库
+  python novel_cli.py store stats | list | search 关键词 | export 目录
+
+批量生成的进度记录在保存目录下的batch_jobs.db中，与界面共用：
+中断后再次运行相同的章节范围会跳过已完成的章节继续生成。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from novel_http import get_session, build_provider_request, DEFAULT_BATCH_CONCURRENCY
+from novel_stream import StreamDecoder, StreamTextBuffer
+from novel_engine import ENGINE_AVAILABLE, get_engine, shutdown_engine
+from novel_io import atomic_write_text
+from novel_jobs import get_job_store, close_job_stores
+from novel_project import (load_user_settings, load_novel_settings, outline_file_path, find_latest_outline,
+                           chapter_file_name, find_chapter_file, record_chapter_write, remove_novel_title_from_content)
+from novel_history import get_chapter_history, close_chapter_histories, KIND_GENERATE, KIND_POLISH
+from novel_store import PROJECT_DB_NAME, get_project_store, close_project_stores, import_layout, export_layout
+from novel_memory import build_story_context, close_story_memories
+from novel_search import related_passages
+from novel_perf import perf
+from novel_ollama import get_ollama_session, ollama_request_fields, start_ollama_request
+from novel_prompts import (POLISH_PRESETS, build_outline_prompt, build_chapter_prompt, build_polish_prompt,
+                           prefix_report, prompt_prefix_stats)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROGRESS_INTERVAL = 2.0  # 生成过程中每隔几秒输出一次已收到的字数
+
+
+class GenerationError(Exception):
+    """一次生成请求失败，异常信息可直接输出给用户"""
+
+
+class ProgressPrinter:
+    """按章节输出生成进度，多个章节同时生成时共用一个输出锁"""
+
+    def __init__(self, stream_output=False):
+        self.stream_output = stream_output  # 逐字输出生成内容（只适合单个请求）
+        self._lock = threading.Lock()
+
+    def log(self, message):
+        with self._lock:
+            print(message, flush=True)
+
+    def delta_callback(self, label):
+        """返回给on_delta用的回调：定时输出已收到的字数，或直接输出生成内容"""
+        state = {"last": time.perf_counter(), "length": 0}
+
+        def on_delta(chunk, offset):
+            state["length"] = offset + len(chunk)
+            if self.stream_output:
+                with self._lock:
+                    sys.stdout.write(chunk)
+                    sys.stdout.flush()
+                return
+            now = time.perf_counter()
+            if now - state["last"] >= PROGRESS_INTERVAL:
+                state["last"] = now
+                self.log(f"  {label} 已生成 {state['length']} 字")
+
+        return on_delta
+
+
+def generate_text(api, prompt, max_chapter_length=5000, on_delta=None):
+    """调用服务商生成一段内容，返回完整文本，失败时抛出GenerationError
+
+    安装了aiohttp时交给共享的异步生成引擎，否则用共享连接池同步读取流式响应。
+    """
+    try:
+        request = build_provider_request(api.api_type, api.api_url, api.api_key, api.model_name, prompt,
+                                         api.api_format, api.custom_headers, max_chapter_length,
+                                         **ollama_request_fields(api.api_type, api.api_url, api.model_name, prompt))
+    except ValueError as e:
+        raise GenerationError(str(e))
+    prompt_prefix_stats.record((api.api_type, api.api_url, api.model_name), prompt)
+    ollama_timer = start_ollama_request(api.api_type, api.api_url, api.model_name)
+    if ollama_timer is not None:
+        user_on_delta = on_delta
+
+        def on_delta(content, offset):
+            ollama_timer.first_token()
+            if user_on_delta:
+                user_on_delta(content, offset)
+
+    if ENGINE_AVAILABLE:
+        job = get_engine().submit(request, on_delta=on_delta)
+        try:
+            job.wait()
+        except KeyboardInterrupt:
+            job.cancel()
+            raise
+        if job.status != "success":
+            raise GenerationError(job.error_message or f"生成{job.status}")
+        return job.response_text
+
+    buffer = StreamTextBuffer()
+    session = get_session(request.url, request.api_type)
+    try:
+        with session.post(request.url, headers=request.headers, data=json.dumps(request.payload),
+                          stream=True, timeout=request.timeout) as response:
+            if response.status_code != 200:
+                raise GenerationError(f"API调用失败: {response.status_code} - 服务器暂时不可用或配置有误")
+            decoder = StreamDecoder(request.stream_format)
+            for data in response.iter_content(chunk_size=None):
+                for content in decoder.feed(data):
+                    offset = buffer.append(content)
+                    if on_delta:
+                        on_delta(content, offset)
+                if decoder.done:
+                    break
+            for content in decoder.close():
+                offset = buffer.append(content)
+                if on_delta:
+                    on_delta(content, offset)
+    except GenerationError:
+        raise
+    except Exception as e:
+        raise GenerationError(f"API调用出错: {str(e)}")
+    return buffer.getvalue()
+
+
+class NovelRunner:
+    """命令行下的大纲、章节、润色流程"""
+
+    def __init__(self, novel, settings, printer):
+        self.novel = novel
+        self.settings = settings
+        self.printer = printer
+        self.save_path = settings.save_path
+        self.title = novel.title
+
+    def load_outline(self):
+        """读取当前小说的大纲，没有时退回到最近保存的大纲"""
+        outline_file = outline_file_path(self.save_path, self.title)
+        if not os.path.exists(outline_file):
+            title, latest = find_latest_outline(self.save_path)
+            if latest is None:
+                raise GenerationError(f"未找到已保存的大纲，请先运行: python novel_cli.py outline")
+            self.printer.log(f"未找到《{self.title}》的大纲，使用最近保存的大纲: {latest}")
+            self.title = title
+            outline_file = latest
+        with open(outline_file, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def run_outline(self):
+        if not self.novel.background or not self.novel.plot:
+            raise GenerationError("novel_params.json中缺少小说背景（background）或核心剧情（plot）")
+        self.printer.log(f"正在生成《{self.title}》的大纲 ({self.settings.api.api_type} / {self.settings.api.model_name})")
+        prompt = build_outline_prompt(self.title, self.novel.background, self.novel.plot)
+        started = time.perf_counter()
+        outline = generate_text(self.settings.api, prompt, on_delta=self.printer.delta_callback("大纲"))
+        if not outline.strip():
+            raise GenerationError("大纲生成为空内容")
+        outline_file = outline_file_path(self.save_path, self.title)
+        os.makedirs(os.path.dirname(outline_file), exist_ok=True)
+        atomic_write_text(outline_file, outline, fsync=True)
+        self.printer.log(f"\n大纲已保存到: {outline_file} ({len(outline)} 字, 耗时 {time.perf_counter() - started:.1f} 秒)")
+
+    def run_chapters(self, start_chapter, end_chapter, read_previous=True, concurrency=1, overwrite=False):
+        outline = self.load_outline()
+        os.makedirs(self.save_path, exist_ok=True)
+        concurrency = 1 if read_previous else max(1, concurrency)
+
+        # 与界面共用任务表：相同章节范围的未完成任务直接继续
+        job_store = get_job_store(self.save_path)
+        batch = job_store.find_unfinished_batch(self.title)
+        if batch and batch["start_chapter"] == start_chapter and batch["end_chapter"] == end_chapter:
+            job_store.resume_batch(batch["id"])
+            batch_id = batch["id"]
+            self.printer.log(f"继续未完成的批量任务{batch_id}: {job_store.counts(batch_id)}")
+        else:
+            if batch:
+                job_store.finish_batch(batch["id"])
+            batch_id = job_store.create_batch(self.title, start_chapter, end_chapter, read_previous,
+                                              overwrite, concurrency)
+        skip_chapters = job_store.chapters_to_skip(batch_id)
+
+        total = end_chapter - start_chapter + 1
+        self.printer.log(f"批量生成《{self.title}》第{start_chapter}章到第{end_chapter}章，共{total}章，"
+                         f"同时生成: {concurrency} 章 ({self.settings.api.api_type} / {self.settings.api.model_name})")
+        counter = {"finished": 0, "generated": 0, "failed": 0}
+        counter_lock = threading.Lock()
+
+        def run_one(chapter):
+            result = self._generate_chapter(chapter, outline, read_previous, overwrite,
+                                            skip_chapters, job_store, batch_id)
+            with counter_lock:
+                counter["finished"] += 1
+                if result in counter:
+                    counter[result] += 1
+                finished = counter["finished"]
+            self.printer.log(f"[{finished}/{total}] 第{chapter}章 {result}")
+
+        chapters = range(start_chapter, end_chapter + 1)
+        ollama_session = None
+        if self.settings.api.api_type == "Ollama":
+            # 先加载模型，批量生成期间保持加载
+            ollama_session = get_ollama_session(self.settings.api.api_url, self.settings.api.model_name)
+            ollama_session.begin_batch(wait=True)
+        started = time.perf_counter()
+        perf_start = perf.snapshot()
+        try:
+            if concurrency == 1:
+                for chapter in chapters:
+                    run_one(chapter)
+            else:
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    for future in as_completed([executor.submit(run_one, chapter) for chapter in chapters]):
+                        future.result()
+        finally:
+            if ollama_session is not None:
+                report = ollama_session.end_batch(wait=True)
+                if report:
+                    self.printer.log(f"Ollama: {report}")
+
+        job_store.finish_batch(batch_id)
+        self.printer.log(f"批量生成完成: 新生成 {counter['generated']} 章，失败 {counter['failed']} 章，"
+                         f"耗时 {time.perf_counter() - started:.1f} 秒")
+        report = prefix_report(perf_start)
+        if report:
+            self.printer.log(f"提示词前缀: {report}")
+        return counter["failed"] == 0
+
+    def _generate_chapter(self, chapter, outline, read_previous, overwrite, skip_chapters, job_store, batch_id):
+        """生成并保存一章，返回结果：generated、skipped、failed"""
+        if chapter in skip_chapters:
+            return "skipped"
+
+        file_path = find_chapter_file(self.save_path, chapter, self.title)
+        # 命令行下无法询问，"询问"模式按跳过处理，需要覆盖时加--overwrite
+        if file_path and not overwrite and self.settings.file_behavior != "覆盖":
+            job_store.mark_done(batch_id, chapter)
+            return "skipped"
+
+        previous_chapter_content = ""
+        story_context = ""
+        if read_previous and chapter > 1:
+            prev_file_path = find_chapter_file(self.save_path, chapter - 1, self.title)
+            if prev_file_path:
+                with open(prev_file_path, "r", encoding="utf-8") as f:
+                    previous_chapter_content = f.read()
+            # 故事记忆：前情提要、最近章节概要和上一章结尾，总长有预算上限
+            story_context = build_story_context(self.save_path, chapter, previous_chapter_content or None)
+            # 按本章大纲概要和主角名从更早的章节中检索相关片段
+            passages = related_passages(self.save_path, chapter, outline,
+                                        (self.novel.hero_name, self.novel.heroine_name))
+            if passages:
+                story_context = f"{passages}\n\n{story_context}" if story_context else passages
+
+        target_length = random.randint(self.settings.min_chapter_length, self.settings.max_chapter_length)
+        prompt = build_chapter_prompt(self.title, chapter, outline, self.novel.hero_name, self.novel.heroine_name,
+                                      self.novel.pov, self.novel.language, self.novel.rhythm,
+                                      target_length, previous_chapter_content, story_context)
+        self.printer.log(f"开始生成第{chapter}章，目标字数: {target_length}字")
+        job_store.mark_in_flight(batch_id, chapter)
+        started = time.perf_counter()
+        try:
+            content = generate_text(self.settings.api, prompt, self.settings.max_chapter_length,
+                                    on_delta=self.printer.delta_callback(f"第{chapter}章"))
+            if not content.strip():
+                raise GenerationError("生成为空内容")
+        except GenerationError as e:
+            self.printer.log(f"生成第{chapter}章时出错: {e}")
+            job_store.mark_failed(batch_id, chapter, str(e))
+            return "failed"
+
+        chapter_file = os.path.join(self.save_path, chapter_file_name(chapter))
+        # 先落盘再记录完成，中途崩溃时不会把没写完的章节当作已完成
+        chapter_text = remove_novel_title_from_content(content, self.title)
+        # 覆盖前记录版本历史（第一次记录时先保存文件现有的内容）
+        get_chapter_history(self.save_path).record(chapter, chapter_text, KIND_GENERATE, existing_path=chapter_file)
+        atomic_write_text(chapter_file, chapter_text, fsync=True)
+        record_chapter_write(chapter_file, chapter_text)
+        job_store.mark_done(batch_id, chapter)
+        store = get_project_store(self.save_path)
+        if store is not None:
+            store.record_generation(chapter, "chapter", self.settings.api.api_type, self.settings.api.model_name,
+                                    time.perf_counter() - started, len(chapter_text))
+        self.printer.log(f"第{chapter}章已保存到: {chapter_file} ({len(content)} 字)")
+        return "generated"
+
+    def run_polish(self, start_chapter, end_chapter, requirements, concurrency=1):
+        total = end_chapter - start_chapter + 1
+        self.printer.log(f"润色第{start_chapter}章到第{end_chapter}章，共{total}章")
+        failed = []
+
+        def polish_one(chapter):
+            file_path = find_chapter_file(self.save_path, chapter, self.title)
+            if not file_path:
+                self.printer.log(f"未找到第{chapter}章文件，跳过")
+                return
+            with open(file_path, "r", encoding="utf-8") as f:
+                chapter_content = f.read()
+            prompt = build_polish_prompt(chapter_content, requirements)
+            try:
+                polished = generate_text(self.settings.api, prompt, self.settings.max_chapter_length,
+                                         on_delta=self.printer.delta_callback(f"润色第{chapter}章"))
+                if not polished.strip():
+                    raise GenerationError("润色结果为空")
+            except GenerationError as e:
+                self.printer.log(f"润色第{chapter}章时出错: {e}")
+                failed.append(chapter)
+                return
+            # 与界面一致：保存为新文件 第X章新.txt，不覆盖原章节
+            new_file_path = os.path.join(os.path.dirname(file_path),
+                                         os.path.basename(file_path).replace("章.txt", "章新.txt"))
+            # 记为原章节的旁支版本，注明实际保存的文件
+            get_chapter_history(os.path.dirname(file_path)).record(
+                chapter, polished, KIND_POLISH, existing_path=file_path,
+                note=f"保存为{os.path.basename(new_file_path)}")
+            atomic_write_text(new_file_path, polished, fsync=True)
+            self.printer.log(f"第{chapter}章润色完成，已保存到: {new_file_path}")
+
+        chapters = range(start_chapter, end_chapter + 1)
+        if concurrency <= 1:
+            for chapter in chapters:
+                polish_one(chapter)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in as_completed([executor.submit(polish_one, chapter) for chapter in chapters]):
+                    future.result()
+        self.printer.log(f"润色完成，失败 {len(failed)} 章" + (f": {sorted(failed)}" if failed else ""))
+        return not failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="小说生成助手命令行批量生成（不需要图形界面）")
+    parser.add_argument("--novel-params", default="novel_params.json", help="小说设定文件，默认当前目录的novel_params.json")
+    parser.add_argument("--user-params", default=os.path.join(SCRIPT_DIR, "user_params.json"),
+                        help="API配置文件，默认与本脚本同目录的user_params.json")
+    parser.add_argument("--save-path", help="保存目录，默认使用user_params.json中的save_path")
+    parser.add_argument("--api-type", help="使用user_params.json中保存的其他服务商配置，如Ollama、SiliconFlow")
+    parser.add_argument("--model", help="覆盖配置中的模型名称")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    outline_parser = subparsers.add_parser("outline", help="生成小说大纲")
+    outline_parser.add_argument("--stream", action="store_true", help="逐字输出生成内容")
+
+    chapters_parser = subparsers.add_parser("chapters", help="批量生成章节")
+    chapters_parser.add_argument("start", type=int, help="起始章节")
+    chapters_parser.add_argument("end", type=int, help="结束章节")
+    chapters_parser.add_argument("--no-previous", action="store_true", help="不读取上一章内容，各章可以同时生成")
+    chapters_parser.add_argument("-j", "--concurrency", type=int, help="不读取上一章时同时生成的章节数")
+    chapters_parser.add_argument("--overwrite", action="store_true", help="覆盖已存在的章节")
+
+    polish_parser = subparsers.add_parser("polish", help="批量润色章节")
+    polish_parser.add_argument("start", type=int, help="起始章节")
+    polish_parser.add_argument("end", type=int, help="结束章节")
+    polish_parser.add_argument("--preset", choices=[name for name, _ in POLISH_PRESETS], default="综合全面优化",
+                               help="预设润色要求")
+    polish_parser.add_argument("--requirements", help="自定义润色要求，优先于--preset")
+    polish_parser.add_argument("-j", "--concurrency", type=int, default=1, help="同时润色的章节数")
+
+    store_parser = subparsers.add_parser("store", help=f"项目数据库（保存目录/{PROJECT_DB_NAME}）")
+    store_parser.add_argument("action", choices=["import", "export", "stats", "list", "search"],
+                              help="import: 从文本目录导入；export: 导出为文本目录；stats: 统计；list: 列出章节；search: 搜索正文")
+    store_parser.add_argument("argument", nargs="?", help="search的关键词，或export的目标目录（默认导出到保存目录）")
+    return parser
+
+
+def run_store(args, settings):
+    """项目数据库的导入、导出和查询"""
+    save_path = settings.save_path
+    if args.action == "import":
+        store = get_project_store(save_path, create=True)
+        started = time.perf_counter()
+        params_files = [args.novel_params, args.user_params] + [
+            f"custom_{name}_models.json" for name in ("ollama", "siliconflow", "modelscope")]
+        counts = import_layout(store, save_path, params_files)
+        print(f"已导入到 {store.db_path}: {counts['chapters']} 章, {counts['outlines']} 个大纲, "
+              f"{counts['params']} 个参数文件 (耗时 {time.perf_counter() - started:.1f} 秒)")
+        return True
+
+    store = get_project_store(save_path)
+    if store is None:
+        print(f"保存目录中没有项目数据库，请先运行: python novel_cli.py store import")
+        return False
+    if args.action == "export":
+        target = args.argument or save_path
+        counts = export_layout(store, target, params_dir=target if args.argument else None)
+        print(f"已导出到 {target}: {counts['chapters']} 章, {counts['outlines']} 个大纲, {counts['params']} 个参数文件")
+    elif args.action == "stats":
+        stats = store.stats()
+        if not stats["chapters"]:
+            print("项目数据库中还没有章节")
+        else:
+            print(f"章节: {stats['chapters']} 章 (第{stats['first_chapter']}章到第{stats['last_chapter']}章), "
+                  f"总字数: {stats['words']}, 平均每章: {stats['average_words']} 字, 大纲: {stats['outlines']} 个")
+    elif args.action == "list":
+        for item in store.list_chapters():
+            print(f"第{item['chapter']}章  {item['word_count']:6d} 字  {item['title']}")
+    else:
+        if not args.argument:
+            print("请指定搜索关键词")
+            return False
+        results = store.search(args.argument)
+        for chapter, title, snippet in results:
+            print(f"第{chapter}章 {title}: {snippet}")
+        print(f"找到 {len(results)} 章")
+    return True
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    settings = load_user_settings(args.user_params)
+    novel = load_novel_settings(args.novel_params)
+    try:
+        if args.api_type:
+            settings.use_api(args.api_type)
+    except ValueError as e:
+        print(e)
+        return 2
+    if args.model:
+        settings.api.model_name = args.model
+    if args.save_path:
+        settings.save_path = args.save_path
+
+    if args.command in ("chapters", "polish") and args.start > args.end:
+        print("起始章节不能大于结束章节")
+        return 2
+
+    printer = ProgressPrinter(stream_output=getattr(args, "stream", False))
+    runner = NovelRunner(novel, settings, printer)
+    try:
+        if args.command == "store":
+            ok = run_store(args, settings)
+        elif args.command == "outline":
+            runner.run_outline()
+            ok = True
+        elif args.command == "chapters":
+            concurrency = args.concurrency
+            if concurrency is None:
+                concurrency = settings.batch_concurrency.get(
+                    settings.api.api_type, DEFAULT_BATCH_CONCURRENCY.get(settings.api.api_type, 1))
+            ok = runner.run_chapters(args.start, args.end, read_previous=not args.no_previous,
+                                     concurrency=concurrency, overwrite=args.overwrite)
+        else:
+            requirements = args.requirements or dict(POLISH_PRESETS)[args.preset]
+            ok = runner.run_polish(args.start, args.end, requirements, args.concurrency)
+    except GenerationError as e:
+        print(f"生成失败: {e}")
+        ok = False
+    except KeyboardInterrupt:
+        print("\n已中断，再次运行相同的命令可从中断处继续")
+        ok = False
+    finally:
+        shutdown_engine()
+        close_job_stores()
+        close_project_stores()
+        close_chapter_histories()
+        close_story_memories()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
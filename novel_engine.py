@@ -0,0 +1,309 @@
+"""异步流式生成引擎
+
+所有生成请求在同一个后台asyncio事件循环线程中并发执行，
+不再为每次API调用单独创建线程；流式内容通过回调交给调用方
+（界面通过AsyncApiCall桥接成Qt信号，命令行直接打印）。
+
+连接按服务商地址（scheme://host:port）复用，并发连接数受PROVIDER_POOL_LIMITS限制，
+超出上限的请求在引擎内部排队。连接统计记在novel_http.session_pool中，与同步请求合并。
+
+依赖aiohttp；未安装时ENGINE_AVAILABLE为False，调用方应退回到ApiCallThread。
+"""
+import asyncio
+import json
+import threading
+import time
+import traceback
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp是可选依赖
+    aiohttp = None
+
+from novel_http import PROVIDER_POOL_LIMITS, DEFAULT_POOL_SIZE, ProviderSessionPool, session_pool
+from novel_stream import StreamDecoder, StreamTextBuffer
+
+ENGINE_AVAILABLE = aiohttp is not None
+
+TIMEOUT_ERROR_MSG = "API调用超时，可能是网络连接不稳定或服务器响应较慢。请检查网络连接或减小生成长度。"
+CONNECTION_ERROR_MSG = "网络连接失败，请检查网络是否正常"
+
+
+class GenerationJob:
+    """引擎中的一个生成任务
+
+    回调都在引擎线程中调用：
+    on_delta(chunk, offset) 每收到一段内容调用一次；
+    on_error(error_msg) 出错时调用；
+    on_done(response_text, status) 结束时必定调用一次，status为success/error/cancelled。
+    """
+
+    def __init__(self, request, on_delta=None, on_done=None, on_error=None):
+        self.request = request
+        self.on_delta = on_delta
+        self.on_done = on_done
+        self.on_error = on_error
+        self.buffer = StreamTextBuffer()  # 已收到的内容
+        self.status = None
+        self.error_message = None
+        self.cancelled = False
+        self.started_at = None
+        self.first_token_at = None
+        self._task = None
+        self._engine = None
+        self._done_event = threading.Event()
+
+    @property
+    def response_text(self):
+        return self.buffer.getvalue()
+
+    @property
+    def length(self):
+        """已收到的总字符数"""
+        return len(self.buffer)
+
+    def cancel(self):
+        """取消任务，可在任意线程调用"""
+        self.cancelled = True
+        if self._engine is not None:
+            self._engine.cancel(self)
+
+    def wait(self, timeout=None):
+        """等待任务结束，返回是否已结束"""
+        return self._done_event.wait(timeout)
+
+    def is_done(self):
+        return self._done_event.is_set()
+
+    def _append(self, content):
+        offset = self.buffer.append(content)
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if self.on_delta:
+            self.on_delta(content, offset)
+
+    def _report_error(self, error_msg):
+        print(error_msg)
+        self.error_message = error_msg
+        if self.on_error:
+            self.on_error(error_msg)
+
+    def _finish(self, status):
+        if self._done_event.is_set():
+            return
+        self.status = status
+        try:
+            if self.on_done:
+                self.on_done(self.response_text, status)
+        finally:
+            self._done_event.set()
+
+
+class GenerationEngine:
+    """在单个后台事件循环线程中运行所有流式生成任务"""
+
+    def __init__(self, pool_limits=None, default_pool_size=DEFAULT_POOL_SIZE, connection_pool=None):
+        self.pool_limits = dict(PROVIDER_POOL_LIMITS if pool_limits is None else pool_limits)
+        self.default_pool_size = default_pool_size
+        self.connection_pool = session_pool if connection_pool is None else connection_pool  # 连接统计记在这里
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._sessions = {}  # 服务商地址 -> aiohttp.ClientSession（只在引擎线程中访问）
+        self._jobs = set()  # 进行中的任务
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动后台事件循环线程（已启动时直接返回）"""
+        with self._lock:
+            if self.is_running():
+                return
+            if aiohttp is None:
+                raise RuntimeError("未安装aiohttp，无法启动异步生成引擎")
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop, args=(ready,),
+                                            name="GenerationEngine", daemon=True)
+            self._thread.start()
+            ready.wait()
+            print("[生成引擎] 后台事件循环已启动")
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        try:
+            self._loop.run_forever()
+            # 退出前取消剩余任务并关闭连接
+            pending = [job._task for job in self._jobs if job._task is not None]
+            for task in pending:
+                task.cancel()
+            if pending:
+                self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.run_until_complete(self._close_sessions())
+        finally:
+            self._loop.close()
+
+    def submit(self, request, on_delta=None, on_done=None, on_error=None):
+        """提交一个ProviderRequest，立即返回GenerationJob"""
+        self.start()
+        job = GenerationJob(request, on_delta, on_done, on_error)
+        job._engine = self
+        self._loop.call_soon_threadsafe(self._start_job, job)
+        return job
+
+    def cancel(self, job):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._cancel_job, job)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _start_job(self, job):
+        if job.cancelled:
+            job._finish("cancelled")
+            return
+        self._jobs.add(job)
+        job._task = self._loop.create_task(self._run_job(job))
+
+    def _cancel_job(self, job):
+        if job._task is not None and not job._task.done():
+            job._task.cancel()
+
+    async def _run_job(self, job):
+        request = job.request
+        status = "success"
+        job.started_at = time.perf_counter()
+        try:
+            await self._stream(job)
+            if job.error_message:
+                status = "error"
+            elif job.cancelled:
+                status = "cancelled"
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except asyncio.TimeoutError:
+            status = "error"
+            job._report_error(TIMEOUT_ERROR_MSG)
+        except aiohttp.ClientConnectionError:
+            status = "error"
+            job._report_error(CONNECTION_ERROR_MSG)
+        except Exception as e:
+            status = "error"
+            print(f"异常堆栈: {traceback.format_exc()}")
+            job._report_error(f"API调用出错: {str(e)}")
+        finally:
+            self._jobs.discard(job)
+            elapsed = time.perf_counter() - job.started_at
+            print(f"[生成引擎] {request.api_type} 请求结束，状态: {status}, "
+                  f"长度: {job.length}, 耗时: {elapsed:.2f}秒, 进行中: {len(self._jobs)}")
+            job._finish(status)
+
+    async def _stream(self, job):
+        request = job.request
+        session = self._get_session(request)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=request.timeout,
+                                        sock_read=request.timeout)
+        async with session.post(request.url, headers=request.headers,
+                                data=json.dumps(request.payload), timeout=timeout) as response:
+            if response.status != 200:
+                error_msg = f"API调用失败: {response.status} - 服务器暂时不可用或配置有误"
+                body = await response.text(errors='replace')
+                try:
+                    error_detail = json.loads(body)
+                    if isinstance(error_detail, dict) and "error" in error_detail:
+                        error_msg += f" - {error_detail['error']}"
+                    elif isinstance(error_detail, dict) and "message" in error_detail:
+                        error_msg += f" - {error_detail['message']}"
+                except json.JSONDecodeError:
+                    if body:
+                        error_msg += f" - {body[:200]}"
+                job._report_error(error_msg)
+                return
+
+            decoder = StreamDecoder(request.stream_format)
+            async for data in response.content.iter_any():
+                if job.cancelled:
+                    return
+                for content in decoder.feed(data):
+                    job._append(content)
+                if decoder.done:
+                    return
+            for content in decoder.close():
+                job._append(content)
+
+    def _get_session(self, request):
+        """获取服务商地址对应的ClientSession（在引擎线程中调用）"""
+        key = ProviderSessionPool.base_url(request.url)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            limit = self.pool_limits.get(request.api_type, self.default_pool_size)
+            stats = self.connection_pool.connection_stats(request.url)
+            trace = aiohttp.TraceConfig()
+
+            async def on_request_start(session, ctx, params):
+                stats.record_request()
+
+            async def on_connection_create_start(session, ctx, params):
+                ctx.connect_started = time.perf_counter()
+
+            async def on_connection_create_end(session, ctx, params):
+                stats.record_connect(time.perf_counter() - ctx.connect_started)
+
+            trace.on_request_start.append(on_request_start)
+            trace.on_connection_create_start.append(on_connection_create_start)
+            trace.on_connection_create_end.append(on_connection_create_end)
+            connector = aiohttp.TCPConnector(limit=limit, keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+            self._sessions[key] = session
+            print(f"[生成引擎] 为 {key} 创建异步连接池，并发连接数上限: {limit}")
+        return session
+
+    async def _close_sessions(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    def stats(self, api_url=None):
+        """返回连接统计；指定api_url时只返回该服务商的统计"""
+        return self.connection_pool.stats(api_url)
+
+    def active_jobs(self):
+        return len(self._jobs)
+
+    def shutdown(self, timeout=5.0):
+        """停止事件循环，取消所有进行中的任务并关闭连接，程序退出时调用"""
+        with self._lock:
+            if not self.is_running():
+                return
+            loop = self._loop
+            thread = self._thread
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        print("[生成引擎] 后台事件循环已停止")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """获取进程级共享的生成引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = GenerationEngine()
+        return _engine
+
+
+def shutdown_engine():
+    """关闭共享引擎（未创建时什么也不做）"""
+    with _engine_lock:
+        engine = _engine
+    if engine is not None:
+        engine.shutdown()
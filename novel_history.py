@@ -0,0 +1,301 @@
+"""章节版本历史
+
+重新生成、润色或手动修改章节都会覆盖第X章.txt。这里把每一章的每个版本记录在
+章节所在目录的chapter_history.db（SQLite）中：
+- 与上一个版本大部分行相同时（手动修改、局部润色），只保存按行的差异（复制哪些行、插入哪些新行），
+  改一两个字的版本只需要几十字节；
+- 其他版本（重新生成）用zlib压缩，以上一个版本的正文作为预设字典（zdict），复用人名、常用语句；
+- 距上一个完整版本的差异累计超过完整压缩的DELTA_CHAIN_FACTOR倍（或已连续MAX_DELTA_CHAIN个差异）时，
+  保存一个不依赖其他版本的完整压缩，恢复任意版本要处理的数据量有上限，只需几毫秒；
+- 连续的手动修改（自动保存）在EDIT_MERGE_SECONDS内合并为一个版本，不会每5秒产生一个版本。
+
+第一次记录某一章时，如果章节文件已经存在，先把文件现有内容记为“原始”版本。
+润色结果保存为第X章新.txt，不覆盖章节文件，记为旁支版本（SIDE_KINDS）：它们有自己的版本号，
+但判断章节内容是否重复时跟章节文件的最新版本（head）比较，不跟旁支版本比较。
+"""
+import difflib
+import hashlib
+import json
+import time
+import zlib
+
+from novel_io import get_write_queue
+from novel_sqlite import SQLiteStore, StoreRegistry
+
+HISTORY_DB_NAME = "chapter_history.db"
+MAX_DELTA_CHAIN = 64  # 两个完整版本之间最多的差异版本数
+DELTA_CHAIN_FACTOR = 4  # 差异累计超过完整压缩大小的这么多倍时改存完整版本
+EDIT_MERGE_SECONDS = 300  # 这段时间内连续的手动修改合并为一个版本
+ZDICT_BYTES = 32768  # zlib预设字典的有效长度（窗口大小）
+
+# 版本数据的存储方式
+CODEC_FULL = 0  # 完整压缩（关键版本）
+CODEC_ZDICT = 1  # 以上一个版本为字典压缩
+CODEC_LINES = 2  # 相对上一个版本的按行差异
+
+KIND_ORIGINAL = "original"
+KIND_GENERATE = "generate"
+KIND_POLISH = "polish"
+KIND_EDIT = "edit"
+KIND_RESTORE = "restore"
+
+SIDE_KINDS = (KIND_POLISH,)  # 没有写入章节文件的版本，不作为章节的当前内容
+
+KIND_LABELS = {
+    KIND_ORIGINAL: "原始",
+    KIND_GENERATE: "生成",
+    KIND_POLISH: "润色",
+    KIND_EDIT: "手动修改",
+    KIND_RESTORE: "恢复",
+}
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _compress(text, base_text=None):
+    """压缩正文；给出base_text时以它为预设字典（取末尾的窗口大小）"""
+    if base_text is None:
+        compressor = zlib.compressobj(9)
+    else:
+        compressor = zlib.compressobj(9, zdict=base_text.encode('utf-8')[-ZDICT_BYTES:])
+    return compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+
+def _decompress(data, base_text=None):
+    if base_text is None:
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = zlib.decompressobj(zdict=base_text.encode('utf-8')[-ZDICT_BYTES:])
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+
+def _line_delta(text, base_text):
+    """按行差异：[[起始行, 结束行]（复制上一版本的这些行）或 "新行"]，压缩后返回"""
+    base_lines = base_text.split('\n')
+    lines = text.split('\n')
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        else:
+            ops.extend(lines[j1:j2])
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _apply_line_delta(data, base_text):
+    base_lines = base_text.split('\n')
+    lines = []
+    for op in json.loads(zlib.decompress(data).decode('utf-8')):
+        if isinstance(op, list):
+            lines.extend(base_lines[op[0]:op[1]])
+        else:
+            lines.append(op)
+    return '\n'.join(lines)
+
+
+def _encode(text, base_text):
+    """相对上一个版本编码，返回(存储方式, 数据)；base_text为None时完整压缩"""
+    if base_text is None:
+        return CODEC_FULL, _compress(text)
+    zdict_data = _compress(text, base_text)
+    delta_data = _line_delta(text, base_text)
+    if len(delta_data) < len(zdict_data):
+        return CODEC_LINES, delta_data
+    return CODEC_ZDICT, zdict_data
+
+
+def _encode_next(text, base_text, chain_length, chain_bytes):
+    """编码新版本：差异链过长或累计过大时改存完整版本"""
+    full = _compress(text)
+    if base_text is None or chain_length >= MAX_DELTA_CHAIN:
+        return CODEC_FULL, full
+    codec, data = _encode(text, base_text)
+    if chain_bytes + len(data) > DELTA_CHAIN_FACTOR * len(full):
+        return CODEC_FULL, full
+    return codec, data
+
+
+def _decode(codec, data, base_text):
+    if codec == CODEC_FULL:
+        return _decompress(data)
+    if codec == CODEC_ZDICT:
+        return _decompress(data, base_text)
+    return _apply_line_delta(data, base_text)
+
+
+class ChapterHistory(SQLiteStore):
+    """一个章节目录的版本历史（线程安全，生成线程和界面线程可同时使用）"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self._latest_cache = {}  # 章节号 -> (最新版本号, 正文)，压缩下一个版本时作为字典
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS versions (
+                    chapter INTEGER NOT NULL,
+                    version INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    codec INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    hash TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    note TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (chapter, version)
+                )
+            """)
+
+    def _latest_row(self, chapter):
+        return self._conn.execute(
+            "SELECT * FROM versions WHERE chapter = ? ORDER BY version DESC LIMIT 1", (chapter,)).fetchone()
+
+    def _delta_chain(self, chapter, version):
+        """version（含）之前最近的完整版本之后的差异版本数和总字节数；调用时须持有锁"""
+        row = self._conn.execute(
+            "SELECT COUNT(*) AS n, COALESCE(SUM(LENGTH(data)), 0) AS size FROM versions "
+            "WHERE chapter = ? AND version <= ? AND version > COALESCE("
+            "(SELECT MAX(version) FROM versions WHERE chapter = ? AND version <= ? AND codec = ?), 0)",
+            (chapter, version, chapter, version, CODEC_FULL)).fetchone()
+        return row["n"], row["size"]
+
+    def _text_at(self, chapter, version):
+        """从最近的完整版本开始依次解压到version；调用时须持有锁"""
+        cached = self._latest_cache.get(chapter)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        keyframe = self._conn.execute(
+            "SELECT version FROM versions WHERE chapter = ? AND version <= ? AND codec = ? "
+            "ORDER BY version DESC LIMIT 1", (chapter, version, CODEC_FULL)).fetchone()
+        if keyframe is None:
+            raise KeyError(f"第{chapter}章没有版本{version}")
+        text = None
+        for row in self._conn.execute(
+                "SELECT data, codec FROM versions WHERE chapter = ? AND version BETWEEN ? AND ? ORDER BY version",
+                (chapter, keyframe["version"], version)):
+            text = _decode(row["codec"], row["data"], text)
+        return text
+
+    def _head_row(self, chapter):
+        """章节文件对应的最新版本（跳过旁支版本）；调用时须持有锁"""
+        placeholders = ", ".join("?" * len(SIDE_KINDS))
+        return self._conn.execute(
+            f"SELECT * FROM versions WHERE chapter = ? AND kind NOT IN ({placeholders}) "
+            "ORDER BY version DESC LIMIT 1", (chapter,) + SIDE_KINDS).fetchone()
+
+    def _latest(self, chapter):
+        """最新版本的(行, 正文)，没有版本时返回(None, None)；调用时须持有锁"""
+        row = self._latest_row(chapter)
+        if row is None:
+            return None, None
+        cached = self._latest_cache.get(chapter)
+        if cached is None or cached[0] != row["version"]:
+            # 缓存过期（如另一个进程写入了新版本），解压后重新缓存
+            self._latest_cache.pop(chapter, None)
+            cached = self._latest_cache[chapter] = (row["version"], self._text_at(chapter, row["version"]))
+        return row, cached[1]
+
+    def record(self, chapter, text, kind, existing_path=None, note=None):
+        """记录一个新版本，返回版本号；与最新版本内容相同时不记录，返回None
+
+        existing_path为即将被覆盖的章节文件，这一章还没有历史时先把它的现有内容记为原始版本，
+        所以要在提交写入之前调用。
+        """
+        if existing_path and self.latest_version(chapter) is None and get_write_queue().exists(existing_path):
+            try:
+                original = get_write_queue().read_text(existing_path)
+            except OSError:
+                original = None
+            if original and original != text:
+                self._append(chapter, original, KIND_ORIGINAL, None)
+        return self._append(chapter, text, kind, note)
+
+    def _append(self, chapter, text, kind, note):
+        now = time.time()
+        digest = _digest(text)
+        with self._lock, self._conn:
+            latest, latest_text = self._latest(chapter)
+            if latest is not None and latest["hash"] == digest:
+                return None
+            if kind not in SIDE_KINDS and latest is not None and latest["kind"] in SIDE_KINDS:
+                # 最新的是旁支版本，章节文件的内容与它之前的版本比较
+                head = self._head_row(chapter)
+                if head is not None and head["hash"] == digest:
+                    return None
+            if (latest is not None and kind == KIND_EDIT and latest["kind"] == KIND_EDIT
+                    and now - latest["updated_at"] < EDIT_MERGE_SECONDS):
+                # 合并到上一次手动修改：以它之前的版本为字典重新压缩，保持原版本号
+                version = latest["version"]
+                if latest["codec"] == CODEC_FULL:
+                    codec, data = CODEC_FULL, _compress(text)
+                else:
+                    codec, data = _encode_next(text, self._text_at(chapter, version - 1),
+                                               *self._delta_chain(chapter, version - 1))
+                self._conn.execute(
+                    "UPDATE versions SET codec = ?, data = ?, hash = ?, length = ?, updated_at = ? "
+                    "WHERE chapter = ? AND version = ?",
+                    (codec, data, digest, len(text), now, chapter, version))
+            else:
+                version = latest["version"] + 1 if latest is not None else 1
+                if latest is None:
+                    codec, data = CODEC_FULL, _compress(text)
+                else:
+                    codec, data = _encode_next(text, latest_text, *self._delta_chain(chapter, latest["version"]))
+                self._conn.execute(
+                    "INSERT INTO versions (chapter, version, kind, codec, data, hash, length, note, "
+                    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (chapter, version, kind, codec, data, digest, len(text), note, now, now))
+            self._latest_cache[chapter] = (version, text)
+        return version
+
+    def versions(self, chapter):
+        """版本列表（不含正文）：[{version, kind, length, size, note, created_at, updated_at}]，按版本号排序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, kind, length, LENGTH(data) AS size, note, created_at, updated_at "
+                "FROM versions WHERE chapter = ? ORDER BY version", (chapter,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest_version(self, chapter):
+        with self._lock:
+            row = self._latest_row(chapter)
+        return row["version"] if row is not None else None
+
+    def text(self, chapter, version):
+        """某个版本的正文"""
+        with self._lock:
+            self._latest(chapter)
+            return self._text_at(chapter, version)
+
+    def storage_size(self, chapter=None):
+        """压缩后占用的字节数"""
+        sql = "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM versions"
+        args = ()
+        if chapter is not None:
+            sql += " WHERE chapter = ?"
+            args = (chapter,)
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()[0]
+
+    def compare(self, chapter, old_version, new_version):
+        """两个版本按行比较，返回difflib的差异操作[(tag, 旧行列表, 新行列表)]"""
+        old_lines = self.text(chapter, old_version).split('\n')
+        new_lines = self.text(chapter, new_version).split('\n')
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        return [(tag, old_lines[i1:i2], new_lines[j1:j2]) for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+
+
+_histories = StoreRegistry(HISTORY_DB_NAME, ChapterHistory)
+
+
+def get_chapter_history(chapter_dir):
+    """获取章节目录对应的版本历史，同一目录共用一个连接"""
+    return _histories.get(chapter_dir)
+
+
+def close_chapter_histories():
+    """关闭所有版本历史，程序退出时调用"""
+    _histories.close_all()
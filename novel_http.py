@@ -0,0 +1,280 @@
+"""进程级HTTP连接池
+
+所有服务商调用（生成、润色、测试连接）都通过这里取得requests.Session，
+同一个服务商地址（scheme://host:port）共用一个Session和keep-alive连接池，
+批量生成几百章时不必为每一章重新做TCP+TLS握手。
+"""
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from novel_perf import perf
+
+# 各服务商保持的keep-alive连接数上限，超出的并发请求会临时建连，用完即关闭
+PROVIDER_POOL_LIMITS = {
+    "Ollama": 4,
+    "SiliconFlow": 8,
+    "ModelScope": 8,
+    "自定义": 4,
+}
+DEFAULT_POOL_SIZE = 4
+
+# 批量生成时（不读取上一章内容）各服务商默认同时生成的章节数，可在批量生成界面按服务商修改
+DEFAULT_BATCH_CONCURRENCY = {
+    "Ollama": 1,  # 本地Ollama默认单槽位，开启OLLAMA_NUM_PARALLEL后可调大
+    "SiliconFlow": 4,
+    "ModelScope": 4,
+    "自定义": 2,
+}
+
+
+class ConnectionStats:
+    """单个服务商地址的连接统计，用于计算连接复用率和节省的握手时间"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0  # 发出的请求数
+        self.new_connections = 0  # 新建的连接数（每次都要握手）
+        self.handshake_seconds = 0.0  # 新建连接累计耗时
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.new_connections += 1
+            self.handshake_seconds += seconds
+
+    def snapshot(self):
+        """返回统计快照：请求数、新建连接数、复用率、平均握手耗时和估算节省的握手时间"""
+        with self._lock:
+            requests_count = self.requests
+            new_connections = self.new_connections
+            handshake_seconds = self.handshake_seconds
+        reused = max(0, requests_count - new_connections)
+        avg_handshake = handshake_seconds / new_connections if new_connections else 0.0
+        return {
+            "requests": requests_count,
+            "new_connections": new_connections,
+            "reused_connections": reused,
+            "reuse_rate": reused / requests_count if requests_count else 0.0,
+            "avg_handshake_ms": avg_handshake * 1000,
+            "handshake_saved_ms": reused * avg_handshake * 1000,
+        }
+
+
+class _PooledAdapter(HTTPAdapter):
+    """给连接计时的HTTPAdapter，只有真正新建连接时才记录握手耗时"""
+
+    def __init__(self, stats, pool_size):
+        # init_poolmanager在父类构造函数中调用，需要先保存stats
+        self.stats = stats
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        class TimedHTTPConnection(HTTPConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                stats.record_connect(time.perf_counter() - start)
+
+        class TimedHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                stats.record_connect(time.perf_counter() - start)
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TimedHTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super().send(request, **kwargs)
+
+
+class ProviderSessionPool:
+    """按服务商地址管理共享Session的连接池管理器（线程安全）"""
+
+    def __init__(self, pool_limits=None, default_pool_size=DEFAULT_POOL_SIZE):
+        self.pool_limits = dict(PROVIDER_POOL_LIMITS if pool_limits is None else pool_limits)
+        self.default_pool_size = default_pool_size
+        self._lock = threading.Lock()
+        self._sessions = {}  # 服务商地址 -> Session
+        self._stats = {}  # 服务商地址 -> ConnectionStats
+
+    @staticmethod
+    def base_url(api_url):
+        """提取服务商地址作为连接池的键，例如https://api.siliconflow.cn"""
+        parts = urlsplit(api_url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def get_session(self, api_url, api_type=None):
+        """获取某个API地址对应的共享Session，不存在时创建"""
+        key = self.base_url(api_url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                pool_size = self.pool_limits.get(api_type, self.default_pool_size)
+                stats = self._stats.setdefault(key, ConnectionStats())
+                adapter = _PooledAdapter(stats, pool_size)
+                session = requests.Session()
+                session.headers["Connection"] = "keep-alive"
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[key] = session
+                perf.incr("http_sessions_created")
+            return session
+
+    def connection_stats(self, api_url):
+        """服务商地址的连接统计对象；同步请求和异步生成引擎的连接都记在这里，复用率按服务商合并计算"""
+        key = self.base_url(api_url)
+        with self._lock:
+            return self._stats.setdefault(key, ConnectionStats())
+
+    def stats(self, api_url=None):
+        """返回连接统计；指定api_url时只返回该服务商的统计"""
+        with self._lock:
+            items = list(self._stats.items())
+        if api_url is not None:
+            key = self.base_url(api_url)
+            for base, stats in items:
+                if base == key:
+                    return stats.snapshot()
+            return ConnectionStats().snapshot()
+        return {base: stats.snapshot() for base, stats in items}
+
+    def close_all(self):
+        """关闭所有连接，程序退出时调用"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._stats.clear()
+        for session in sessions:
+            session.close()
+
+
+# 进程级共享实例
+session_pool = ProviderSessionPool()
+
+
+def get_session(api_url, api_type=None):
+    """获取服务商对应的共享Session"""
+    return session_pool.get_session(api_url, api_type)
+
+
+class ProviderRequest:
+    """一次流式生成请求的完整描述：地址、请求头、请求体和流格式"""
+
+    def __init__(self, api_type, url, headers, payload, stream_format, timeout=None):
+        self.api_type = api_type
+        self.url = url
+        self.headers = headers
+        self.payload = payload
+        self.stream_format = stream_format  # "ndjson"（Ollama格式）或 "sse"（OpenAI格式）
+        self.timeout = timeout
+
+
+def build_provider_request(api_type, api_url, api_key, model_name, prompt,
+                           api_format=None, custom_headers=None, max_chapter_length=5000,
+                           keep_alive=None, options=None):
+    """按服务商构建流式生成请求，参数与ApiCallThread各_call_*方法保持一致
+
+    keep_alive、options只用于Ollama（见novel_ollama.ollama_request_fields），为None时不发送。
+    配置有误（如ModelScope密钥为空、自定义请求头不是JSON）时抛出ValueError，
+    异常信息可直接展示给用户。
+    """
+    # 中文字符与token的比例约为1:1.5（保守估计）
+    max_tokens = int(max_chapter_length * 1.5)
+    messages = [{"role": "user", "content": prompt}]
+
+    if api_type == "Ollama":
+        headers = {"Content-Type": "application/json"}
+        payload = {
+            "model": model_name,
+            "prompt": prompt,
+            "stream": True,
+            "max_tokens": 5000,
+            "temperature": 0.7
+        }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if options:
+            payload["options"] = options
+        return ProviderRequest(api_type, api_url, headers, payload, "ndjson")
+
+    if api_type == "SiliconFlow":
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        payload = {
+            "model": model_name,
+            "messages": messages,
+            "stream": True,
+            "max_tokens": 5000,
+            "temperature": 0.7
+        }
+        return ProviderRequest(api_type, api_url, headers, payload, "sse")
+
+    if api_type == "ModelScope":
+        if not api_key or len(api_key.strip()) == 0:
+            raise ValueError("API密钥为空，请检查ModelScope API配置")
+        headers = {
+            "Authorization": f"Bearer {api_key.strip()}",
+            "Content-Type": "application/json",
+            "User-Agent": "ModelScope-Client/1.0"
+        }
+        payload = {
+            "model": model_name,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "stream": True
+        }
+        return ProviderRequest(api_type, api_url, headers, payload, "sse", timeout=60)
+
+    if api_type == "自定义":
+        headers = {"Content-Type": "application/json"}
+        if custom_headers:
+            try:
+                headers.update(json.loads(custom_headers))
+            except json.JSONDecodeError:
+                raise ValueError("自定义请求头格式错误，请确保是有效的JSON格式")
+        if api_format == "OpenAI格式":
+            payload = {
+                "model": model_name,
+                "messages": messages,
+                "stream": True,
+                "max_tokens": max_tokens,
+                "temperature": 0.7
+            }
+            return ProviderRequest(api_type, api_url, headers, payload, "sse")
+        payload = {
+            "model": model_name,
+            "prompt": prompt,
+            "stream": True,
+            "max_tokens": max_tokens,
+            "temperature": 0.7
+        }
+        return ProviderRequest(api_type, api_url, headers, payload, "ndjson")
+
+    raise ValueError(f"不支持的API类型: {api_type}")
@@ -0,0 +1,236 @@
+"""后台写盘队列
+
+章节、大纲和配置文件的写入都交给一个后台线程，界面线程只负责把内容放进队列，
+磁盘慢或保存目录在网络共享上时界面也不会卡住。
+
+- 每个文件先写同目录下的临时文件，再用os.replace替换，崩溃时不会留下写了一半的章节；
+- 需要时对文件做fsync，同一批写入的文件一起fsync，每个目录只fsync一次；
+- 同一个文件在写入前被多次提交时只写最后一次的内容；
+- flush()等待已提交的写入全部完成，close()在退出时写完剩余内容并停止线程。
+"""
+import os
+import threading
+
+from novel_perf import perf
+
+
+def _temp_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _fsync_directory(directory):
+    """fsync目录，使文件替换本身落盘；Windows不支持打开目录，直接跳过"""
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_text(path, text, fsync=False):
+    """先写同目录下的临时文件，再用os.replace替换目标文件"""
+    temp_path = _temp_path(path)
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        _remove_quietly(temp_path)
+        raise
+    if fsync:
+        _fsync_directory(os.path.dirname(path))
+
+
+class _WriteRequest:
+    __slots__ = ("path", "text", "fsync", "callbacks", "sequence")
+
+    def __init__(self, path, text, fsync, callbacks, sequence):
+        self.path = path
+        self.text = text
+        self.fsync = fsync
+        self.callbacks = callbacks
+        self.sequence = sequence  # 最后一次提交的序号
+
+
+class WriteBehindQueue:
+    """单个后台线程按提交顺序写文件，同一文件未写入前的多次提交合并为一次"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {}  # 规范化路径 -> _WriteRequest，dict保持提交顺序
+        self._writing = {}  # 正在写入的批次，读取时同样可见
+        self._submitted = 0  # 最后一次提交的序号
+        self._completed = 0  # 序号不超过该值的提交都已写完（每批取走全部待写内容，所以序号连续完成）
+        self._error_listeners = []
+        self._thread = None
+        self._closed = False
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="novel-writer", daemon=True)
+            self._thread.start()
+
+    def add_error_listener(self, listener):
+        """写入失败时调用listener(path, error_message)，在写盘线程中调用"""
+        with self._cond:
+            self._error_listeners.append(listener)
+
+    def write(self, path, text, fsync=False, on_done=None):
+        """提交一次写入后立即返回
+
+        on_done(error)在写盘线程中调用，成功时error为None，失败时为错误信息。
+        同一文件尚未写入时再次提交，旧内容被丢弃，两次提交的on_done都在新内容写入后调用。
+        """
+        key = os.path.normpath(os.path.abspath(path))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("写盘队列已关闭")
+            callbacks = [on_done] if on_done is not None else []
+            previous = self._pending.pop(key, None)
+            if previous is not None:
+                callbacks = previous.callbacks + callbacks
+                fsync = fsync or previous.fsync
+                perf.incr("write_queue_coalesced")
+            self._submitted += 1
+            self._pending[key] = _WriteRequest(path, text, fsync, callbacks, self._submitted)
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def pending_text(self, path):
+        """文件已提交但还没有写完的内容，没有时返回None"""
+        key = os.path.normpath(os.path.abspath(path))
+        with self._cond:
+            request = self._pending.get(key) or self._writing.get(key)
+            return request.text if request is not None else None
+
+    def exists(self, path):
+        """文件已存在或已提交写入"""
+        return self.pending_text(path) is not None or os.path.exists(path)
+
+    def read_text(self, path):
+        """读取文件内容，已提交但还没有写完时返回提交的内容"""
+        text = self.pending_text(path)
+        if text is not None:
+            return text
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def flush(self, timeout=None):
+        """等待此前提交的写入全部完成，超时返回False"""
+        with self._cond:
+            target = self._submitted
+            return self._cond.wait_for(lambda: self._completed >= target, timeout)
+
+    def close(self, timeout=None):
+        """写完剩余内容并停止写盘线程，程序退出时调用"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch = self._pending
+                self._pending = {}
+                self._writing = batch
+            errors = self._write_batch(list(batch.values()))
+            with self._cond:
+                self._writing = {}
+                listeners = list(self._error_listeners)
+            for request in batch.values():
+                error = errors.get(request.path)
+                if error is not None:
+                    print(f"[写盘] 写入失败: {request.path}: {error}")
+                    for listener in listeners:
+                        self._call(listener, request.path, error)
+                for callback in request.callbacks:
+                    self._call(callback, error)
+            with self._cond:
+                self._completed = max(request.sequence for request in batch.values())
+                self._cond.notify_all()
+
+    @staticmethod
+    def _call(callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"[写盘] 回调出错: {e}")
+
+    @staticmethod
+    def _write_batch(requests):
+        """写一批文件：全部写临时文件，需要的一起fsync，再逐个替换，最后每个目录fsync一次"""
+        errors = {}
+        staged = []
+        for request in requests:
+            temp_path = _temp_path(request.path)
+            try:
+                f = open(temp_path, 'w', encoding='utf-8')
+                try:
+                    f.write(request.text)
+                    if request.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                finally:
+                    f.close()
+                staged.append((request, temp_path))
+            except Exception as e:
+                _remove_quietly(temp_path)
+                errors[request.path] = str(e)
+        synced_dirs = set()
+        for request, temp_path in staged:
+            try:
+                os.replace(temp_path, request.path)
+            except Exception as e:
+                _remove_quietly(temp_path)
+                errors[request.path] = str(e)
+                continue
+            perf.incr("write_queue_writes")
+            if request.fsync:
+                synced_dirs.add(os.path.dirname(os.path.abspath(request.path)))
+        for directory in synced_dirs:
+            _fsync_directory(directory)
+        return errors
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """进程共用的写盘队列"""
+    global _queue
+    with _queue_lock:
+        if _queue is None or _queue._closed:
+            _queue = WriteBehindQueue()
+        return _queue
+
+
+def close_write_queue(timeout=None):
+    """写完剩余内容并停止写盘线程"""
+    global _queue
+    with _queue_lock:
+        queue, _queue = _queue, None
+    if queue is not None:
+        queue.close(timeout)
@@ -0,0 +1,155 @@
+"""批量生成任务表
+
+把每次批量生成的每一章记录在保存目录下的batch_jobs.db（SQLite）中：
+queued（待生成）、in_flight（生成中）、done（已保存）、failed（失败），以及尝试次数。
+每次状态变化立即提交，程序崩溃、关闭或断网后可以从中断处继续，
+已完成的章节直接跳过，不必重新读取章节文件。
+"""
+import time
+
+from novel_sqlite import SQLiteStore, StoreRegistry
+
+JOB_DB_NAME = "batch_jobs.db"
+MAX_ATTEMPTS = 3  # 同一章最多尝试次数，超过后继续任务时不再重试
+
+STATE_QUEUED = "queued"
+STATE_IN_FLIGHT = "in_flight"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+BATCH_RUNNING = "running"  # 进行中或被中断，可以继续
+BATCH_FINISHED = "finished"  # 所有章节都已处理完
+
+
+class BatchJobStore(SQLiteStore):
+    """批量生成任务表（线程安全，生成线程和界面线程可同时使用）"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    novel_title TEXT,
+                    start_chapter INTEGER NOT NULL,
+                    end_chapter INTEGER NOT NULL,
+                    read_previous INTEGER NOT NULL,
+                    overwrite_existing INTEGER NOT NULL,
+                    concurrency INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    batch_id INTEGER NOT NULL,
+                    chapter INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (batch_id, chapter)
+                )
+            """)
+
+    def create_batch(self, novel_title, start_chapter, end_chapter, read_previous=True,
+                     overwrite_existing=False, concurrency=1):
+        """登记一次新的批量生成，所有章节初始为queued，返回批次ID"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO batches (novel_title, start_chapter, end_chapter, read_previous, "
+                "overwrite_existing, concurrency, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (novel_title, start_chapter, end_chapter, int(read_previous),
+                 int(overwrite_existing), concurrency, BATCH_RUNNING, now, now))
+            batch_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO jobs (batch_id, chapter, state, updated_at) VALUES (?, ?, ?, ?)",
+                [(batch_id, chapter, STATE_QUEUED, now)
+                 for chapter in range(start_chapter, end_chapter + 1)])
+        print(f"[任务表] 登记批量任务{batch_id}: 第{start_chapter}章到第{end_chapter}章")
+        return batch_id
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_unfinished_batch(self, novel_title=None):
+        """返回最近一次未完成的批量任务，没有时返回None"""
+        sql = "SELECT * FROM batches WHERE status = ?"
+        args = [BATCH_RUNNING]
+        if novel_title is not None:
+            sql += " AND novel_title = ?"
+            args.append(novel_title)
+        sql += " ORDER BY id DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(sql, args).fetchone()
+        return dict(row) if row else None
+
+    def resume_batch(self, batch_id):
+        """继续一次被中断的任务：上次生成中的章节重新排队，返回批次信息"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE batch_id = ? AND state = ?",
+                (STATE_QUEUED, now, batch_id, STATE_IN_FLIGHT))
+            self._conn.execute("UPDATE batches SET updated_at = ? WHERE id = ?", (now, batch_id))
+        return self.get_batch(batch_id)
+
+    def chapters_to_skip(self, batch_id):
+        """已完成的章节，以及失败次数已达上限的章节"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chapter FROM jobs WHERE batch_id = ? AND "
+                "(state = ? OR (state = ? AND attempts >= ?))",
+                (batch_id, STATE_DONE, STATE_FAILED, MAX_ATTEMPTS)).fetchall()
+        return {row["chapter"] for row in rows}
+
+    def counts(self, batch_id):
+        """按状态统计章节数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY state",
+                (batch_id,)).fetchall()
+        counts = {STATE_QUEUED: 0, STATE_IN_FLIGHT: 0, STATE_DONE: 0, STATE_FAILED: 0}
+        counts.update({row["state"]: row["n"] for row in rows})
+        return counts
+
+    def mark_in_flight(self, batch_id, chapter):
+        self._update_job(batch_id, chapter, STATE_IN_FLIGHT, count_attempt=True)
+
+    def mark_done(self, batch_id, chapter):
+        self._update_job(batch_id, chapter, STATE_DONE)
+
+    def mark_failed(self, batch_id, chapter, error=None):
+        self._update_job(batch_id, chapter, STATE_FAILED, error=error)
+
+    def finish_batch(self, batch_id):
+        """所有章节都已处理，任务不再需要继续"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE batches SET status = ?, updated_at = ? WHERE id = ?",
+                               (BATCH_FINISHED, time.time(), batch_id))
+
+    def _update_job(self, batch_id, chapter, state, error=None, count_attempt=False):
+        attempts_sql = ", attempts = attempts + 1" if count_attempt else ""
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET state = ?, last_error = ?, updated_at = ?{attempts_sql} "
+                "WHERE batch_id = ? AND chapter = ?",
+                (state, error, time.time(), batch_id, chapter))
+
+
+_stores = StoreRegistry(JOB_DB_NAME, BatchJobStore)
+
+
+def get_job_store(save_path):
+    """获取保存目录对应的任务表，同一目录共用一个连接"""
+    return _stores.get(save_path)
+
+
+def close_job_stores():
+    """关闭所有任务表，程序退出时调用"""
+    _stores.close_all()
@@ -0,0 +1,289 @@
+"""生成中内容的落盘日志（.part文件）
+
+流式生成时整章内容只在内存里，程序崩溃或被强制关闭时已经花钱生成的内容全部丢失。
+这里把正在生成的内容同时追加到保存目录下.partial目录中的日志文件：
+
+- 文件第一行是JSON头（类型、章节号、小说标题、模型、提示词、开始时间），之后是已生成的正文；
+- append()只把片段放进内存，由一个后台线程批量追加到文件并fsync，
+  每个日志每FLUSH_INTERVAL秒最多写一次，写盘次数与token数量无关；
+- 生成完成并保存后discard()删除日志；出错、被中断时close()保留日志，
+  下次启动时find_partial_generations()找出这些日志，由界面询问继续生成还是保留已生成的部分。
+"""
+import json
+import os
+import threading
+import time
+
+from novel_perf import perf
+
+JOURNAL_DIR = ".partial"  # 保存目录下存放日志的子目录
+JOURNAL_SUFFIX = ".part"
+FLUSH_INTERVAL = 0.5  # 秒，同一个日志两次写盘的最小间隔
+
+KIND_CHAPTER = "chapter"
+KIND_OUTLINE = "outline"
+
+
+def journal_dir(save_path):
+    return os.path.join(save_path, JOURNAL_DIR)
+
+
+def journal_path(save_path, kind, chapter=0):
+    """日志文件路径：同一章（或大纲）只有一个日志，重新生成时覆盖旧日志"""
+    name = f"第{chapter}章" if kind == KIND_CHAPTER else kind
+    return os.path.join(journal_dir(save_path), name + JOURNAL_SUFFIX)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class GenerationJournal:
+    """一次生成的落盘日志，append()可以在任意线程调用"""
+
+    def __init__(self, path, meta, writer, text="", fsync=True):
+        self.path = path
+        self.meta = dict(meta)
+        self.fsync = fsync
+        self.failed = None  # 出错信息，出错的生成结束时保留日志
+        self._writer = writer
+        self._lock = threading.Lock()  # 保护内存中的状态，append()只拿这个锁，不会等待写盘
+        self._file_lock = threading.Lock()  # 串行化文件的写入和关闭，先于_lock获取
+        self._pending = [text] if text else []
+        self._scheduled = bool(text)  # 已经交给后台线程等待写盘
+        self._file = None
+        self._closed = False
+        self._broken = False  # 写盘出错后不再写入，不影响生成本身
+        if text:
+            writer.schedule(self)
+
+    def append(self, text):
+        """追加一段生成的内容，只放进内存，由后台线程批量写盘"""
+        if not text:
+            return
+        with self._lock:
+            if self._closed or self._broken:
+                return
+            self._pending.append(text)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._writer.schedule(self)
+
+    def mark_failed(self, reason=""):
+        """记录生成出错，之后finish()会保留日志"""
+        self.failed = reason or "生成出错"
+
+    def flush(self):
+        """把内存中的内容追加到文件，第一次写入时创建文件并写入JSON头
+
+        只在取出待写内容时持有_lock，写文件和fsync期间append()可以继续追加。
+        """
+        with self._file_lock:
+            with self._lock:
+                self._scheduled = False
+                if not self._pending or self._broken:
+                    return
+                text = "".join(self._pending)
+                self._pending = []
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self._file = open(self.path, 'w', encoding='utf-8')
+                    self._file.write(json.dumps(self.meta, ensure_ascii=False) + "\n")
+                self._file.write(text)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except Exception as e:
+                print(f"[生成日志] 写入失败: {self.path}: {e}")
+                with self._lock:
+                    self._broken = True
+                return
+        perf.incr("journal_writes")
+
+    def close(self, keep=True):
+        """停止记录：写完剩余内容后关闭文件；keep为False或没有写入任何内容时删除日志"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._writer.forget(self)
+        if keep:
+            self.flush()
+        with self._file_lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+            else:
+                keep = False
+        if not keep:
+            _remove_quietly(self.path)
+
+    def discard(self):
+        """生成的内容已经保存，删除日志"""
+        self.close(keep=False)
+
+    def finish(self):
+        """生成结束：出错时保留日志供下次启动恢复，否则删除"""
+        self.close(keep=self.failed is not None)
+
+
+class JournalWriter:
+    """后台线程，把各个日志攒下的内容按FLUSH_INTERVAL为周期批量写盘"""
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._dirty = {}  # 有内容待写的日志，dict保持顺序
+        self._open = {}  # 所有未关闭的日志
+        self._last_round = 0.0
+        self._thread = None
+        self._closed = False
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="novel-journal", daemon=True)
+            self._thread.start()
+
+    def open(self, path, meta, text="", fsync=True):
+        with self._cond:
+            stale = [j for j in self._open.values() if j.path == path]
+        for journal in stale:
+            # 同一章又开始生成，旧的生成不再需要恢复
+            journal.close(keep=False)
+        journal = GenerationJournal(path, meta, self, text, fsync)
+        with self._cond:
+            self._open[id(journal)] = journal
+        return journal
+
+    def schedule(self, journal):
+        with self._cond:
+            if self._closed:
+                return
+            if id(journal) not in self._dirty:
+                self._dirty[id(journal)] = journal
+                self._ensure_thread()
+                self._cond.notify_all()
+
+    def forget(self, journal):
+        with self._cond:
+            self._dirty.pop(id(journal), None)
+            self._open.pop(id(journal), None)
+
+    def close(self, timeout=None):
+        """程序退出时调用：写完所有日志的剩余内容并保留文件，下次启动时可以恢复"""
+        with self._cond:
+            self._closed = True
+            journals = list(self._open.values())
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        for journal in journals:
+            journal.close(keep=True)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                delay = self._last_round + self.interval - time.monotonic()
+                if delay > 0:
+                    # 距上一轮写盘不足一个周期，等到周期结束再把这段时间攒下的内容一起写
+                    self._cond.wait(delay)
+                    continue
+                journals = list(self._dirty.values())
+                self._dirty = {}
+                self._last_round = time.monotonic()
+            for journal in journals:
+                journal.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_journal_writer():
+    """进程共用的日志写盘线程"""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer._closed:
+            _writer = JournalWriter()
+        return _writer
+
+
+def close_journal_writer(timeout=None):
+    """写完所有日志的剩余内容并停止后台线程"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close(timeout)
+
+
+def open_generation_journal(save_path, kind, chapter=0, text="", **meta):
+    """开始记录一次生成；text为已有的内容（继续生成时的前半部分），meta写入日志头"""
+    header = {"kind": kind, "chapter": chapter, "started_at": time.time()}
+    header.update(meta)
+    return get_journal_writer().open(journal_path(save_path, kind, chapter), header, text)
+
+
+def read_journal(path):
+    """读取日志，返回(日志头, 已生成的内容)，文件不是有效日志时返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            header = f.readline()
+            text = f.read()
+        meta = json.loads(header)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict):
+        return None
+    return meta, text
+
+
+def find_partial_generations(save_path):
+    """保存目录中上次没有完成的生成，按(类型, 章节号)排序
+
+    每项是日志头加上path、text（已生成的内容）和updated_at（最后写入时间）。
+    没有内容或无法解析的日志直接删除。
+    """
+    directory = journal_dir(save_path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    partials = []
+    for name in names:
+        if not name.endswith(JOURNAL_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        journal = read_journal(path)
+        if journal is None or not journal[1].strip():
+            print(f"[生成日志] 删除无效或空的日志: {path}")
+            _remove_quietly(path)
+            continue
+        meta, text = journal
+        partial = dict(meta)
+        partial.update(path=path, text=text)
+        try:
+            partial["updated_at"] = os.path.getmtime(path)
+        except OSError:
+            partial["updated_at"] = meta.get("started_at", 0)
+        partials.append(partial)
+    partials.sort(key=lambda p: (p.get("kind") != KIND_OUTLINE, p.get("chapter", 0)))
+    return partials
+
+
+def discard_partial(partial):
+    """删除一条未完成生成的日志（find_partial_generations返回的一项）"""
+    _remove_quietly(partial["path"])
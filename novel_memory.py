@@ -0,0 +1,333 @@
+"""故事记忆：按章节和篇章滚动压缩的前情概要
+
+生成新章节时原来只附上上一章结尾的1000字，几章之后前面的情节就不在提示词里了。
+这里为每一章保存一段抽取式摘要（从正文中挑出信息量最大的几句，不调用模型），
+每ARC_SIZE章合并为一个篇章概要，记录在保存目录的story_memory.db（SQLite）中：
+- 章节保存时（record_chapter_write）更新该章摘要，内容没有变化时跳过；
+- 没有摘要或文件在本程序之外被改动的章节，在构建上下文时按需补上（按文件大小和修改时间判断）；
+- build_context()在token预算内组装上下文：上一章结尾、最近几章的摘要、更早篇章的概要，
+  预算从近到远分配，第300章的上下文与第10章一样长。
+"""
+import hashlib
+import math
+import os
+import re
+import time
+
+from novel_io import get_write_queue
+from novel_perf import perf
+from novel_project import add_chapter_write_listener, get_chapter_index
+from novel_sqlite import SQLiteStore, StoreRegistry
+
+MEMORY_DB_NAME = "story_memory.db"
+ARC_SIZE = 10  # 每个篇章包含的章节数
+CHAPTER_SUMMARY_CHARS = 150  # 每章摘要的最大字数
+ARC_SUMMARY_CHARS = 300  # 每个篇章概要的最大字数
+RECENT_CHAPTERS = 5  # 单独列出摘要的最近章节数，更早的章节按篇章概括
+PREVIOUS_ENDING_CHARS = 600  # 附上的上一章结尾字数
+DEFAULT_CONTEXT_TOKENS = 2000  # 上下文的默认token预算
+ARCS_HEADER = "【前情提要】"
+RECENT_HEADER = "【最近章节概要】"
+
+_CJK_RE = re.compile(r'[一-鿿]')
+_SENTENCE_RE = re.compile(r'[^。！？!?…\n]+[。！？!?…]*[”」』"]?')
+_CHAPTER_TITLE_RE = re.compile(r'^\s*\**\s*第\d+章')
+_DIALOGUE_CHARS = '“”「」"'
+
+
+def estimate_tokens(text):
+    """估算文本的token数：汉字按每字一个token，其他字符按每4个一个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def split_sentences(text):
+    """按句末标点和换行切分句子，去掉章节标题行"""
+    sentences = []
+    for line in text.split('\n'):
+        if _CHAPTER_TITLE_RE.match(line):
+            continue
+        sentences.extend(s.strip() for s in _SENTENCE_RE.findall(line) if s.strip())
+    return sentences
+
+
+def _bigrams(sentence):
+    chars = [c for c in sentence if '一' <= c <= '鿿']
+    return {a + b for a, b in zip(chars, chars[1:])}
+
+
+def summarize_text(text, max_chars):
+    """抽取式摘要：按句子中高频词（汉字二元组）的覆盖程度打分，开头结尾的句子加权，
+    对话减权，选出得分最高的若干句按原文顺序拼接，总长不超过max_chars"""
+    sentences = split_sentences(text)
+    if not sentences or max_chars <= 0:
+        return ""
+    if sum(len(s) for s in sentences) <= max_chars:
+        return "".join(sentences)
+    grams = [_bigrams(s) for s in sentences]
+    frequency = {}
+    for sentence_grams in grams:
+        for gram in sentence_grams:
+            frequency[gram] = frequency.get(gram, 0) + 1
+    scored = []
+    last = len(sentences) - 1
+    for i, (sentence, sentence_grams) in enumerate(zip(sentences, grams)):
+        if len(sentence) < 6:
+            continue
+        score = sum(frequency[g] for g in sentence_grams if frequency[g] > 1) / math.sqrt(len(sentence_grams) + 1)
+        if i < 3 or i > last - 3:
+            score *= 1.3  # 开头交代场景，结尾留下悬念
+        if any(c in sentence for c in _DIALOGUE_CHARS):
+            score *= 0.6
+        scored.append((score, i))
+    scored.sort(reverse=True)
+    chosen = []
+    used = 0
+    for _, i in scored:
+        sentence = sentences[i]
+        if used + len(sentence) > max_chars:
+            continue
+        chosen.append(i)
+        used += len(sentence)
+    if not chosen:
+        return sentences[0][:max_chars]
+    return "".join(sentences[i] for i in sorted(chosen))
+
+
+def _ending(text, max_chars):
+    """正文最后max_chars字，从句子开头截起"""
+    if len(text) <= max_chars:
+        return text.strip()
+    tail = text[-max_chars:]
+    match = re.search(r'[。！？!?…\n]', tail)
+    if match and match.end() < len(tail) // 2:
+        tail = tail[match.end():]
+    return tail.strip()
+
+
+def _section_cost(header):
+    """一段上下文的标题行和与前一段之间的空行占用的token数"""
+    return estimate_tokens(header + "\n") + estimate_tokens("\n\n")
+
+
+def _line_cost(line):
+    """一行内容连同换行占用的token数"""
+    return estimate_tokens(line) + estimate_tokens("\n")
+
+
+def arc_of(chapter):
+    """章节所属的篇章编号（从0开始）"""
+    return (chapter - 1) // ARC_SIZE
+
+
+def arc_label(arc, last_chapter=None):
+    first = arc * ARC_SIZE + 1
+    last = last_chapter if last_chapter is not None else first + ARC_SIZE - 1
+    return f"第{first}章" if first == last else f"第{first}-{last}章"
+
+
+class StoryMemory(SQLiteStore):
+    """一个章节目录的故事记忆（线程安全，生成线程和界面线程可同时使用）"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chapters (
+                    chapter INTEGER PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    summary TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS arcs (
+                    arc INTEGER PRIMARY KEY,
+                    last_chapter INTEGER NOT NULL,
+                    source_hash TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def update_chapter(self, chapter, text, size=-1, mtime_ns=-1):
+        """更新一章的摘要，内容没有变化时只更新文件状态；返回摘要"""
+        digest = text_hash(text)
+        with self._lock:
+            row = self._conn.execute("SELECT hash, summary FROM chapters WHERE chapter = ?", (chapter,)).fetchone()
+            if row is not None and row["hash"] == digest:
+                with self._conn:
+                    self._conn.execute("UPDATE chapters SET size = ?, mtime_ns = ? WHERE chapter = ?",
+                                       (size, mtime_ns, chapter))
+                return row["summary"]
+        summary = summarize_text(text, CHAPTER_SUMMARY_CHARS)
+        perf.incr("story_memory_summaries")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chapters (chapter, hash, size, mtime_ns, summary, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (chapter, digest, size, mtime_ns, summary, time.time()))
+        return summary
+
+    def sync(self, index, chapters):
+        """为chapters中有文件、但没有摘要或文件已被改动的章节补上摘要，index为保存目录的ChapterIndex"""
+        wanted = [item for item in (index.find(chapter) for chapter in chapters) if item is not None]
+        if not wanted:
+            return
+        with self._lock:
+            known = {row["chapter"]: (row["size"], row["mtime_ns"]) for row in self._conn.execute(
+                "SELECT chapter, size, mtime_ns FROM chapters WHERE chapter BETWEEN ? AND ?",
+                (wanted[0].chapter, wanted[-1].chapter))}
+        queue = get_write_queue()
+        for item in wanted:
+            if known.get(item.chapter) == (item.size, item.mtime_ns):
+                continue
+            try:
+                text = queue.read_text(item.path)
+            except OSError as e:
+                print(f"[故事记忆] 读取第{item.chapter}章失败: {e}")
+                continue
+            self.update_chapter(item.chapter, text, item.size, item.mtime_ns)
+
+    def summaries(self, first, last):
+        """第first到last章的摘要：章节号 -> 摘要"""
+        with self._lock:
+            return {row["chapter"]: row["summary"] for row in self._conn.execute(
+                "SELECT chapter, summary FROM chapters WHERE chapter BETWEEN ? AND ? ORDER BY chapter",
+                (first, last))}
+
+    def arc_summary(self, arc, last_chapter):
+        """篇章概要：由该篇章第一章到last_chapter的章节摘要再次压缩而成，章节摘要不变时直接使用上次的结果"""
+        first = arc * ARC_SIZE + 1
+        chapter_summaries = self.summaries(first, last_chapter)
+        if not chapter_summaries:
+            return ""
+        source = "\n".join(chapter_summaries[c] for c in sorted(chapter_summaries))
+        source_hash = text_hash(f"{last_chapter}\n{source}")
+        with self._lock:
+            row = self._conn.execute("SELECT source_hash, summary FROM arcs WHERE arc = ?", (arc,)).fetchone()
+        if row is not None and row["source_hash"] == source_hash:
+            return row["summary"]
+        summary = summarize_text(source, ARC_SUMMARY_CHARS)
+        perf.incr("story_memory_arc_summaries")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO arcs (arc, last_chapter, source_hash, summary, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", (arc, last_chapter, source_hash, summary, time.time()))
+        return summary
+
+    def build_context(self, chapter, index=None, previous_text=None, budget_tokens=DEFAULT_CONTEXT_TOKENS):
+        """组装生成第chapter章时附上的前文上下文，总长不超过budget_tokens
+
+        previous_text为上一章正文（调用方已经读取时传入，否则从index中读取）。
+        预算依次分给上一章结尾、最近RECENT_CHAPTERS章的摘要（从近到远）、更早篇章的概要（从近到远），
+        用完为止，输出时按时间顺序排列。第1章或前面没有任何章节时返回空字符串。
+        """
+        if chapter <= 1:
+            return ""
+        if index is not None:
+            self.sync(index, range(1, chapter))
+        if previous_text is None and index is not None:
+            item = index.find(chapter - 1)
+            if item is not None:
+                try:
+                    previous_text = get_write_queue().read_text(item.path)
+                except OSError:
+                    previous_text = None
+
+        # 标题、分段用的空行和每行的换行都计入预算，逐段估算的token数不少于整段估算的结果
+        remaining = budget_tokens
+        ending = ""
+        if previous_text:
+            ending = _ending(previous_text, PREVIOUS_ENDING_CHARS)
+            remaining -= _section_cost(f"【上一章（第{chapter - 1}章）结尾】") + estimate_tokens(ending)
+
+        recent_first = max(1, chapter - RECENT_CHAPTERS)
+        recent = []
+        summaries = self.summaries(recent_first, chapter - 1)
+        for number in range(chapter - 1, recent_first - 1, -1):
+            summary = summaries.get(number)
+            if not summary:
+                continue
+            cost = _line_cost(f"第{number}章：{summary}")
+            if not recent:
+                cost += _section_cost(RECENT_HEADER)
+            if cost > remaining:
+                break
+            recent.append((number, summary))
+            remaining -= cost
+
+        arcs = []
+        if recent_first > 1:
+            for arc in range(arc_of(recent_first - 1), -1, -1):
+                last_chapter = min(arc * ARC_SIZE + ARC_SIZE, recent_first - 1)
+                summary = self.arc_summary(arc, last_chapter)
+                if not summary:
+                    continue
+                label = arc_label(arc, last_chapter)
+                header_cost = 0 if arcs else _section_cost(ARCS_HEADER)
+                cost = header_cost + _line_cost(f"{label}：{summary}")
+                if cost > remaining:
+                    # 放不下的更早篇章合并成一段，用剩余的预算概括，开头的情节不会完全丢失
+                    label = arc_label(0, last_chapter)
+                    available = remaining - header_cost - _line_cost(f"{label}：")
+                    earlier = [self.arc_summary(a, a * ARC_SIZE + ARC_SIZE) for a in range(arc)]
+                    earlier = "".join(s for s in earlier + [summary] if s)
+                    summary = summarize_text(earlier, min(ARC_SUMMARY_CHARS, available)) if available > 0 else ""
+                    if summary:
+                        arcs.append((label, summary))
+                        remaining -= header_cost + _line_cost(f"{label}：{summary}")
+                    break
+                arcs.append((label, summary))
+                remaining -= cost
+
+        parts = []
+        if arcs:
+            parts.append(ARCS_HEADER + "\n" + "\n".join(f"{label}：{summary}" for label, summary in reversed(arcs)))
+        if recent:
+            parts.append(RECENT_HEADER + "\n" + "\n".join(f"第{number}章：{summary}" for number, summary in reversed(recent)))
+        if ending:
+            parts.append(f"【上一章（第{chapter - 1}章）结尾】\n{ending}")
+        context = "\n\n".join(parts)
+        perf.incr("story_memory_context_tokens", estimate_tokens(context))
+        return context
+
+
+_memories = StoreRegistry(MEMORY_DB_NAME, StoryMemory)
+
+
+def get_story_memory(chapter_dir):
+    """获取章节目录对应的故事记忆，同一目录共用一个连接"""
+    return _memories.get(chapter_dir)
+
+
+def close_story_memories():
+    """关闭所有故事记忆，程序退出时调用"""
+    _memories.close_all()
+
+
+def build_story_context(save_path, chapter, previous_text=None, budget_tokens=DEFAULT_CONTEXT_TOKENS):
+    """生成第chapter章时附上的前文上下文（保存目录中的章节按需补上摘要）"""
+    return get_story_memory(save_path).build_context(chapter, get_chapter_index(save_path), previous_text,
+                                                     budget_tokens)
+
+
+def _remember_chapter_write(path, chapter, text):
+    """本程序保存章节时更新该章摘要（只更新已经打开的故事记忆，其余在下次构建上下文时补上）"""
+    memory = _memories.opened(os.path.dirname(path) or ".")
+    if memory is None:
+        return
+    try:
+        memory.update_chapter(chapter, text)
+    except Exception as e:
+        print(f"[故事记忆] 更新第{chapter}章摘要失败: {e}")
+
+
+add_chapter_write_listener(_remember_chapter_write)
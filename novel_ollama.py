@@ -0,0 +1,235 @@
+"""Ollama模型预热与保活
+
+直接向/api/generate发请求时，每批的第一章都要等模型加载（大模型可能要几十秒），
+章节之间间隔超过Ollama默认的5分钟时模型还会被卸载；大纲加前文的提示词较长时，
+默认的上下文长度可能装不下。这里为每个(地址, 模型)维护一个OllamaSession：
+- 开始单章或批量生成时先发一个不带提示词的请求预热（加载模型），与准备提示词同时进行；
+- 批量生成期间每个请求带keep_alive=BATCH_KEEP_ALIVE，结束时恢复为Ollama的默认值；
+- 提示词估算的token数超过Ollama默认的上下文长度时才设置num_ctx（提示词加输出预留取整），
+  只增不减（num_ctx变化会让Ollama重新加载模型）；否则不带num_ctx，使用模型自己配置的上下文长度；
+- 分别统计冷启动（模型尚未加载）和热请求的首字延迟。
+"""
+import threading
+import time
+
+from novel_http import get_session, session_pool
+from novel_memory import estimate_tokens
+from novel_perf import perf
+
+BATCH_KEEP_ALIVE = "30m"  # 批量生成期间每个请求都续期，章节之间再慢也不会被卸载
+DEFAULT_KEEP_ALIVE = "5m"  # Ollama的默认值，批量生成结束后恢复
+OUTPUT_TOKENS = 5000  # 给输出预留的上下文，与请求中的max_tokens一致
+NUM_CTX_STEP = 2048
+DEFAULT_NUM_CTX = 2048  # Ollama默认的上下文长度（较新的版本为4096），提示词装得下时不设置num_ctx
+MAX_NUM_CTX = 32768
+PRELOAD_TIMEOUT = 300  # 秒，加载大模型可能很慢
+
+
+def context_size(prompt_tokens, output_tokens=OUTPUT_TOKENS):
+    """提示词和输出需要的num_ctx，按NUM_CTX_STEP向上取整"""
+    needed = prompt_tokens + output_tokens
+    size = -(-needed // NUM_CTX_STEP) * NUM_CTX_STEP
+    return min(MAX_NUM_CTX, size)
+
+
+def _average(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+class OllamaRequestTimer:
+    """一次生成请求的首字计时，first_token()可以在每个片段到达时调用"""
+
+    def __init__(self, session, cold):
+        self.session = session
+        self.cold = cold
+        self.started = time.perf_counter()
+        self._recorded = False
+
+    def first_token(self):
+        if self._recorded:
+            return
+        self._recorded = True
+        self.session._record_latency(self.cold, time.perf_counter() - self.started)
+
+
+class OllamaSession:
+    """一个Ollama地址上一个模型的加载状态、保活设置和延迟统计（线程安全）"""
+
+    def __init__(self, api_url, model_name):
+        self.api_url = api_url
+        self.model_name = model_name
+        self.base_url = session_pool.base_url(api_url)
+        self.num_ctx = None  # 为None时请求不带num_ctx，使用模型自己的配置
+        self.keep_alive = None  # 批量生成期间为BATCH_KEEP_ALIVE，否则不指定（使用Ollama的默认值）
+        self.warm = False  # 模型已按当前上下文长度加载
+        self.load_seconds = None  # 最近一次预热时加载模型的耗时
+        self.cold_latencies = []  # 冷启动请求的首字延迟（秒）
+        self.warm_latencies = []  # 热请求的首字延迟（秒）
+        self._batches = 0
+        self._lock = threading.Lock()
+        self._preload_thread = None
+
+    def is_loaded(self):
+        """通过/api/ps查询模型是否已在内存中，查询失败时返回None"""
+        try:
+            response = get_session(self.api_url, "Ollama").get(self.base_url + "/api/ps", timeout=5)
+            if response.status_code != 200:
+                return None
+            names = {model.get("name") for model in response.json().get("models", [])}
+        except Exception:
+            return None
+        return self.model_name in names or f"{self.model_name}:latest" in names
+
+    def _post_empty(self, keep_alive, action):
+        """发送不带提示词的/api/generate请求：模型未加载时加载，已加载时刷新保活时间；成功返回True"""
+        with self._lock:
+            payload = {"model": self.model_name, "stream": False, "keep_alive": keep_alive}
+            if self.num_ctx:
+                payload["options"] = {"num_ctx": self.num_ctx}
+        try:
+            response = get_session(self.api_url, "Ollama").post(self.base_url + "/api/generate", json=payload,
+                                                                  timeout=PRELOAD_TIMEOUT)
+        except Exception as e:
+            print(f"[Ollama] {action}失败（模型{self.model_name}）: {e}")
+            return False
+        if response.status_code != 200:
+            print(f"[Ollama] {action}失败（模型{self.model_name}）: {response.status_code}")
+            return False
+        return True
+
+    def preload(self):
+        """同步加载模型，返回耗时（秒），失败时返回None"""
+        loaded = self.is_loaded()
+        with self._lock:
+            keep_alive = self.keep_alive or DEFAULT_KEEP_ALIVE
+            num_ctx = self.num_ctx
+        started = time.perf_counter()
+        if not self._post_empty(keep_alive, "预热"):
+            return None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.warm = True
+            if not loaded:
+                self.load_seconds = elapsed
+        if loaded:
+            print(f"[Ollama] 模型{self.model_name}已在内存中，预热耗时{elapsed:.2f}秒")
+        else:
+            perf.incr("ollama_model_loads")
+            print(f"[Ollama] 已加载模型{self.model_name}（num_ctx={num_ctx or '默认'}），耗时{elapsed:.2f}秒")
+        return elapsed
+
+    def release(self):
+        """把模型的保活时间恢复为Ollama的默认值"""
+        if self._post_empty(DEFAULT_KEEP_ALIVE, "恢复保活时间"):
+            print(f"[Ollama] 模型{self.model_name}的保活时间已恢复为{DEFAULT_KEEP_ALIVE}")
+
+    def warm_up(self, wait=False):
+        """在后台线程中预热模型，已有预热在进行时不重复发送；wait为True时等预热完成"""
+        with self._lock:
+            thread = self._preload_thread
+            if thread is None or not thread.is_alive():
+                thread = self._preload_thread = threading.Thread(target=self.preload, name="novel-ollama-preload",
+                                                                 daemon=True)
+                thread.start()
+        if wait:
+            thread.join()
+
+    def begin_batch(self, wait=False):
+        """批量生成开始：之后的请求带BATCH_KEEP_ALIVE，清空延迟统计并预热模型"""
+        with self._lock:
+            self._batches += 1
+            self.keep_alive = BATCH_KEEP_ALIVE
+            self.load_seconds = None
+            self.cold_latencies = []
+            self.warm_latencies = []
+        self.warm_up(wait)
+
+    def end_batch(self, wait=False):
+        """批量生成结束：所有批次都结束后把保活时间恢复为Ollama的默认值，返回延迟统计
+
+        wait为False时在后台线程中发送恢复请求；命令行程序随后就退出，需要传True。
+        """
+        with self._lock:
+            self._batches = max(0, self._batches - 1)
+            # 模型没有加载时不必为了恢复保活时间再加载一次
+            release = self._batches == 0 and self.keep_alive is not None and self.warm
+            if self._batches == 0:
+                self.keep_alive = None
+        if release and wait:
+            self.release()
+        elif release:
+            threading.Thread(target=self.release, name="novel-ollama-release", daemon=True).start()
+        return self.report()
+
+    def request_fields(self, prompt):
+        """生成请求中要加上的字段：keep_alive和options.num_ctx（提示词超过默认上下文长度后才有）"""
+        prompt_tokens = estimate_tokens(prompt)
+        with self._lock:
+            # 提示词装得下默认的上下文时不设置num_ctx；设置过之后再按需要增大
+            if self.num_ctx or prompt_tokens >= DEFAULT_NUM_CTX:
+                needed = context_size(prompt_tokens)
+                if needed > (self.num_ctx or 0):
+                    print(f"[Ollama] 提示词较长（约{prompt_tokens} tokens），num_ctx从{self.num_ctx or '默认'}"
+                          f"增加到{needed}，模型将重新加载")
+                    self.num_ctx = needed
+                    self.warm = False
+            fields = {}
+            if self.num_ctx:
+                fields["options"] = {"num_ctx": self.num_ctx}
+            if self.keep_alive:
+                fields["keep_alive"] = self.keep_alive
+        return fields
+
+    def start_request(self):
+        """一次生成请求开始，返回计时器；模型还没有预热完成时这次请求按冷启动统计"""
+        with self._lock:
+            return OllamaRequestTimer(self, cold=not self.warm)
+
+    def _record_latency(self, cold, seconds):
+        with self._lock:
+            if cold:
+                self.cold_latencies.append(seconds)
+                self.warm = True
+            else:
+                self.warm_latencies.append(seconds)
+        perf.incr("ollama_cold_requests" if cold else "ollama_warm_requests")
+
+    def report(self):
+        """冷启动和热请求的延迟统计，没有任何数据时返回空字符串"""
+        with self._lock:
+            parts = []
+            if self.load_seconds is not None:
+                parts.append(f"预热加载模型 {self.load_seconds:.2f} 秒")
+            if self.cold_latencies:
+                parts.append(f"冷启动首字延迟 {_average(self.cold_latencies):.2f} 秒（{len(self.cold_latencies)} 次）")
+            if self.warm_latencies:
+                parts.append(f"热请求首字延迟 {_average(self.warm_latencies):.2f} 秒（{len(self.warm_latencies)} 次）")
+        return "，".join(parts)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_ollama_session(api_url, model_name):
+    """获取(地址, 模型)对应的OllamaSession"""
+    key = (session_pool.base_url(api_url), model_name)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = OllamaSession(api_url, model_name)
+        return session
+
+
+def ollama_request_fields(api_type, api_url, model_name, prompt):
+    """Ollama请求要加上的keep_alive和options，其他服务商返回空字典"""
+    if api_type != "Ollama":
+        return {}
+    return get_ollama_session(api_url, model_name).request_fields(prompt)
+
+
+def start_ollama_request(api_type, api_url, model_name):
+    """Ollama请求开始时调用，返回首字计时器，其他服务商返回None"""
+    if api_type != "Ollama":
+        return None
+    return get_ollama_session(api_url, model_name).start_request()
@@ -0,0 +1,154 @@
+"""大纲分节：全局部分与逐章概要
+
+generate_outline生成的大纲包含"每章内容概要"，章节越多大纲越长，而生成每一章时原来都把整份大纲
+放进提示词。这里把大纲拆成两部分：
+- 全局部分：故事梗概、人物、结构、情节线等不属于某一章的内容；
+- 逐章概要：以"第N章"（也支持"第一章"、"第1-3章"）开头的条目，直到下一个章节条目或下一节标题为止。
+生成第N章时只放全局部分和第N章前后OUTLINE_WINDOW章的概要（outline_for_chapter）。
+
+解析结果按大纲内容的哈希缓存，大纲不变时不会重复解析；大纲里找不到任何章节条目时按原样使用整份大纲。
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from novel_perf import perf
+
+OUTLINE_WINDOW = 1  # 除本章外，前后各附上几章的概要
+CACHE_SIZE = 8  # 缓存的大纲解析结果数
+
+_NUMBER = r'[0-9零〇一二两三四五六七八九十百]+'
+# 章节条目的开头：可带列表符号、序号和markdown标记，"第N章"后面必须是分隔符或行尾，排除"第3章中……"这类正文
+_CHAPTER_HEADING_RE = re.compile(
+    r'^[\s>*#\-•·【\[]*(?:\d+[.、)]\s*)?\**\s*第\s*(' + _NUMBER + r')\s*(?:[-~～—至到]\s*第?\s*(' + _NUMBER +
+    r')\s*)?章\s*(?=[:：\-—.、，,（(【】\]*]|\s|$)')
+# 下一节的标题：markdown标题、"八、"这类中文序号、或带有大纲各部分名称的数字序号
+_SECTION_HEADING_RE = re.compile(
+    r'^\s*(?:#{1,6}\s|\**[一二三四五六七八九十]+[、.．]|\**\d+[.、．]\s*\**\s*'
+    r'(?:故事|主要|人物|情节|情感|关键|转折|结局|世界观|背景|主题|伏笔|每章|章节))')
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+
+def parse_number(text):
+    """阿拉伯数字或中文数字（最大到999）转为整数，无法识别时返回None"""
+    if text.isdigit():
+        return int(text)
+    total = 0
+    digit = 0
+    for char in text:
+        if char in _CN_DIGITS:
+            digit = _CN_DIGITS[char]
+        elif char == '十':
+            total += (digit or 1) * 10
+            digit = 0
+        elif char == '百':
+            total += (digit or 1) * 100
+            digit = 0
+        else:
+            return None
+    return total + digit or None
+
+
+class OutlineSections:
+    """一份大纲的解析结果：global_text为全局部分，entries为[(起始章, 结束章, 条目文本)]"""
+
+    def __init__(self, outline, global_text, entries):
+        self.outline = outline
+        self.global_text = global_text
+        self.entries = entries
+
+    def chapter_entries(self, first, last):
+        """与第first到第last章有交集的条目"""
+        return [entry for entry in self.entries if entry[0] <= last and entry[1] >= first]
+
+    def entry(self, chapter):
+        """第chapter章的概要，没有时返回空字符串"""
+        return "\n".join(text for _, _, text in self.chapter_entries(chapter, chapter))
+
+    def static_text(self):
+        """所有章节共用的部分：全局部分；没有章节条目时为整份大纲"""
+        return self.global_text if self.entries else self.outline
+
+    def chapter_window(self, chapter, window=OUTLINE_WINDOW):
+        """本章前后window章的概要，带小标题；没有章节条目时返回空字符串"""
+        if not self.entries:
+            return ""
+        entries = self.chapter_entries(chapter - window, chapter + window)
+        if entries:
+            title = "【本章及前后章节概要】"
+        else:
+            # 章节超出了大纲的范围，附上大纲中最后几章的概要
+            entries = [entry for entry in self.entries if entry[1] < chapter][-(window + 1):]
+            title = "【大纲中最近的章节概要】"
+        if not entries:
+            return ""
+        return title + "\n" + "\n".join(text for _, _, text in entries)
+
+    def for_chapter(self, chapter, window=OUTLINE_WINDOW):
+        """生成第chapter章时使用的大纲：全局部分加上本章前后window章的概要"""
+        parts = [part for part in (self.static_text(), self.chapter_window(chapter, window)) if part]
+        return "\n\n".join(parts)
+
+
+def parse_outline(outline):
+    """把大纲拆成全局部分和逐章条目（不使用缓存）"""
+    global_lines = []
+    entries = []
+    current = None  # 正在收集的条目：[起始章, 结束章, [行]]
+    for line in outline.split('\n'):
+        match = _CHAPTER_HEADING_RE.match(line)
+        if match:
+            first = parse_number(match.group(1))
+            last = parse_number(match.group(2)) if match.group(2) else first
+            if first is not None and last is not None and last >= first:
+                if current is not None:
+                    entries.append(current)
+                current = [first, last, [line.strip().replace('**', '')]]
+                continue
+        if current is not None and _SECTION_HEADING_RE.match(line):
+            entries.append(current)
+            current = None
+        if current is not None:
+            if line.strip():
+                current[2].append(line.strip())
+        else:
+            global_lines.append(line)
+    if current is not None:
+        entries.append(current)
+    global_text = re.sub(r'\n{3,}', '\n\n', "\n".join(global_lines)).strip()
+    entries = [(first, last, "\n".join(lines)) for first, last, lines in entries]
+    entries.sort(key=lambda entry: entry[0])
+    return OutlineSections(outline, global_text, entries)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_outline_sections(outline):
+    """解析大纲，按内容哈希缓存"""
+    key = hashlib.blake2b(outline.encode('utf-8'), digest_size=16).digest()
+    with _cache_lock:
+        sections = _cache.get(key)
+        if sections is not None:
+            _cache.move_to_end(key)
+            perf.incr("outline_cache_hits")
+            return sections
+    sections = parse_outline(outline)
+    perf.incr("outline_parses")
+    with _cache_lock:
+        _cache[key] = sections
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return sections
+
+
+def outline_for_chapter(outline, chapter, window=OUTLINE_WINDOW):
+    """生成第chapter章时放进提示词的大纲"""
+    return get_outline_sections(outline).for_chapter(chapter, window)
+
+
+def outline_entry(outline, chapter):
+    """大纲中第chapter章的概要，没有时返回空字符串"""
+    return get_outline_sections(outline).entry(chapter)
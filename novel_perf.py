@@ -0,0 +1,39 @@
+"""性能计数器
+
+进程级的命名计数器，用于确认优化是否生效，例如批量生成实时预览期间
+界面是否还在读取章节文件。计数只在内存中累加，开销可以忽略。
+"""
+import threading
+
+
+class PerfCounters:
+    """线程安全的命名计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def get(self, name):
+        with self._lock:
+            return self._counts.get(name, 0)
+
+    def snapshot(self):
+        """返回所有计数的副本"""
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self, name=None):
+        """清零某个计数，不指定时清零全部"""
+        with self._lock:
+            if name is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(name, None)
+
+
+# 进程级共享实例
+perf = PerfCounters()
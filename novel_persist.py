@@ -0,0 +1,190 @@
+"""设置和内容的集中保存
+
+界面上每次输入都会触发自动保存。这里按产物（user_params.json、novel_params.json、大纲、
+当前章节）记录脏标记，由界面的单次定时器合并一段时间内的修改后统一保存，只写真正改过的
+产物；内容与磁盘上相同时由novel_cache跳过写盘，写盘均为临时文件替换。
+
+user_params.json在内存中只保留一份（ConfigDocument），主窗口、设置对话框和模型切换都
+修改这一份，不再各自读取、修改、写回文件。
+"""
+import copy
+import json
+import os
+import threading
+
+from novel_cache import content_cache
+from novel_project import load_json
+
+
+class ConfigDocument:
+    """JSON配置文件在内存中的唯一副本，内容与文件不同时为脏，flush()时写回"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        self._saved = {}  # 最近一次读取或写入文件时的内容，写盘失败时为None
+        self._flushes = 0  # 提交写入的次数，只有最近一次提交写完时才更新_saved
+        self.reload()
+
+    def reload(self):
+        """从文件重新读取，丢弃未保存的修改"""
+        try:
+            data = load_json(self.path)
+        except (OSError, ValueError) as e:
+            print(f"读取配置文件失败: {self.path}: {e}")
+            data = {}
+        with self._lock:
+            self._data = data
+            self._saved = copy.deepcopy(data)
+
+    @property
+    def dirty(self):
+        """内容与文件不同（改了又改回去的不算）"""
+        with self._lock:
+            return self._data != self._saved
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def data(self):
+        """返回配置内容的副本"""
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return copy.deepcopy(self._data.get(key, default))
+
+    def set(self, key, value):
+        """设置顶层字段，返回值是否有变化"""
+        with self._lock:
+            if key in self._data and self._data[key] == value:
+                return False
+            self._data[key] = copy.deepcopy(value)
+            return True
+
+    def api_config(self, api_type):
+        """某个服务商的配置副本，没有时返回空字典"""
+        with self._lock:
+            return copy.deepcopy(self._data.get("api_configs", {}).get(api_type, {}))
+
+    def update_api_config(self, api_type, **fields):
+        """更新某个服务商的配置字段，返回值是否有变化"""
+        with self._lock:
+            config = self._data.setdefault("api_configs", {}).setdefault(api_type, {})
+            changed = False
+            for key, value in fields.items():
+                if key not in config or config[key] != value:
+                    config[key] = copy.deepcopy(value)
+                    changed = True
+            return changed
+
+    def flush(self, force=False):
+        """内容与文件不同（或force）时提交写回文件，返回是否提交了写入
+
+        写盘在后台完成，写成功后才把这份内容记为已保存；写失败时文档保持为脏，下次flush重新写入。
+        """
+        with self._lock:
+            if not force and self._data == self._saved:
+                return False
+            snapshot = copy.deepcopy(self._data)
+            self._flushes += 1
+            flush_id = self._flushes
+
+        def on_done(error):
+            with self._lock:
+                if error is not None:
+                    print(f"保存配置文件失败: {self.path}: {error}")
+                    self._saved = None  # 与任何内容都不同，保持为脏
+                elif flush_id == self._flushes:
+                    self._saved = snapshot
+
+        written = content_cache.write_text(self.path, json.dumps(snapshot, ensure_ascii=False, indent=4),
+                                           on_done=on_done)
+        if not written:
+            # 文件内容已经是这份（或正在写入这份），不会有on_done回调
+            with self._lock:
+                if flush_id == self._flushes:
+                    self._saved = snapshot
+        return written
+
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def get_config_document(path):
+    """获取配置文件对应的文档，同一文件共用一份"""
+    path = os.path.abspath(path)
+    with _documents_lock:
+        document = _documents.get(path)
+        if document is None:
+            document = ConfigDocument(path)
+            _documents[path] = document
+        return document
+
+
+class PersistenceManager:
+    """按产物记录脏标记，flush()时只保存被标记的产物
+
+    每个产物注册一个保存函数，保存函数自己负责生成内容并写盘（通过novel_cache）。
+    什么时候flush由调用方决定，界面用单次定时器实现防抖。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._savers = {}  # 产物名 -> 保存函数
+        self._order = []  # 注册顺序，保存时按此顺序
+        self._dirty = set()
+
+    def register(self, name, saver):
+        with self._lock:
+            if name not in self._savers:
+                self._order.append(name)
+            self._savers[name] = saver
+
+    def mark_dirty(self, name):
+        with self._lock:
+            if name not in self._savers:
+                raise KeyError(f"未注册的保存项: {name}")
+            self._dirty.add(name)
+
+    def discard(self, names=None):
+        """清除修改标记（不指定时清除全部），对应的产物不再保存"""
+        with self._lock:
+            if names is None:
+                self._dirty.clear()
+            else:
+                self._dirty.difference_update(names)
+
+    def is_dirty(self, name=None):
+        """某个产物（不指定时为任意产物）是否有未保存的修改"""
+        with self._lock:
+            return bool(self._dirty) if name is None else name in self._dirty
+
+    def flush(self, names=None):
+        """保存被标记的产物（names指定时只保存其中被标记的），返回保存了的产物名列表
+
+        某个产物保存失败时重新标记为脏，继续保存其他产物，最后抛出第一个异常。
+        """
+        with self._lock:
+            pending = [name for name in self._order
+                       if name in self._dirty and (names is None or name in names)]
+            self._dirty.difference_update(pending)
+            savers = [(name, self._savers[name]) for name in pending]
+        saved = []
+        first_error = None
+        for name, saver in savers:
+            try:
+                saver()
+                saved.append(name)
+            except Exception as e:
+                print(f"保存{name}失败: {e}")
+                with self._lock:
+                    self._dirty.add(name)
+                if first_error is None:
+                    first_error = e
+        if first_error is not None:
+            raise first_error
+        return saved
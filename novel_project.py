@@ -0,0 +1,349 @@
+"""小说项目文件
+
+读取novel_params.json（小说设定）、user_params.json（API配置和保存路径）和已保存的大纲，
+查找、保存章节文件。界面和命令行批量生成共用这里的文件命名规则。
+
+章节文件通过ChapterIndex查找：一次扫描保存目录建立章节号到文件的索引，
+检查几百章是否存在也只需要一次目录扫描，不必对每章每种文件名格式各做一次exists。
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from novel_io import get_write_queue
+from novel_perf import perf
+
+DEFAULT_NOVEL_TITLE = "未命名小说"
+OUTLINE_DIR_NAME = "outlines"
+
+
+class ApiConfig:
+    """当前使用的服务商配置，字段与界面中的同名属性一致"""
+
+    def __init__(self, api_type="Ollama", api_url="http://localhost:11434/api/generate", api_key="",
+                 model_name="deepseek-r1:latest", api_format=None, custom_headers=None):
+        self.api_type = api_type
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model_name = model_name
+        self.api_format = api_format
+        self.custom_headers = custom_headers
+
+
+class UserSettings:
+    """user_params.json中的设置，缺少的字段使用界面的默认值"""
+
+    def __init__(self, params=None):
+        params = params or {}
+        if "api_configs" in params:
+            api_type = params.get("current_api_type", "Ollama")
+            config = params["api_configs"].get(api_type, {})
+        else:
+            # 旧格式：API配置直接放在顶层
+            api_type = params.get("api_type", "Ollama")
+            config = params
+        self.api = ApiConfig(
+            api_type=api_type,
+            api_url=config.get("api_url", "http://localhost:11434/api/generate"),
+            api_key=config.get("api_key", ""),
+            model_name=config.get("model_name", "deepseek-r1:latest"),
+            api_format=config.get("api_format", None),
+            custom_headers=config.get("custom_headers", None),
+        )
+        self.api_configs = params.get("api_configs", {})
+        self.min_chapter_length = params.get("min_chapter_length", 3500)
+        self.max_chapter_length = params.get("max_chapter_length", 5000)
+        self.save_path = params.get("save_path", "novels")
+        self.file_behavior = params.get("file_behavior", "询问")
+        self.batch_concurrency = params.get("batch_concurrency", {})
+
+    def use_api(self, api_type):
+        """切换到user_params.json中保存的另一个服务商配置"""
+        if api_type not in self.api_configs:
+            raise ValueError(f"user_params.json中没有{api_type}的配置")
+        self.api = UserSettings({"current_api_type": api_type, "api_configs": self.api_configs}).api
+
+
+class NovelSettings:
+    """novel_params.json中的小说设定"""
+
+    def __init__(self, params=None):
+        params = params or {}
+        hero = params.get("hero", {})
+        heroine = params.get("heroine", {})
+        self.title = params.get("title", "").strip() or DEFAULT_NOVEL_TITLE
+        self.background = params.get("background", "")
+        self.plot = params.get("plot", "")
+        self.relationship = params.get("relationship", "")
+        self.hero_name = hero.get("name", "")
+        self.heroine_name = heroine.get("name", "")
+        self.pov = params.get("pov", "第一人称")
+        self.language = params.get("language", "现代白话文")
+        self.rhythm = params.get("rhythm", "平铺直叙")
+        self.chapter_number = params.get("chapter_number", 1)
+
+
+def load_json(path):
+    """读取JSON文件，文件不存在时返回空字典"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_user_settings(path):
+    return UserSettings(load_json(path))
+
+
+def load_novel_settings(path):
+    return NovelSettings(load_json(path))
+
+
+def outline_file_path(save_path, title):
+    """大纲保存位置：保存目录/outlines/标题_outline.txt"""
+    return os.path.normpath(os.path.join(save_path, OUTLINE_DIR_NAME, f"{title}_outline.txt"))
+
+
+def find_latest_outline(save_path):
+    """查找最近修改的大纲文件，返回(小说标题, 文件路径)，没有时返回(None, None)"""
+    outlines_dir = os.path.join(save_path, OUTLINE_DIR_NAME)
+    if not os.path.exists(outlines_dir):
+        return None, None
+    outline_files = [f for f in os.listdir(outlines_dir) if f.endswith("_outline.txt") or f.endswith("大纲.txt")]
+    if not outline_files:
+        return None, None
+    # 按修改时间排序，选择最新的
+    outline_files.sort(key=lambda f: os.path.getmtime(os.path.join(outlines_dir, f)), reverse=True)
+    file_name = outline_files[0]
+    if file_name.endswith("_outline.txt"):
+        title = file_name[:-len("_outline.txt")]
+    else:
+        title = file_name[:-len("大纲.txt")]
+    return title, os.path.join(outlines_dir, file_name)
+
+
+def chapter_file_name(chapter):
+    """章节文件名：第X章.txt"""
+    return f"第{chapter}章.txt"
+
+
+_CHAPTER_FILE_RE = re.compile(r'^第(\d+)章(.*)\.txt$')
+
+# 同一章有多个文件时的优先顺序
+_RANK_PLAIN = 0  # 第X章.txt
+_RANK_PADDED = 1  # 第00X章.txt
+_RANK_TITLED = 2  # 第X章_小说标题.txt、第X章：章节标题_小说标题.txt
+
+
+def _path_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _chapter_file_rank(name):
+    """解析章节文件名，返回(章节号, 优先级, 文件名中章节号之后的部分)，不是章节文件时返回None"""
+    match = _CHAPTER_FILE_RE.match(name)
+    if match is None:
+        return None
+    digits, rest = match.groups()
+    if rest:
+        # 第X章新.txt（润色结果）等不算章节文件
+        if '_' not in rest:
+            return None
+        return int(digits), _RANK_TITLED, rest
+    if len(digits) > 1 and digits.startswith('0'):
+        return int(digits), _RANK_PADDED, rest
+    return int(digits), _RANK_PLAIN, rest
+
+
+class ChapterFile:
+    """索引中的一个章节文件"""
+    __slots__ = ("chapter", "path", "size", "mtime_ns", "rank", "suffix")
+
+    def __init__(self, chapter, path, size, mtime_ns, rank, suffix):
+        self.chapter = chapter
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.rank = rank
+        self.suffix = suffix
+
+    def matches_title(self, title):
+        return self.rank != _RANK_TITLED or not title or self.suffix.endswith(f"_{title}")
+
+
+class ChapterIndex:
+    """保存目录中章节文件的索引：章节号 -> 文件、大小、修改时间
+
+    用一次os.scandir建立，目录的修改时间变化（文件被增删、改名）时重新扫描；
+    本程序提交的写入通过record()立即加入索引，不必等写盘队列写完。线程安全。
+    """
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self._lock = threading.Lock()
+        self._chapters = {}  # 章节号 -> [ChapterFile]，按优先级排序
+        self._dir_mtime = None  # 上次扫描时目录的修改时间，None表示还没有扫描
+        self._recorded = {}  # 已提交写入、可能还没有落盘的文件：规范化路径 -> ChapterFile
+
+    def _directory_mtime(self):
+        try:
+            return os.stat(self.save_path).st_mtime_ns
+        except OSError:
+            return -1  # 目录不存在
+
+    def _scan(self, dir_mtime):
+        chapters = {}
+        if dir_mtime != -1:
+            with os.scandir(self.save_path) as entries:
+                for entry in entries:
+                    parsed = _chapter_file_rank(entry.name)
+                    if parsed is None or not entry.is_file():
+                        continue
+                    chapter, rank, suffix = parsed
+                    stat = entry.stat()
+                    chapters.setdefault(chapter, []).append(
+                        ChapterFile(chapter, entry.path, stat.st_size, stat.st_mtime_ns, rank, suffix))
+        perf.incr("chapter_index_scans")
+        # 已提交但还在写盘队列中的文件磁盘上还看不到，保留record()记下的条目
+        queue = get_write_queue()
+        for key, item in list(self._recorded.items()):
+            on_disk = any(_path_key(f.path) == key for f in chapters.get(item.chapter, ()))
+            if on_disk or queue.pending_text(item.path) is None:
+                del self._recorded[key]
+            else:
+                chapters.setdefault(item.chapter, []).append(item)
+        for files in chapters.values():
+            files.sort(key=lambda f: (f.rank, f.path))
+        self._chapters = chapters
+        self._dir_mtime = dir_mtime
+
+    def _current(self):
+        """目录有变化时重新扫描，返回章节表；调用时须持有锁"""
+        dir_mtime = self._directory_mtime()
+        if dir_mtime != self._dir_mtime:
+            self._scan(dir_mtime)
+        return self._chapters
+
+    def refresh(self):
+        """强制重新扫描目录"""
+        with self._lock:
+            self._scan(self._directory_mtime())
+
+    def find(self, chapter, title=None):
+        """查找章节文件，优先第X章.txt，其次第00X章.txt，最后是文件名带小说标题的旧格式，找不到返回None"""
+        with self._lock:
+            for item in self._current().get(chapter, ()):
+                if item.matches_title(title):
+                    return item
+        return None
+
+    def find_path(self, chapter, title=None):
+        item = self.find(chapter, title)
+        return item.path if item is not None else None
+
+    def existing(self, chapters, title=None):
+        """返回chapters中已有文件的章节号列表，整个范围只检查一次目录"""
+        with self._lock:
+            index = self._current()
+            return [chapter for chapter in chapters
+                    if any(item.matches_title(title) for item in index.get(chapter, ()))]
+
+    def chapters(self):
+        """已保存的全部章节号，升序"""
+        with self._lock:
+            return sorted(self._current())
+
+    def record(self, path, text):
+        """记录本程序提交的一次章节写入，path不是本目录的章节文件时忽略"""
+        if _path_key(os.path.dirname(path)) != _path_key(self.save_path):
+            return
+        parsed = _chapter_file_rank(os.path.basename(path))
+        if parsed is None:
+            return
+        chapter, rank, suffix = parsed
+        item = ChapterFile(chapter, path, len(text.encode('utf-8')), time.time_ns(), rank, suffix)
+        key = _path_key(path)
+        with self._lock:
+            index = self._current()
+            files = [f for f in index.get(chapter, ()) if _path_key(f.path) != key]
+            files.append(item)
+            files.sort(key=lambda f: (f.rank, f.path))
+            index[chapter] = files
+            self._recorded[key] = item
+
+
+_chapter_indexes = {}
+_chapter_indexes_lock = threading.Lock()
+
+
+def get_chapter_index(save_path):
+    """同一保存目录共用一个章节索引"""
+    key = _path_key(save_path)
+    with _chapter_indexes_lock:
+        index = _chapter_indexes.get(key)
+        if index is None:
+            index = _chapter_indexes[key] = ChapterIndex(save_path)
+        return index
+
+
+_chapter_write_listeners = []
+
+
+def add_chapter_write_listener(listener):
+    """本程序保存章节时调用listener(path, chapter, text)，如同步到项目数据库"""
+    _chapter_write_listeners.append(listener)
+
+
+def record_chapter_write(path, text):
+    """本程序提交章节写入后调用，更新所在目录的章节索引（还没有建立索引时不必处理）并通知监听者"""
+    key = _path_key(os.path.dirname(path))
+    with _chapter_indexes_lock:
+        index = _chapter_indexes.get(key)
+    if index is not None:
+        index.record(path, text)
+    parsed = _chapter_file_rank(os.path.basename(path))
+    if parsed is not None:
+        for listener in list(_chapter_write_listeners):
+            listener(path, parsed[0], text)
+
+
+def find_chapter_file(save_path, chapter, title):
+    """查找已保存的章节文件，兼容新旧文件名格式，找不到返回None"""
+    return get_chapter_index(save_path).find_path(chapter, title)
+
+
+def remove_novel_title_from_content(content, novel_title):
+    """从章节内容中移除小说标题行"""
+    if not novel_title or not content:
+        return content
+
+    # 创建小说标题的可能格式
+    title_patterns = [
+        f"**《{novel_title}》**",  # Markdown格式
+        f"《{novel_title}》",     # 普通格式
+        f"{novel_title}",         # 只有标题名
+    ]
+
+    processed_lines = []
+    for line in content.split('\n'):
+        should_remove_line = False
+        stripped_line = line.strip()
+
+        # 如果行中只有小说标题或者小说标题在行首，则移除整行
+        for pattern in title_patterns:
+            if stripped_line == pattern or stripped_line.startswith(pattern):
+                should_remove_line = True
+                break
+
+        # 额外检查：如果行包含**《...》**格式，即使不完全匹配也尝试移除
+        if not should_remove_line and '**《' in stripped_line and '》**' in stripped_line:
+            match = re.search(r'\*\*《(.+?)》\*\*', stripped_line)
+            if match and match.group(1).strip() == novel_title:
+                should_remove_line = True
+
+        if not should_remove_line:
+            processed_lines.append(line)
+
+    return '\n'.join(processed_lines)
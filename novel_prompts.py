@@ -0,0 +1,274 @@
+"""提示词构建
+
+大纲、章节和润色的提示词都在这里构建，界面和命令行批量生成共用，
+保证两边生成的内容一致。所有函数只接收普通字符串和数字，不读取界面控件。
+
+章节提示词把不随章节变化的内容放在前面、每章不同的内容放在最后，
+让服务商和Ollama的前缀缓存能够命中；prompt_prefix_stats统计相邻请求实际共享的前缀。
+"""
+import threading
+
+from novel_outline import get_outline_sections
+from novel_perf import perf
+
+# 润色预设：(名称, 润色要求)
+POLISH_PRESETS = [
+    ("优化文笔和语言表达", "请优化本章节的文笔和语言表达，使文字更加优美流畅，增强文学性"),
+    ("增强情感描写", "请重点增强本章节的情感描写，让人物情感更加细腻真实，增强读者共鸣"),
+    ("提高可读性", "请优化本章节的可读性，使语言更加通俗易懂，段落结构更加清晰"),
+    ("调整节奏和张力", "请优化本章节的节奏感和戏剧张力，使情节推进更加合理，增强吸引力"),
+    ("丰富场景描写", "请丰富本章节的场景描写，让环境更加生动具体，增强画面感"),
+    ("优化对话自然度", "请优化本章节的对话内容，使对话更加自然流畅，符合人物性格"),
+    ("综合全面优化", "请对本章节进行全面优化，包括文笔、情感、节奏、对话等各个方面"),
+]
+
+
+def build_outline_prompt(title, background, plot):
+    """构建生成小说大纲的提示词"""
+    prompt = f"请为小说《{title}》生成详细的大纲。\n\n"
+    prompt += f"小说背景：{background}\n\n"
+    prompt += f"核心剧情：{plot}\n\n"
+    prompt += "请生成一个完整的小说大纲，包含以下内容：\n"
+    prompt += "1. 故事梗概（200-300字）\n"
+    prompt += "2. 主要人物介绍（主角、配角及其关系）\n"
+    prompt += "3. 故事结构（开端、发展、高潮、结局）\n"
+    prompt += "4. 主要情节线（至少3条）\n"
+    prompt += "5. 情感发展线（主角情感变化）\n"
+    prompt += "6. 关键转折点和冲突\n"
+    prompt += "7. 每章内容概要（至少10章）\n\n"
+    prompt += "要求：\n"
+    prompt += "- 大纲要详细具体，每个情节点都要有具体的场景和事件描述\n"
+    prompt += "- 人物关系要复杂立体，避免简单的善恶二元对立\n"
+    prompt += "- 情感线索要清晰，与主线剧情紧密结合\n"
+    prompt += "- 重要：请使用纯中文生成大纲，不要包含任何英文内容\n"
+    return prompt
+
+
+def _previous_context(chapter, previous_chapter_content, story_context):
+    """前文上下文：优先使用故事记忆，其次是上一章结尾（最多1000字）"""
+    if story_context:
+        return (f"【前文回顾】\n{story_context}\n\n"
+                f"请确保新章节与前文衔接自然，情节连贯，不要与已经发生的情节矛盾。\n\n")
+    if previous_chapter_content:
+        prev_content_end = previous_chapter_content[-1000:]
+        return (f"上一章（第{chapter-1}章）结尾内容：\n{prev_content_end}\n\n"
+                f"请确保新章节与上一章内容衔接自然，情节连贯。\n\n")
+    return ""
+
+
+def _chapter_part(chapter, outline, previous_chapter_content, story_context):
+    """每章不同的部分：本章前后的大纲概要和前文上下文"""
+    part = ""
+    window = get_outline_sections(outline).chapter_window(chapter)
+    if window:
+        part += window + "\n\n"
+    part += _previous_context(chapter, previous_chapter_content, story_context)
+    return part
+
+
+def build_chapter_prompt(title, chapter, outline, hero_name, heroine_name, pov, language, rhythm,
+                         target_length, previous_chapter_content="", story_context=""):
+    """构建批量生成某一章的提示词
+
+    前半部分（说明、大纲全局部分、角色信息、写作要求）在同一批次中逐字节相同，
+    服务商和Ollama的前缀缓存可以复用；章节号、本章前后的大纲概要、前文上下文和目标字数放在最后。
+    outline为整份大纲，提示词中只放全局部分和本章前后几章的概要（novel_outline）；
+    hero_name、heroine_name为空时使用"男主角"、"女主角"；
+    story_context为故事记忆组装的前文上下文（novel_memory），不为空时代替上一章结尾；
+    否则previous_chapter_content不为空时附上上一章结尾（最多1000字）。
+    """
+    hero_name = hero_name.strip() or "男主角"
+    heroine_name = heroine_name.strip() or "女主角"
+
+    prompt = f"请根据以下小说大纲创作《{title}》的章节内容：\n"
+    static_outline = get_outline_sections(outline).static_text()
+    prompt += (static_outline + "\n\n") if static_outline else "\n"
+
+    # 添加男女主角信息到提示词
+    prompt += f"【重要角色信息】\n"
+    prompt += f"男主角：{hero_name}\n"
+    prompt += f"女主角：{heroine_name}\n"
+    prompt += f"请确保在章节内容中正确使用以上角色名字，不要混淆男女主角的名字。\n\n"
+
+    prompt += f"章节具体要求：\n"
+    prompt += f"- 保持{pov}视角\n"
+    prompt += f"- 使用{language}风格\n"
+    prompt += f"- 节奏：{rhythm}\n"
+    prompt += f"- 必须在章节开头添加一个吸引人的章节标题，格式为'第N章：[章节标题]'，N为本章的章节号\n"
+    prompt += f"- 章节标题必须独特且能反映本章主要情节，避免重复使用相同标题\n"
+    prompt += f"- 章节标题应该简洁明了，不超过15个字，能够概括本章的核心事件或情感变化\n"
+    prompt += f"- 重要：不要在章节内容中添加小说标题'《{title}》'，章节内容直接从章节标题开始\n"
+    prompt += f"- 特别注意：必须正确使用角色名字，男主角是{hero_name}，女主角是{heroine_name}，不要混淆\n\n"
+
+    # 以下每章不同
+    prompt += _chapter_part(chapter, outline, previous_chapter_content, story_context)
+    prompt += f"【本章任务】\n"
+    prompt += f"请生成第{chapter}章，字数约{target_length}字，章节标题格式为'第{chapter}章：[章节标题]'。\n"
+    return prompt
+
+
+def build_single_chapter_prompt(title, chapter, outline, pov, language, rhythm, target_length,
+                                previous_chapter_content="", story_context=""):
+    """构建单章生成的提示词（主界面"生成章节"）
+
+    与build_chapter_prompt一样，不随章节变化的说明和写作要求在前，第一章的特殊要求和之后各章的
+    衔接要求在中间（第2章起不再变化），本章前后的大纲概要、前文上下文和目标字数放在最后。
+    """
+    prompt = f"请根据以下小说大纲创作《{title}》的章节内容：\n"
+    static_outline = get_outline_sections(outline).static_text()
+    prompt += (static_outline + "\n\n") if static_outline else "\n"
+
+    prompt += f"章节具体要求：\n"
+    prompt += f"- 保持{pov}视角\n"
+    prompt += f"- 使用{language}风格\n"
+    prompt += f"- 节奏：{rhythm}\n"
+    prompt += f"- 重要：请使用纯中文生成章节内容，不要包含任何英文内容\n"
+
+    # 添加情感冲突要求
+    prompt += "\n【情感冲突要求】\n"
+    prompt += "1. 必须包含'虐妻一时爽，追妻火葬场'元素，情节要狗血且富有张力\n"
+    prompt += "2. 主角与女主角之间要有误解、伤害与情感纠葛，为后续追妻情节埋下伏笔\n"
+    prompt += "3. 设计至少一个让读者心疼女主角的场景，展现主角的冷漠或误解\n"
+    prompt += "4. 在情感冲突中埋下后悔与救赎的种子，为后续追妻火葬场做铺垫\n"
+    prompt += "5. 情感冲突要激烈但不过度，保持角色性格的一致性\n"
+    prompt += "6. 每章都要有情感张力，让读者感受到'虐'的痛苦和'追'的渴望\n"
+
+    # 添加通用写作技巧要求
+    prompt += "\n【写作技巧要求】\n"
+    prompt += "1. 每个段落都要有明确目的，要么推动情节，要么塑造人物，要么营造氛围\n"
+    prompt += "2. 使用'展示而非告知'的写作手法，通过具体行动和细节展示信息\n"
+    prompt += "3. 控制信息释放节奏，不要一次性揭示所有信息\n"
+    prompt += "4. 确保每个场景都有开头、发展和结尾\n"
+    prompt += "5. 使用多样化的句式结构，避免单调重复\n"
+
+    # 添加口语化写作要求
+    prompt += "\n【口语化写作要求】\n"
+    prompt += "1. 使用自然流畅的口语化表达，避免过于书面化的词语\n"
+    prompt += "2. 减少华丽修饰词和形容词堆砌，保持简洁有力\n"
+    prompt += "3. 对话要贴近生活，使用人们日常交流的语言风格\n"
+    prompt += "4. 避免使用过于复杂的句式和生僻词汇\n"
+    prompt += "5. 叙述部分要像讲故事一样自然，不要有明显的AI写作痕迹\n"
+    prompt += "6. 适当使用口语化的语气词和感叹词，增强真实感\n"
+    prompt += "7. 避免过度解释和心理描写，让读者自行感受\n\n"
+
+    if chapter == 1:
+        # 第一章特殊要求
+        prompt += "【第一章特殊要求】\n"
+        prompt += "1. 开篇必须在3秒内抓住读者注意力，使用以下三种开头类型之一：\n"
+        prompt += "   a) 冲突型开头：直接让主角面临危机或矛盾，不做铺垫\n"
+        prompt += "   b) 悬念型开头：用反常细节制造疑问，不解释只呈现不合理场景\n"
+        prompt += "   c) 情绪共鸣型开头：用细腻细节唤起读者情感，快速代入主角心境\n"
+        prompt += "2. 主角出场要有鲜明特点，通过具体行动展示性格而非描述\n"
+        prompt += "3. 在前500字内必须出现一个异常事件或转折点\n"
+        prompt += "4. 设置至少2个谜团或伏笔，为后续章节埋下线索\n"
+        prompt += "5. 结尾要留下强烈悬念，让读者迫切想知道后续发展\n"
+        prompt += "6. 避免平铺直叙的背景介绍，将背景信息融入情节发展中\n"
+        prompt += "7. 使用生动的感官描写（视觉、听觉、触觉等）营造氛围\n"
+        prompt += "8. 对话要简洁有力，每句对话都要推动情节或展示人物性格\n"
+        prompt += "9. 开篇避免使用天气描写、环境描写等常见套路，除非与情节直接相关\n"
+        prompt += "10. 确保第一段就出现核心冲突或悬念，不要慢慢铺垫\n\n"
+        prompt += "【情感冲突要求】\n"
+        prompt += "11. 必须包含'虐妻一时爽，追妻火葬场'元素，情节要狗血且富有张力\n"
+        prompt += "12. 主角与女主角之间要有误解、伤害与情感纠葛，为后续追妻情节埋下伏笔\n"
+        prompt += "13. 设计至少一个让读者心疼女主角的场景，展现主角的冷漠或误解\n"
+        prompt += "14. 在情感冲突中埋下后悔与救赎的种子，为后续追妻火葬场做铺垫\n\n"
+    else:
+        # 章节衔接要求
+        prompt += "【章节衔接要求】\n"
+        prompt += "1. 开头要与上一章结尾自然衔接\n"
+        prompt += "2. 适当回顾上一章关键信息，但避免重复\n"
+        prompt += "3. 推进至少一个主要情节线\n"
+        prompt += "4. 引入新的冲突或发展现有冲突\n"
+        prompt += "5. 结尾要为下一章做好铺垫\n\n"
+
+    # 以下每章不同
+    prompt += _chapter_part(chapter, outline, previous_chapter_content, story_context)
+    prompt += f"【本章任务】\n"
+    prompt += f"请生成第{chapter}章，字数约{target_length}字。\n"
+    return prompt
+
+
+def build_polish_prompt(chapter_content, polish_requirements):
+    """构建润色章节的提示词"""
+    prompt = f"请对以下小说章节进行润色优化：\n\n"
+    prompt += f"【原章节内容】\n{chapter_content}\n\n"
+    prompt += f"【润色要求】\n{polish_requirements}\n\n"
+    prompt += f"【润色说明】\n"
+    prompt += f"1. 保持原章节的核心情节和人物设定不变\n"
+    prompt += f"2. 重点优化文笔、语言表达和可读性\n"
+    prompt += f"3. 增强情感描写和场景氛围\n"
+    prompt += f"4. 提高对话的自然度和表现力\n"
+    prompt += f"5. 保持章节长度与原章节相近\n"
+    prompt += f"6. 使用纯中文输出，不要包含任何英文内容\n"
+    return prompt
+
+
+def build_continue_prompt(prompt, partial_text, tail_length=1500):
+    """构建接着中断处继续生成的提示词：原提示词加上已生成内容的结尾（最多tail_length字）"""
+    tail = partial_text[-tail_length:]
+    continued = prompt.rstrip() + "\n\n"
+    continued += f"【已写内容（结尾部分）】\n{tail}\n\n"
+    continued += "【续写要求】\n"
+    continued += "1. 上面的内容因为中断没有写完，请紧接着最后一句继续往下写\n"
+    continued += "2. 不要重复已写的内容，不要重新添加标题，直接输出后续正文\n"
+    continued += "3. 保持人物、情节和文风与已写内容一致，写完整个剩余部分\n"
+    return continued
+
+
+def shared_prefix_length(a, b):
+    """两个bytes相同前缀的长度（二分比较切片，不逐字节循环）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PromptPrefixStats:
+    """统计同一模型相邻两次请求的提示词共享的前缀字节数
+
+    服务商的提示词缓存和Ollama的KV缓存只能复用与上一次请求相同的前缀，
+    这个比例越高，每章需要重新计算的提示词越少。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = {}  # (API类型, 地址, 模型) -> 上一次请求的提示词（UTF-8）
+
+    def record(self, key, prompt):
+        """记录一次请求的提示词，返回(与同一key上一次请求共享的前缀字节数, 提示词字节数)
+
+        同一key的第一次请求没有可比较的对象，返回的共享字节数为None，不计入统计。
+        """
+        data = prompt.encode('utf-8')
+        with self._lock:
+            previous = self._last.get(key)
+            self._last[key] = data
+        if previous is None:
+            return None, len(data)
+        shared = shared_prefix_length(previous, data)
+        perf.incr("prompt_prefix_requests")
+        perf.incr("prompt_prefix_bytes", len(data))
+        perf.incr("prompt_prefix_shared_bytes", shared)
+        return shared, len(data)
+
+
+# 进程级共享实例
+prompt_prefix_stats = PromptPrefixStats()
+
+
+def prefix_report(start=None):
+    """从perf计数起点start（perf.snapshot()，不指定时从程序启动起）到现在的前缀共享情况，没有请求时返回空字符串"""
+    now = perf.snapshot()
+    start = start or {}
+    delta = {name: now.get(name, 0) - start.get(name, 0)
+             for name in ("prompt_prefix_requests", "prompt_prefix_bytes", "prompt_prefix_shared_bytes")}
+    if not delta["prompt_prefix_requests"]:
+        return ""
+    total = delta["prompt_prefix_bytes"]
+    shared = delta["prompt_prefix_shared_bytes"]
+    return (f"相邻请求 {delta['prompt_prefix_requests']} 次, 共享前缀 {shared}/{total} 字节"
+            f"（{shared / total if total else 0:.0%}）")
@@ -0,0 +1,277 @@
+"""已生成章节的本地全文检索
+
+生成新章节时，从前面所有章节中找出与本章大纲和人物最相关的几段原文附在提示词里，
+比只看上一章更不容易把早先埋下的伏笔、人物关系写错。完全在本地运行：
+- 章节正文按段落切成约PASSAGE_CHARS字的片段，以汉字二元组（字母数字按单词）为词建立倒排索引；
+- 查询用BM25打分，出现在大多数片段中的常见二元组直接跳过，百万字的正文查询只需几毫秒；
+- 本程序保存章节时（record_chapter_write）增量更新该章的片段；文件在本程序之外被改动、
+  或刚打开时还没有索引的章节，在查询前按文件大小和修改时间补上。
+
+索引只在内存中，每次启动后第一次查询时建立。
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+from array import array
+
+from novel_io import get_write_queue
+from novel_outline import outline_entry
+from novel_perf import perf
+from novel_project import add_chapter_write_listener, get_chapter_index
+
+PASSAGE_CHARS = 300  # 每个片段的目标字数
+DEFAULT_TOP_K = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+COMMON_TERM_RATIO = 0.5  # 出现在超过这个比例的片段中的词不参与打分
+COMPACT_RATIO = 0.3  # 已删除的片段超过这个比例时重建倒排表
+
+_CJK_RUN_RE = re.compile(r'[一-鿿]+')
+_WORD_RE = re.compile(r'[A-Za-z0-9]{2,}')
+_SENTENCE_END_RE = re.compile(r'(?<=[。！？!?…])')
+_CHAPTER_TITLE_RE = re.compile(r'^\s*\**\s*第\d+章')
+
+
+def terms(text):
+    """文本中的检索词：汉字二元组和字母数字单词（小写）"""
+    result = []
+    for run in _CJK_RUN_RE.findall(text):
+        result.extend(run[i:i + 2] for i in range(len(run) - 1))
+    result.extend(word.lower() for word in _WORD_RE.findall(text))
+    return result
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """按段落把正文切成约size字的片段，过长的段落按句子再切，章节标题行不计入"""
+    passages = []
+    current = ""
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or _CHAPTER_TITLE_RE.match(line):
+            continue
+        pieces = [line] if len(line) <= size * 2 else [s for s in _SENTENCE_END_RE.split(line) if s]
+        for piece in pieces:
+            current += piece
+            if len(current) >= size:
+                passages.append(current)
+                current = ""
+    if current:
+        if passages and len(current) < size // 3:
+            passages[-1] += current
+        else:
+            passages.append(current)
+    return passages
+
+
+def _text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class ChapterSearchIndex:
+    """一个章节目录的倒排索引（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chapters = {}  # 章节号 -> (内容哈希, [片段编号])
+        self._file_states = {}  # 章节号 -> (文件大小, 修改时间)，sync()据此判断文件是否改动
+        self._reset_passages()
+
+    def _reset_passages(self):
+        self._postings = {}  # 词 -> (片段编号array, 词频array)
+        self._df = {}  # 词 -> 包含该词的有效片段数
+        self._passage_chapter = array('i')
+        self._passage_length = array('i')  # 片段的词数
+        self._passage_text = []
+        self._alive = bytearray()
+        self._live = 0
+        self._dead = 0
+        self._total_length = 0
+
+    def __len__(self):
+        return self._live
+
+    def _add_passage(self, chapter, text):
+        passage_id = len(self._passage_text)
+        counts = {}
+        for term in terms(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = (array('i'), array('H'))
+            posting[0].append(passage_id)
+            posting[1].append(min(count, 65535))
+            self._df[term] = self._df.get(term, 0) + 1
+        length = sum(counts.values())
+        self._passage_chapter.append(chapter)
+        self._passage_length.append(length)
+        self._passage_text.append(text)
+        self._alive.append(1)
+        self._live += 1
+        self._total_length += length
+        return passage_id
+
+    def _remove_passages(self, passage_ids):
+        """标记片段已删除，倒排表中的条目在查询时跳过，积累多了再统一重建"""
+        for passage_id in passage_ids:
+            if not self._alive[passage_id]:
+                continue
+            self._alive[passage_id] = 0
+            for term in set(terms(self._passage_text[passage_id])):
+                self._df[term] -= 1
+            self._live -= 1
+            self._dead += 1
+            self._total_length -= self._passage_length[passage_id]
+            self._passage_text[passage_id] = ""
+        if self._dead > COMPACT_RATIO * (self._live + self._dead):
+            self._compact()
+
+    def _compact(self):
+        """丢弃已删除的片段，重新编号并重建倒排表"""
+        live = [(self._passage_chapter[i], self._passage_text[i])
+                for i in range(len(self._passage_text)) if self._alive[i]]
+        self._reset_passages()
+        perf.incr("search_index_compactions")
+        ids_by_chapter = {}
+        for chapter, text in live:
+            ids_by_chapter.setdefault(chapter, []).append(self._add_passage(chapter, text))
+        self._chapters = {chapter: (digest, ids_by_chapter.get(chapter, []))
+                          for chapter, (digest, _) in self._chapters.items()}
+
+    def update_chapter(self, chapter, text):
+        """索引一章的正文，内容没有变化时跳过"""
+        digest = _text_hash(text)
+        with self._lock:
+            known = self._chapters.get(chapter)
+            if known is not None and known[0] == digest:
+                return
+            if known is not None:
+                self._remove_passages(known[1])
+            ids = [self._add_passage(chapter, passage) for passage in split_passages(text)]
+            self._chapters[chapter] = (digest, ids)
+            self._file_states.pop(chapter, None)
+        perf.incr("search_index_chapter_updates")
+
+    def remove_chapter(self, chapter):
+        with self._lock:
+            known = self._chapters.pop(chapter, None)
+            self._file_states.pop(chapter, None)
+            if known is not None:
+                self._remove_passages(known[1])
+
+    def sync(self, index):
+        """与保存目录的ChapterIndex对齐：索引新增或被改动的章节，去掉已删除的章节"""
+        items = [item for item in (index.find(chapter) for chapter in index.chapters()) if item is not None]
+        present = {item.chapter for item in items}
+        with self._lock:
+            removed = [chapter for chapter in self._chapters if chapter not in present]
+            changed = [item for item in items if self._file_states.get(item.chapter) != (item.size, item.mtime_ns)]
+        for chapter in removed:
+            self.remove_chapter(chapter)
+        queue = get_write_queue()
+        for item in changed:
+            try:
+                text = queue.read_text(item.path)
+            except OSError as e:
+                print(f"[检索] 读取第{item.chapter}章失败: {e}")
+                continue
+            self.update_chapter(item.chapter, text)
+            with self._lock:
+                self._file_states[item.chapter] = (item.size, item.mtime_ns)
+
+    def search(self, query, k=DEFAULT_TOP_K, before=None, exclude=()):
+        """BM25检索，返回得分最高的k个片段[(得分, 章节号, 片段)]
+
+        before不为None时只在章节号小于before的章节中检索；exclude中的章节不参与检索。
+        """
+        query_counts = {}
+        for term in terms(query):
+            query_counts[term] = query_counts.get(term, 0) + 1
+        with self._lock:
+            if not self._live or not query_counts:
+                return []
+            live = self._live
+            average_length = self._total_length / live
+            lengths = self._passage_length
+            scores = {}
+            for term, query_count in query_counts.items():
+                df = self._df.get(term, 0)
+                if df == 0 or df > COMMON_TERM_RATIO * live:
+                    continue
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5)) * query_count
+                ids, tfs = self._postings[term]
+                for passage_id, tf in zip(ids, tfs):
+                    if not self._alive[passage_id]:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[passage_id] / average_length)
+                    scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            results = []
+            for passage_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+                chapter = self._passage_chapter[passage_id]
+                if (before is not None and chapter >= before) or chapter in exclude:
+                    continue
+                results.append((score, chapter, self._passage_text[passage_id]))
+                if len(results) >= k:
+                    break
+        perf.incr("search_queries")
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {"chapters": len(self._chapters), "passages": self._live, "terms": len(self._postings),
+                    "deleted_passages": self._dead}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_key(chapter_dir):
+    return os.path.normcase(os.path.abspath(chapter_dir))
+
+
+def get_search_index(chapter_dir, sync=True):
+    """获取章节目录对应的检索索引，sync为True时先补上新增或被改动的章节"""
+    key = _index_key(chapter_dir)
+    with _indexes_lock:
+        search_index = _indexes.get(key)
+        if search_index is None:
+            search_index = _indexes[key] = ChapterSearchIndex()
+    if sync:
+        search_index.sync(get_chapter_index(chapter_dir))
+    return search_index
+
+
+def related_passages(save_path, chapter, outline="", names=(), k=DEFAULT_TOP_K):
+    """与第chapter章的大纲概要和人物最相关的前文片段，格式化为提示词中的一节；没有结果时返回空字符串
+
+    上一章及之后的章节不参与检索（上一章的结尾已经在故事记忆的上下文中）。
+    """
+    names = [name.strip() for name in names if name and name.strip()]
+    query = outline_entry(outline, chapter)
+    if not query and not names:
+        return ""
+    query = "\n".join([query] + names)
+    results = get_search_index(save_path).search(query, k, before=chapter - 1)
+    if not results:
+        return ""
+    results.sort(key=lambda result: result[1])
+    lines = [f"第{result_chapter}章：{text}" for _, result_chapter, text in results]
+    return "【相关前文片段】\n" + "\n".join(lines)
+
+
+def _index_chapter_write(path, chapter, text):
+    """本程序保存章节时更新该目录已建立的检索索引"""
+    with _indexes_lock:
+        search_index = _indexes.get(_index_key(os.path.dirname(path) or "."))
+    if search_index is None:
+        return
+    try:
+        search_index.update_chapter(chapter, text)
+    except Exception as e:
+        print(f"[检索] 更新第{chapter}章索引失败: {e}")
+
+
+add_chapter_write_listener(_index_chapter_write)
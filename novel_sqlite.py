@@ -0,0 +1,68 @@
+"""保存目录中各个SQLite数据库共用的连接设置和注册表
+
+任务表（batch_jobs.db）、版本历史（chapter_history.db）、故事记忆（story_memory.db）和
+项目数据库（novel_project.db）都是：一个文件一个连接，生成线程和界面线程共用，用锁串行化访问；
+WAL模式下每次提交只追加日志，崩溃后也不会损坏已提交的内容。
+"""
+import os
+import sqlite3
+import threading
+
+
+def connect(db_path):
+    """打开数据库：可跨线程使用、按列名取值、WAL模式、synchronous=NORMAL"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    with conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLiteStore:
+    """一个数据库文件上的存储基类：子类在__init__中调用父类后建表，访问连接时持有self._lock"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = connect(db_path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class StoreRegistry:
+    """按数据库文件路径共用存储实例，同一目录的同一数据库只打开一个连接"""
+
+    def __init__(self, db_name, factory):
+        self.db_name = db_name
+        self.factory = factory  # factory(db_path)创建存储实例
+        self._lock = threading.Lock()
+        self._stores = {}
+
+    def get(self, directory, create=True):
+        """获取目录对应的存储；数据库文件不存在且create为False时返回None"""
+        db_path = os.path.abspath(os.path.join(directory, self.db_name))
+        with self._lock:
+            store = self._stores.get(db_path)
+            if store is None:
+                if not create and not os.path.exists(db_path):
+                    return None
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+                store = self._stores[db_path] = self.factory(db_path)
+            return store
+
+    def opened(self, directory):
+        """目录对应的存储已经打开时返回它，否则返回None（不会创建数据库）"""
+        db_path = os.path.abspath(os.path.join(directory, self.db_name))
+        with self._lock:
+            return self._stores.get(db_path)
+
+    def close_all(self):
+        """关闭所有存储，程序退出时调用"""
+        with self._lock:
+            stores = list(self._stores.values())
+            self._stores.clear()
+        for store in stores:
+            store.close()
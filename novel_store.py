@@ -0,0 +1,340 @@
+"""项目数据库（可选）
+
+一部小说原本分散在保存目录下的章节文件、outlines/中的大纲、novel_params.json、
+user_params.json和几个custom_*_models.json中。这里把它们放进保存目录下的一个
+SQLite文件novel_project.db：
+- chapters：章节正文、标题、内容哈希、字数，按章节号建主键；
+- outlines：各小说标题的大纲；
+- params：各个参数/配置文件的JSON内容，按文件名保存；
+- generations：每次生成的模型、耗时、字数等记录。
+
+数据库是可选的：import_layout()从现有的文本目录导入后才会创建，之后本程序保存章节时
+（record_chapter_write）同步更新；export_layout()把数据库写回原来的文本目录结构。
+列出章节、统计字数、全文搜索都是数据库中的索引查询，不再遍历目录、逐个读取文件。
+全文搜索使用FTS5的trigram分词（SQLite 3.34+），不支持时或搜索词少于3个字时退回逐行匹配。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from novel_io import atomic_write_text
+from novel_project import OUTLINE_DIR_NAME, add_chapter_write_listener, chapter_file_name, get_chapter_index
+from novel_sqlite import SQLiteStore, StoreRegistry
+
+PROJECT_DB_NAME = "novel_project.db"
+
+_CHAPTER_TITLE_RE = re.compile(r'^\s*\**第\d+章[：:\s]*(.*?)\**\s*$')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def word_count(text):
+    """字数：去掉空白后的字符数"""
+    return len(_WHITESPACE_RE.sub('', text))
+
+
+def chapter_title(text):
+    """从正文第一行“第X章：标题”中取章节标题，没有时返回空字符串"""
+    first_line = text.lstrip().split('\n', 1)[0] if text else ""
+    match = _CHAPTER_TITLE_RE.match(first_line)
+    return match.group(1).strip() if match else ""
+
+
+class ProjectStore(SQLiteStore):
+    """项目数据库（线程安全，生成线程和界面线程可同时使用）"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chapters (
+                    chapter INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL DEFAULT '',
+                    text TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    word_count INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outlines (
+                    novel_title TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS params (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chapter INTEGER,
+                    kind TEXT NOT NULL,
+                    api_type TEXT,
+                    model_name TEXT,
+                    elapsed REAL,
+                    word_count INTEGER,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS generations_chapter ON generations (chapter, created_at)")
+            self.fts = self._create_fts()
+
+    def _create_fts(self):
+        """建立章节全文索引，SQLite不支持FTS5 trigram时返回False"""
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chapters_fts USING fts5("
+                "text, content='chapters', content_rowid='chapter', tokenize='trigram')")
+        except sqlite3.OperationalError:
+            return False
+        # 外部内容表，由触发器与chapters保持一致
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS chapters_fts_insert AFTER INSERT ON chapters BEGIN
+                INSERT INTO chapters_fts (rowid, text) VALUES (new.chapter, new.text);
+            END
+        """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS chapters_fts_delete AFTER DELETE ON chapters BEGIN
+                INSERT INTO chapters_fts (chapters_fts, rowid, text) VALUES ('delete', old.chapter, old.text);
+            END
+        """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS chapters_fts_update AFTER UPDATE OF text ON chapters BEGIN
+                INSERT INTO chapters_fts (chapters_fts, rowid, text) VALUES ('delete', old.chapter, old.text);
+                INSERT INTO chapters_fts (rowid, text) VALUES (new.chapter, new.text);
+            END
+        """)
+        return True
+
+    # 章节
+
+    def put_chapter(self, chapter, text, title=None):
+        """保存一章，内容与数据库中相同时不写入，返回是否有变化"""
+        digest = text_hash(text)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT hash FROM chapters WHERE chapter = ?", (chapter,)).fetchone()
+            if row is not None and row["hash"] == digest:
+                return False
+            values = (title if title is not None else chapter_title(text), text, digest, word_count(text), time.time())
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO chapters (chapter, title, text, hash, word_count, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (chapter,) + values)
+            else:
+                self._conn.execute(
+                    "UPDATE chapters SET title = ?, text = ?, hash = ?, word_count = ?, updated_at = ? WHERE chapter = ?",
+                    values + (chapter,))
+        return True
+
+    def get_chapter(self, chapter):
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM chapters WHERE chapter = ?", (chapter,)).fetchone()
+        return row["text"] if row else None
+
+    def delete_chapter(self, chapter):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chapters WHERE chapter = ?", (chapter,))
+
+    def list_chapters(self, start=None, end=None):
+        """章节列表（不含正文）：[{chapter, title, word_count, updated_at}]，按章节号排序"""
+        sql = "SELECT chapter, title, word_count, updated_at FROM chapters"
+        args = []
+        if start is not None or end is not None:
+            sql += " WHERE chapter BETWEEN ? AND ?"
+            args = [start if start is not None else 0, end if end is not None else 2 ** 31]
+        sql += " ORDER BY chapter"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, args)]
+
+    def stats(self):
+        """章节数、总字数、平均字数、章节号范围，以及大纲数"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS chapters, COALESCE(SUM(word_count), 0) AS words, "
+                "MIN(chapter) AS first_chapter, MAX(chapter) AS last_chapter FROM chapters").fetchone()
+            outlines = self._conn.execute("SELECT COUNT(*) FROM outlines").fetchone()[0]
+        stats = dict(row)
+        stats["average_words"] = stats["words"] // stats["chapters"] if stats["chapters"] else 0
+        stats["outlines"] = outlines
+        return stats
+
+    def search(self, query, limit=20):
+        """搜索正文中包含query的章节，返回[(章节号, 标题, 片段)]，按章节号排序"""
+        query = query.strip()
+        if not query:
+            return []
+        with self._lock:
+            if self.fts and len(query) >= 3:
+                rows = self._conn.execute(
+                    "SELECT c.chapter, c.title, snippet(chapters_fts, 0, '【', '】', '…', 16) AS snippet "
+                    "FROM chapters_fts JOIN chapters c ON c.chapter = chapters_fts.rowid "
+                    "WHERE chapters_fts MATCH ? ORDER BY c.chapter LIMIT ?",
+                    ('"' + query.replace('"', '""') + '"', limit)).fetchall()
+                return [(row["chapter"], row["title"], row["snippet"]) for row in rows]
+            rows = self._conn.execute(
+                "SELECT chapter, title, text, instr(text, ?) AS pos FROM chapters "
+                "WHERE pos > 0 ORDER BY chapter LIMIT ?", (query, limit)).fetchall()
+        results = []
+        for row in rows:
+            pos = row["pos"] - 1
+            snippet = row["text"][max(0, pos - 16):pos] + f"【{query}】" + row["text"][pos + len(query):pos + len(query) + 16]
+            results.append((row["chapter"], row["title"], snippet.replace('\n', ' ')))
+        return results
+
+    # 大纲和参数
+
+    def put_outline(self, novel_title, text):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outlines (novel_title, text, hash, updated_at) VALUES (?, ?, ?, ?)",
+                (novel_title, text, text_hash(text), time.time()))
+
+    def get_outline(self, novel_title):
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM outlines WHERE novel_title = ?", (novel_title,)).fetchone()
+        return row["text"] if row else None
+
+    def outlines(self):
+        """{小说标题: 大纲}"""
+        with self._lock:
+            return {row["novel_title"]: row["text"] for row in self._conn.execute("SELECT novel_title, text FROM outlines")}
+
+    def put_params(self, name, value):
+        """保存一个参数文件的内容，name为文件名（如novel_params.json）"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO params (name, value, updated_at) VALUES (?, ?, ?)",
+                               (name, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def get_params(self, name, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM params WHERE name = ?", (name,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def params(self):
+        """{文件名: 内容}"""
+        with self._lock:
+            return {row["name"]: json.loads(row["value"]) for row in self._conn.execute("SELECT name, value FROM params")}
+
+    # 生成记录
+
+    def record_generation(self, chapter, kind, api_type=None, model_name=None, elapsed=None, words=None):
+        """记录一次生成（kind为chapter、outline、polish）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO generations (chapter, kind, api_type, model_name, elapsed, word_count, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chapter, kind, api_type, model_name, elapsed, words, time.time()))
+
+    def generations(self, chapter=None, limit=50):
+        sql = "SELECT * FROM generations"
+        args = []
+        if chapter is not None:
+            sql += " WHERE chapter = ?"
+            args.append(chapter)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, args)]
+
+
+def import_layout(store, save_path, params_files=()):
+    """从原来的文本目录导入：保存目录中的章节文件、outlines/中的大纲，以及params_files中的JSON文件
+
+    同一章有多个文件时按章节索引的优先顺序取一个。返回{"chapters": n, "outlines": n, "params": n}。
+    """
+    index = get_chapter_index(save_path)
+    index.refresh()
+    counts = {"chapters": 0, "outlines": 0, "params": 0}
+    for chapter in index.chapters():
+        item = index.find(chapter)
+        with open(item.path, 'r', encoding='utf-8') as f:
+            store.put_chapter(chapter, f.read())
+        counts["chapters"] += 1
+
+    outline_dir = os.path.join(save_path, OUTLINE_DIR_NAME)
+    if os.path.isdir(outline_dir):
+        with os.scandir(outline_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith("_outline.txt"):
+                    novel_title = entry.name[:-len("_outline.txt")]
+                elif entry.name.endswith("大纲.txt"):
+                    novel_title = entry.name[:-len("大纲.txt")]
+                else:
+                    continue
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    store.put_outline(novel_title, f.read())
+                counts["outlines"] += 1
+
+    for path in params_files:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                store.put_params(os.path.basename(path), json.load(f))
+            counts["params"] += 1
+    return counts
+
+
+def export_layout(store, save_path, params_dir=None):
+    """导出为原来的文本目录：保存目录/第X章.txt、保存目录/outlines/标题_outline.txt，
+    参数文件写到params_dir（不指定时不导出参数）。返回{"chapters": n, "outlines": n, "params": n}
+    """
+    os.makedirs(save_path, exist_ok=True)
+    counts = {"chapters": 0, "outlines": 0, "params": 0}
+    for item in store.list_chapters():
+        atomic_write_text(os.path.join(save_path, chapter_file_name(item["chapter"])),
+                          store.get_chapter(item["chapter"]))
+        counts["chapters"] += 1
+
+    outlines = store.outlines()
+    if outlines:
+        outline_dir = os.path.join(save_path, OUTLINE_DIR_NAME)
+        os.makedirs(outline_dir, exist_ok=True)
+        for novel_title, text in outlines.items():
+            atomic_write_text(os.path.join(outline_dir, f"{novel_title}_outline.txt"), text)
+            counts["outlines"] += 1
+
+    if params_dir is not None:
+        for name, value in store.params().items():
+            indent = 4 if name in ("novel_params.json", "user_params.json") else None
+            atomic_write_text(os.path.join(params_dir, name), json.dumps(value, ensure_ascii=False, indent=indent))
+            counts["params"] += 1
+    return counts
+
+
+_stores = StoreRegistry(PROJECT_DB_NAME, ProjectStore)
+
+
+def get_project_store(save_path, create=False):
+    """获取保存目录对应的项目数据库；数据库文件不存在且create为False时返回None"""
+    return _stores.get(save_path, create)
+
+
+def close_project_stores():
+    """关闭所有项目数据库，程序退出时调用"""
+    _stores.close_all()
+
+
+def _mirror_chapter_write(path, chapter, text):
+    """本程序保存章节时同步到所在目录的项目数据库（数据库存在时）"""
+    store = get_project_store(os.path.dirname(path) or ".")
+    if store is None:
+        return
+    try:
+        store.put_chapter(chapter, text)
+    except sqlite3.Error as e:
+        print(f"[项目数据库] 同步第{chapter}章失败: {e}")
+
+
+add_chapter_write_listener(_mirror_chapter_write)
@@ -0,0 +1,154 @@
+"""流式响应增量解码器
+
+直接处理网络收到的原始字节块，支持两种流格式：
+- sse：OpenAI格式，每个事件一行"data: {...}"，以"data: [DONE]"结束
+- ndjson：Ollama格式，每行一个JSON对象，"done": true表示结束
+
+跨字节块被截断的半行会保留到下一块再处理；每个字节块只对其中的完整行做一次正则扫描，
+直接取出需要的内容字段，不逐行json.loads，也不把整块先解码成字符串。
+
+同步（requests）和异步（aiohttp）两条调用路径共用这里的解析。
+"""
+import re
+from json.decoder import scanstring
+
+# 字符串值（不含两侧引号），JSON字符串中不会出现未转义的引号和换行
+_STRING = rb'"((?:[^"\\\n]*(?:\\.[^"\\\n]*)*))"'
+# 键后面必须紧跟冒号，避免把同名的字符串值当成键；null值不会匹配
+_SSE_CONTENT_RE = re.compile(rb'"content"[ \t]*:[ \t]*' + _STRING)
+# ndjson兼容Ollama的/api/generate（response）和/api/chat（message.content）两种格式
+_NDJSON_CONTENT_RE = re.compile(rb'"(?:response|content)"[ \t]*:[ \t]*' + _STRING)
+_SSE_DONE_RE = re.compile(rb'^[ \t]*data:[ \t]*\[DONE\][ \t]*\r?$', re.MULTILINE)
+_NDJSON_DONE_RE = re.compile(rb'"done"[ \t]*:[ \t]*true')
+
+
+class StreamDecoder:
+    """增量解码器：feed()喂入原始字节块，返回本块解析出的内容片段列表
+
+    done为True表示已收到结束标记，之后喂入的数据会被忽略。
+    """
+
+    def __init__(self, stream_format):
+        if stream_format == "sse":
+            self._content_re = _SSE_CONTENT_RE
+            self._done_re = _SSE_DONE_RE
+            self._done_hint = b"[DONE]"
+        elif stream_format == "ndjson":
+            self._content_re = _NDJSON_CONTENT_RE
+            self._done_re = _NDJSON_DONE_RE
+            self._done_hint = b"true"
+        else:
+            raise ValueError(f"不支持的流格式: {stream_format}")
+        self.stream_format = stream_format
+        self._buffer = bytearray()  # 上一块末尾未结束的半行
+        self.done = False
+        self.bytes_in = 0  # 已处理的字节数
+        self.events = 0  # 已处理的行数
+
+    def feed(self, data):
+        """处理一个字节块，返回其中完整行解析出的内容片段"""
+        if self.done or not data:
+            return []
+        self.bytes_in += len(data)
+        buffer = self._buffer
+        if buffer:
+            buffer += data
+            source = buffer
+        else:
+            # 没有残留半行时直接在新数据上扫描，不复制
+            source = data
+
+        # 只处理到最后一个换行符为止的完整行
+        end = source.rfind(b"\n") + 1
+        if end == 0:
+            if source is not buffer:
+                buffer += source
+            return []
+        contents = self._scan(source, end)
+
+        if self.done:
+            buffer.clear()
+        elif source is buffer:
+            del buffer[:end]
+        elif end < len(source):
+            buffer += source[end:]
+        return contents
+
+    def close(self):
+        """流结束时调用，处理最后一行没有换行符的数据"""
+        if self.done or not self._buffer:
+            return []
+        source = bytes(self._buffer) + b"\n"
+        self._buffer.clear()
+        return self._scan(source, len(source))
+
+    def _scan(self, source, end):
+        """扫描source[:end]中的完整行，遇到结束标记时只取到结束标记所在行"""
+        # 先用简单的子串查找排除绝大多数不含结束标记的字节块，再用正则确认
+        done_match = None
+        if source.find(self._done_hint, 0, end) != -1:
+            done_match = self._done_re.search(source, 0, end)
+        if done_match:
+            line_end = source.find(b"\n", done_match.end(), end)
+            end = end if line_end == -1 else line_end + 1
+            self.done = True
+        self.events += source.count(b"\n", 0, end)
+        contents = []
+        for match in self._content_re.finditer(source, 0, end):
+            value = match.group(1)
+            if not value:
+                continue
+            if b"\\" in value:
+                # 有转义字符（\n、\uXXXX等）时交给json的C实现处理
+                try:
+                    content = scanstring(value.decode("utf-8") + '"', 0)[0]
+                except (UnicodeDecodeError, ValueError):
+                    continue
+            else:
+                content = value.decode("utf-8", errors="replace")
+            if content:
+                contents.append(content)
+        return contents
+
+
+class StreamTextBuffer:
+    """流式文本累加器
+
+    逐个片段追加时只记录片段，不重复拷贝已收到的文本；完整文本在第一次被读取时
+    拼接一次并缓存，之后再读取不会重新拼接，直到又有新片段追加进来。
+    """
+
+    def __init__(self):
+        self._chunks = []  # 已拼接的文本（最多一段）加上之后追加的片段
+        self._length = 0
+
+    def append(self, text):
+        """追加一个片段，返回该片段在完整文本中的起始偏移"""
+        offset = self._length
+        if text:
+            self._chunks.append(text)
+            self._length += len(text)
+        return offset
+
+    def getvalue(self):
+        """返回完整文本"""
+        chunks = self._chunks
+        if not chunks:
+            return ""
+        if len(chunks) > 1:
+            # 拼接后只保留一段，下次读取时不必再拼接
+            self._chunks = chunks = ["".join(chunks)]
+        return chunks[0]
+
+    def clear(self):
+        self._chunks = []
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+    def __str__(self):
+        return self.getvalue()
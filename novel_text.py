@@ -0,0 +1,198 @@
+"""章节文本处理
+
+保存章节前的文本清理，界面和命令行批量生成共用。
+
+近似重复句子检测：每个句子取字符n-gram（默认二字组）集合，与最近的几十句直接比较
+Jaccard相似度；更早的句子用MinHash签名分段建立LSH索引，只有落在同一分段桶里的句子
+才做一次精确比较。整章只扫描一遍，比较范围（窗口）可以是前几句，也可以是整章。
+"""
+import random
+import re
+from itertools import repeat
+from zlib import crc32
+
+DEDUP_THRESHOLD = 0.6  # 二字组集合的Jaccard相似度达到该值视为重复，约相当于十字的句子改了一个字
+DEDUP_WINDOW = 4  # 默认与前4个保留的句子比较；None表示与整章所有保留的句子比较
+DEDUP_SHINGLE_SIZE = 2  # 中文按二字组切分，改一两个字的句子仍能识别
+MINHASH_BANDS = 6  # LSH分段数
+MINHASH_ROWS = 2  # 每段的签名行数，6x2在相似度0.8时漏检概率约为0.2%
+LSH_MIN_WINDOW = 32  # 最近这么多句总是直接比较，窗口更大（或为整章）时更早的句子才使用LSH索引
+
+_SENTENCE_RE = re.compile(r'[^。！？]*[。！？]|[^。！？]+')
+# 固定种子，保证同一段文本每次去重结果相同（包括不同进程之间）
+_MINHASH_SEEDS = tuple(random.Random(20240517).getrandbits(64) for _ in range(MINHASH_BANDS * MINHASH_ROWS))
+
+
+def split_sentences(text):
+    """按。！？切分句子，标点保留在句尾，最后一段没有标点时单独成句"""
+    return _SENTENCE_RE.findall(text)
+
+
+def sentence_shingles(sentence, size=DEDUP_SHINGLE_SIZE):
+    """句子（去掉两端空白后）的字符n-gram集合，不足n个字时整句作为一个n-gram"""
+    compact = sentence.strip()
+    if len(compact) <= size:
+        return {compact} if compact else set()
+    if size == 2:
+        # 二字组直接用map拼接相邻字符，避免逐个切片
+        return set(map(str.__add__, compact, compact[1:]))
+    return {compact[i:i + size] for i in range(len(compact) - size + 1)}
+
+
+def minhash_band_keys(shingles, bands=MINHASH_BANDS, rows=MINHASH_ROWS):
+    """计算MinHash签名并按段分组，返回每段的桶键"""
+    # 字符串的hash每个进程不同，先换成crc32；每个种子再与之组成元组求hash，相当于一个独立的随机排列
+    codes = list(map(crc32, map(str.encode, shingles)))
+    signature = [min(map(hash, zip(repeat(seed), codes))) for seed in _MINHASH_SEEDS[:bands * rows]]
+    if rows == 1:
+        return list(enumerate(signature))
+    return [(band,) + tuple(signature[band * rows:(band + 1) * rows]) for band in range(bands)]
+
+
+def _is_similar(shingles, other, threshold):
+    size, other_size = len(shingles), len(other)
+    # 长度相差太大时Jaccard不可能达到阈值，不必求交集
+    if size < threshold * other_size or other_size < threshold * size:
+        return False
+    common = len(shingles & other)
+    return common > 0 and common >= threshold * (size + other_size - common)
+
+
+def _find_in_buckets(buckets, keys, shingles, kept_shingles, threshold, oldest, newest):
+    """在分段桶中查找下标位于[oldest, newest)的相似句子"""
+    checked = set()
+    for key in keys:
+        bucket = buckets.get(key)
+        if not bucket:
+            continue
+        # 桶内下标递增，从最近的句子往前查，超出窗口即停止
+        for candidate in reversed(bucket):
+            if candidate < oldest:
+                break
+            if candidate >= newest or candidate in checked:
+                continue
+            checked.add(candidate)
+            if _is_similar(shingles, kept_shingles[candidate], threshold):
+                return True
+    return False
+
+
+def remove_near_duplicate_sentences(text, threshold=DEDUP_THRESHOLD, window=DEDUP_WINDOW,
+                                    shingle_size=DEDUP_SHINGLE_SIZE):
+    """去除与前面保留的句子近似重复的句子
+
+    window为向前比较的保留句子数，None表示整章。返回去重后的文本，保留句子原有的标点和换行。
+    最近LSH_MIN_WINDOW个句子直接逐个比较；窗口更大（或为整章）时，更早的句子通过MinHash分段桶查找候选句。
+    """
+    if not text:
+        return text
+
+    kept = []  # 保留的句子
+    kept_shingles = []  # 保留句子的n-gram集合，与kept一一对应
+    use_lsh = window is None or window > LSH_MIN_WINDOW
+    buckets = {}  # 分段桶键 -> 保留句子下标列表（递增）
+
+    for sentence in split_sentences(text):
+        if not sentence.strip():
+            continue
+        shingles = sentence_shingles(sentence, shingle_size)
+        index = len(kept)
+        duplicate = False
+
+        # 最近的句子直接比较
+        nearest = window if not use_lsh else LSH_MIN_WINDOW
+        for other in kept_shingles[max(0, index - nearest):]:
+            if _is_similar(shingles, other, threshold):
+                duplicate = True
+                break
+
+        keys = None
+        if use_lsh and not duplicate:
+            # 更早的句子通过MinHash分段桶查找候选
+            keys = minhash_band_keys(shingles)
+            duplicate = _find_in_buckets(buckets, keys, shingles, kept_shingles, threshold,
+                                         0 if window is None else index - window, index - nearest)
+
+        if duplicate:
+            continue
+        kept.append(sentence)
+        kept_shingles.append(shingles)
+        if keys is not None:
+            for key in keys:
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [index]
+                else:
+                    bucket.append(index)
+
+    return ''.join(kept)
+
+
+def remove_duplicate_paragraphs(text, min_length=10):
+    """去除重复的段落，同时去掉空段落和段落两端的空白；短于min_length的段落（标题等）总是保留"""
+    seen_paragraphs = set()
+    unique_paragraphs = []
+    for paragraph in text.split('\n'):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) >= min_length:
+            if paragraph in seen_paragraphs:
+                continue
+            seen_paragraphs.add(paragraph)
+        unique_paragraphs.append(paragraph)
+    return '\n'.join(unique_paragraphs)
+
+
+def remove_duplicate_content(text, window=DEDUP_WINDOW):
+    """先去除重复段落，再去除近似重复的句子"""
+    return remove_near_duplicate_sentences(remove_duplicate_paragraphs(text), window=window)
+
+
+WRAP_WIDTH = 30  # 保存时每行最多字数
+WRAP_PUNCTUATION = '。！？'  # 遇到这些标点换行
+CLOSING_QUOTES = '”’」』'  # 紧跟在标点后的右引号留在上一行
+
+_chunk_patterns = {}
+
+
+def _chunk_pattern(width, closing_quotes):
+    """按参数编译并缓存按行宽切分的正则"""
+    key = (width, closing_quotes)
+    pattern = _chunk_patterns.get(key)
+    if pattern is None:
+        quotes = f'[{re.escape(closing_quotes)}]*' if closing_quotes else ''
+        # 每段最多width个字（后面紧跟的右引号一并带上）；空行单独匹配为空串，保证join后原样保留
+        pattern = re.compile(f'[^\\n]{{1,{width}}}{quotes}|(?<![^\\n])(?![^\\n])')
+        _chunk_patterns[key] = pattern
+    return pattern
+
+
+def wrap_text(text, width=WRAP_WIDTH, punctuation=WRAP_PUNCTUATION, closing_quotes=CLOSING_QUOTES):
+    """按标点和行宽分行
+
+    在punctuation中的标点后换行，一行满width个字也换行；紧跟在换行位置后的右引号留在上一行。
+    原有的换行保留（标点后本来就有换行时不再重复），所以对分好行的文本再处理一次结果不变。
+    不含换行、标点后没有右引号的文本，结果与原来逐字符处理的方式完全相同。
+    """
+    if not text:
+        return text
+    # 先用\x00标记标点后的换行位置，右引号移到标记之前，再把标记换成换行；全部是str.replace
+    quotes = [quote for quote in closing_quotes if quote in text]
+    for mark in punctuation:
+        text = text.replace(mark, mark + '\x00')
+        for quote in quotes:
+            text = text.replace(mark + '\x00' + quote, mark + quote + '\x00')
+    # 连续的右引号（如’”）逐个移到标记之前
+    moved = True
+    while moved and len(quotes) > 1:
+        moved = False
+        for quote in quotes:
+            for following in quotes:
+                if quote + '\x00' + following in text:
+                    text = text.replace(quote + '\x00' + following, quote + following + '\x00')
+                    moved = True
+    if text.endswith('\x00'):
+        text = text[:-1]
+    text = text.replace('\x00\n', '\n').replace('\x00', '\n')
+    return '\n'.join(_chunk_pattern(width, closing_quotes).findall(text))
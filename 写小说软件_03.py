@@ -2,13 +2,14 @@ import sys
 import os
 import json
 import hashlib
+import difflib
 import random
 import re
 import requests
 import threading
 import time
 from datetime import datetime, timedelta, timezone 
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QPropertyAnimation, QEasingCurve, QSize, QTimer, QUrl, QObject, QEventLoop, QMetaObject, Q_ARG
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QPropertyAnimation, QEasingCurve, QSize, QTimer, QUrl, QObject, QEventLoop, QMetaObject, Q_ARG, QFileSystemWatcher
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
     QPushButton, QMessageBox, QFrame, QDialog, QGridLayout, QTabWidget, QTextEdit,
@@ -18,9 +19,34 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtGui import (
     QFont, QIcon, QPalette, QColor, QPixmap, QPainter, QBrush, QLinearGradient,
-    QFontDatabase
+    QFontDatabase, QTextCursor
 )
 
+from novel_http import get_session, session_pool, build_provider_request, DEFAULT_BATCH_CONCURRENCY
+from novel_stream import StreamDecoder, StreamTextBuffer
+from novel_engine import ENGINE_AVAILABLE, get_engine, shutdown_engine
+from novel_jobs import get_job_store, close_job_stores, JOB_DB_NAME, STATE_IN_FLIGHT, STATE_DONE, STATE_FAILED
+from novel_project import find_chapter_file, get_chapter_index, record_chapter_write, remove_novel_title_from_content
+# 导入时注册章节保存的监听：保存目录中有项目数据库时同步写入
+from novel_store import get_project_store, close_project_stores
+from novel_history import (get_chapter_history, close_chapter_histories, KIND_LABELS, KIND_GENERATE, KIND_POLISH,
+                           KIND_EDIT, KIND_RESTORE)
+from novel_prompts import (POLISH_PRESETS, build_outline_prompt, build_chapter_prompt, build_polish_prompt,
+                           build_continue_prompt, build_single_chapter_prompt, prompt_prefix_stats, prefix_report)
+from novel_perf import perf
+from novel_text import remove_duplicate_content, wrap_text
+from novel_cache import content_cache
+from novel_persist import PersistenceManager, get_config_document
+from novel_io import get_write_queue, close_write_queue
+from novel_memory import build_story_context, close_story_memories, estimate_tokens
+from novel_search import get_search_index, related_passages
+from novel_ollama import get_ollama_session, ollama_request_fields, start_ollama_request
+from novel_journal import (KIND_CHAPTER as JOURNAL_CHAPTER, KIND_OUTLINE as JOURNAL_OUTLINE, open_generation_journal,
+                           find_partial_generations, discard_partial, close_journal_writer)
+
+# 用户参数（API配置、保存路径等）保存在程序所在目录
+USER_PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_params.json")
+
 # ==================== 小说写作软件部分 ====================
 
 def load_icon_from_url(url, default_icon=None):
@@ -54,12 +80,19 @@ class GradientFrame(QFrame):
         painter.setBrush(gradient)
         painter.drawRect(self.rect())
 
+def report_prompt_prefix(api_type, api_url, model_name, prompt):
+    """记录本次请求的提示词，输出与上一次请求共享的前缀字节数"""
+    shared, total = prompt_prefix_stats.record((api_type, api_url, model_name), prompt)
+    if shared is not None and total:
+        print(f"[提示词] 与上一次请求共享前缀 {shared}/{total} 字节（{shared / total:.0%}）")
+
+
 class ApiCallThread(QThread):
     """API调用线程，支持流式响应"""
     progress = pyqtSignal(int)  # 进度信号
     finished = pyqtSignal(str, str)  # 完成信号，传递响应文本和状态
     error = pyqtSignal(str)  # 错误信号
-    content_update = pyqtSignal(str)  # 新增：内容更新信号，用于实时显示生成内容
+    content_delta = pyqtSignal(str, int)  # 内容增量信号：新增文本片段，片段在完整响应中的起始偏移
 
     def __init__(self, api_type, api_url, api_key, prompt, model_name, api_format=None, custom_headers=None, max_chapter_length=5000):
         super().__init__()
@@ -71,10 +104,18 @@ class ApiCallThread(QThread):
         self.api_format = api_format
         self.custom_headers = custom_headers
         self.max_chapter_length = max_chapter_length  # 最大章节字数限制
-        self.response_text = ""  # 存储响应内容
+        self.response_buffer = StreamTextBuffer()  # 存储响应内容，按片段累加，避免每个token都拷贝全文
+        self.journal = None  # 生成日志，设置后流式内容同时记录到磁盘
+        self.ollama_timer = None  # Ollama首字延迟计时
         self.running = True  # 控制线程运行的标志
         self.last_progress_time = 0  # 上次进度更新时间
         self.last_progress_value = 0  # 上次进度值
+        self.failed = False  # 出错时finished的状态为"error"
+
+    @property
+    def response_text(self):
+        """完整响应内容，只在需要时拼接一次"""
+        return self.response_buffer.getvalue()
 
     def stop(self):
         """停止API调用线程"""
@@ -89,25 +130,54 @@ class ApiCallThread(QThread):
             self.wait(1000)  # 再等待1秒确保终止
         print(f"[调试] ApiCallThread 已完全停止")
         
+    def _fail(self, error_msg):
+        """记录出错并发出error信号，finished信号随后带"error"状态"""
+        self.failed = True
+        self.error.emit(error_msg)
+
+    def _append_content(self, content):
+        """追加一段流式内容，只把新增片段通过content_delta发给界面"""
+        if not content:
+            return
+        offset = self.response_buffer.append(content)
+        if self.ollama_timer is not None:
+            self.ollama_timer.first_token()
+        if self.journal is not None:
+            self.journal.append(content)
+        # 发送增量信号，界面只需追加新片段，不必重绘全文
+        self.content_delta.emit(content, offset)
+        # 计算进度（假设最大5000字符）
+        progress = min(100, int((offset + len(content)) / 5000 * 100))
+        # 限制进度更新频率
+        current_time = time.time()
+        if (progress - self.last_progress_value >= 5 or 
+            current_time - self.last_progress_time >= 1.0):
+            self.progress.emit(progress)
+            self.last_progress_value = progress
+            self.last_progress_time = current_time
+
+    def _consume_stream(self, response, stream_format):
+        """用增量解码器处理流式响应，按网络收到的字节块解析，返回是否读到结束（被停止时返回False）"""
+        decoder = StreamDecoder(stream_format)
+        for data in response.iter_content(chunk_size=None):
+            if not self.running:  # 检查是否应该停止
+                return False
+            for content in decoder.feed(data):
+                self._append_content(content)
+            if decoder.done:
+                return True
+        for content in decoder.close():
+            self._append_content(content)
+        return True
+        
     def run(self):
         try:
             print(f"ApiCallThread开始运行，API类型: {self.api_type}")
-            if self.api_type == "Ollama":
-                self._call_ollama_api()
-            elif self.api_type == "SiliconFlow":
-                self._call_siliconflow_api()
-            elif self.api_type == "ModelScope":
-                self._call_modelscope_api()
-            elif self.api_type == "自定义":
-                self._call_custom_api()
-            else:
-                error_msg = f"不支持的API类型: {self.api_type}"
-                print(error_msg)
-                self.error.emit(error_msg)
-                return
+            report_prompt_prefix(self.api_type, self.api_url, self.model_name, self.prompt)
+            self._call_provider_api()
             
             # 完成所有响应
-            print(f"API调用完成，准备触发finished信号，response长度: {len(self.response_text)}")
+            print(f"API调用完成，准备触发finished信号，response长度: {len(self.response_buffer)}")
             print(f"response内容预览: {self.response_text[:100] if self.response_text else 'None'}...")
             
         except Exception as e:
@@ -115,360 +185,45 @@ class ApiCallThread(QThread):
             print(error_msg)
             import traceback
             print(f"异常堆栈: {traceback.format_exc()}")
-            self.error.emit(error_msg)
+            self._fail(error_msg)
         finally:
+            # 输出连接池复用情况
+            print(f"[连接池] {self.api_url} 连接统计: {session_pool.stats(self.api_url)}")
             # 确保无论如何都会触发finished信号
             if not hasattr(self, '_finished_emitted'):
-                print(f"在finally块中触发finished信号，response长度: {len(self.response_text)}")
-                self.finished.emit(self.response_text, "success")
+                # 与AsyncApiCall一致：出错为"error"，被停止为"cancelled"
+                status = "error" if self.failed else ("success" if self.running else "cancelled")
+                print(f"在finally块中触发finished信号，状态: {status}, response长度: {len(self.response_buffer)}")
+                self.finished.emit(self.response_text, status)
                 self._finished_emitted = True
     
-    def _call_ollama_api(self):
-        """调用Ollama API"""
-        headers = {"Content-Type": "application/json"}
-        data = {
-            "model": self.model_name,
-            "prompt": self.prompt,
-            "stream": True,  # 启用流式传输
-            "max_tokens": 5000,
-            "temperature": 0.7
-        }
-        
-        # 流式请求
-        with requests.post(self.api_url, headers=headers, 
-                          data=json.dumps(data), stream=True) as response:
-            if response.status_code != 200:
-                self.error.emit(f"API调用失败: {response.status_code} - 服务器暂时不可用或配置有误")
-                return
-                
-            # 处理流式响应
-            total_chars = 0
-            for line in response.iter_lines():
-                if not self.running:  # 检查是否应该停止
-                    return
-                    
-                if line:
-                    # 修复JSON解析错误：尝试直接提取response字段
-                    try:
-                        # 尝试解析为JSON
-                        chunk = json.loads(line.decode('utf-8'))
-                        if 'response' in chunk and chunk['response'] is not None:
-                            self.response_text += chunk['response']
-                            total_chars += len(chunk['response'])
-                            # 发送内容更新信号，实现实时显示
-                            self.content_update.emit(self.response_text)
-                            # 计算进度（假设最大5000字符）
-                            progress = min(100, int(total_chars / 5000 * 100))
-                            # 限制进度更新频率
-                            current_time = time.time()
-                            if (progress - self.last_progress_value >= 5 or 
-                                current_time - self.last_progress_time >= 1.0):
-                                self.progress.emit(progress)
-                                self.last_progress_value = progress
-                                self.last_progress_time = current_time
-                    except json.JSONDecodeError:
-                        # 如果不是完整JSON，尝试直接提取文本内容
-                        line_str = line.decode('utf-8')
-                        if 'response' in line_str:
-                            # 尝试提取response内容
-                            try:
-                                start_idx = line_str.find('"response":"') + len('"response":"')
-                                end_idx = line_str.find('"', start_idx)
-                                response_chunk = line_str[start_idx:end_idx]
-                                self.response_text += response_chunk
-                                total_chars += len(response_chunk)
-                                # 发送内容更新信号，实现实时显示
-                                self.content_update.emit(self.response_text)
-                                progress = min(100, int(total_chars / 5000 * 100))
-                                self.progress.emit(progress)
-                            except:
-                                # 如果提取失败，忽略这一行
-                                pass
-    
-    def _call_siliconflow_api(self):
-        """调用SiliconFlow API"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        data = {
-            "model": self.model_name,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": self.prompt
-                }
-            ],
-            "stream": True,  # 启用流式传输
-            "max_tokens": 5000,
-            "temperature": 0.7
-        }
-        
-        # 流式请求
-        with requests.post(self.api_url, headers=headers, 
-                          data=json.dumps(data), stream=True) as response:
-            if response.status_code != 200:
-                self.error.emit(f"API调用失败: {response.status_code} - 服务器暂时不可用或配置有误")
-                return
-                
-            # 处理流式响应
-            total_chars = 0
-            for line in response.iter_lines():
-                if not self.running:  # 检查是否应该停止
-                    return
-                    
-                if line:
-                    # 处理SiliconFlow的流式响应格式
-                    line_str = line.decode('utf-8')
-                    if line_str.startswith("data: "):
-                        line_str = line_str[6:]  # 移除"data: "前缀
-                        
-                    if line_str == "[DONE]":
-                        break
-                        
-                    try:
-                        # 尝试解析为JSON
-                        chunk = json.loads(line_str)
-                        if 'choices' in chunk and len(chunk['choices']) > 0:
-                            choice = chunk['choices'][0]
-                            if 'delta' in choice and 'content' in choice['delta']:
-                                content = choice['delta']['content']
-                                if content is not None:  # 检查content是否为None
-                                    self.response_text += content
-                                    total_chars += len(content)
-                                    # 发送内容更新信号，实现实时显示
-                                    self.content_update.emit(self.response_text)
-                                    # 计算进度（假设最大5000字符）
-                                    progress = min(100, int(total_chars / 5000 * 100))
-                                    # 限制进度更新频率
-                                    current_time = time.time()
-                                    if (progress - self.last_progress_value >= 5 or 
-                                        current_time - self.last_progress_time >= 1.0):
-                                        self.progress.emit(progress)
-                                        self.last_progress_value = progress
-                                        self.last_progress_time = current_time
-                    except json.JSONDecodeError:
-                        # 如果不是完整JSON，尝试直接提取内容
-                        if '"content":"' in line_str:
-                            try:
-                                start_idx = line_str.find('"content":"') + len('"content":"')
-                                end_idx = line_str.find('"', start_idx)
-                                content = line_str[start_idx:end_idx]
-                                if content is not None:  # 检查content是否为None
-                                    self.response_text += content
-                                    total_chars += len(content)
-                                    # 发送内容更新信号，实现实时显示
-                                    self.content_update.emit(self.response_text)
-                                    progress = min(100, int(total_chars / 5000 * 100))
-                                    self.progress.emit(progress)
-                            except:
-                                # 如果提取失败，忽略这一行
-                                    pass
-    
-    def _call_modelscope_api(self):
-        """调用ModelScope API"""
-        print(f"开始调用ModelScope API: {self.api_url}")
+    def _call_provider_api(self):
+        """按服务商构建请求（与异步生成引擎共用build_provider_request），发送流式请求并处理响应"""
+        print(f"开始调用{self.api_type} API: {self.api_url}")
         print(f"使用模型: {self.model_name}")
-        print(f"API密钥: {self.api_key[:10]}..." if len(self.api_key) > 10 else "API密钥为空")
-        
-        # 验证API密钥
-        if not self.api_key or len(self.api_key.strip()) == 0:
-            error_msg = "API密钥为空，请检查ModelScope API配置"
-            print(error_msg)
-            self.error.emit(error_msg)
+        try:
+            # Ollama请求带上批量生成期间的keep_alive和按提示词长度设置的num_ctx
+            request = build_provider_request(self.api_type, self.api_url, self.api_key, self.model_name,
+                                             self.prompt, self.api_format, self.custom_headers,
+                                             self.max_chapter_length,
+                                             **ollama_request_fields(self.api_type, self.api_url,
+                                                                     self.model_name, self.prompt))
+        except ValueError as e:
+            print(str(e))
+            self._fail(str(e))
             return
+        self.ollama_timer = start_ollama_request(self.api_type, self.api_url, self.model_name)
         
         try:
-            # 设置请求头 - ModelScope API使用特定的认证格式
-            headers = {
-                "Authorization": f"Bearer {self.api_key.strip()}",
-                "Content-Type": "application/json",
-                "User-Agent": "ModelScope-Client/1.0"
-            }
-            
-            # 动态计算max_tokens，根据用户设置的字数限制
-            # 假设中文字符与token的比例约为1:1.5（保守估计）
-            max_chars = self.max_chapter_length  # 直接使用用户设置的值
-            max_tokens = int(max_chars * 1.5)  # 转换为token数
-            
-            # 构建请求数据 - 启用流式传输
-            data = {
-                "model": self.model_name,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": self.prompt
-                    }
-                ],
-                "max_tokens": max_tokens,  # 动态设置最大token数
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "stream": True  # 启用流式传输
-            }
-            
-            print(f"请求数据: {json.dumps(data, ensure_ascii=False)}")
-            print(f"请求头: {headers}")
-            
-            # 发送流式请求
+            # 流式请求，使用with确保连接用完后归还连接池
             print("发送流式API请求...")
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                data=json.dumps(data),
+            with get_session(self.api_url, self.api_type).post(
+                request.url,
+                headers=request.headers,
+                data=json.dumps(request.payload),
                 stream=True,
-                timeout=60
-            )
-            
-            print(f"响应状态码: {response.status_code}")
-            print(f"响应头: {response.headers}")
-            
-            if response.status_code != 200:
-                error_msg = f"API调用失败: {response.status_code} - 服务器暂时不可用或配置有误"
-                try:
-                    error_detail = response.json()
-                    print(f"错误详情: {error_detail}")
-                    if "error" in error_detail:
-                        error_msg += f" - {error_detail['error']}"
-                    elif "message" in error_detail:
-                        error_msg += f" - {error_detail['message']}"
-                except:
-                    error_msg += f" - {response.text[:200]}"
-                print(error_msg)
-                self.error.emit(error_msg)
-                return
-            
-            # 处理流式响应
-            total_chars = 0
-            for line in response.iter_lines():
-                if not self.running:  # 检查是否应该停止
-                    return
-                    
-                if line:
-                    line_str = line.decode('utf-8')
-                    
-                    # 处理流式响应格式
-                    if line_str.startswith("data: "):
-                        line_str = line_str[6:]  # 移除"data: "前缀
-                        
-                    if line_str == "[DONE]":
-                        break
-                        
-                    try:
-                        # 尝试解析为JSON
-                        chunk = json.loads(line_str)
-                        if 'choices' in chunk and len(chunk['choices']) > 0:
-                            choice = chunk['choices'][0]
-                            if 'delta' in choice and 'content' in choice['delta']:
-                                content = choice['delta']['content']
-                                if content is not None:  # 检查content是否为None
-                                    self.response_text += content
-                                    total_chars += len(content)
-                                    # 发送内容更新信号，实现实时显示
-                                    self.content_update.emit(self.response_text)
-                                    # 计算进度（假设最大5000字符）
-                                    progress = min(100, int(total_chars / 5000 * 100))
-                                    # 限制进度更新频率
-                                    current_time = time.time()
-                                    if (progress - self.last_progress_value >= 5 or 
-                                        current_time - self.last_progress_time >= 1.0):
-                                        self.progress.emit(progress)
-                                        self.last_progress_value = progress
-                                        self.last_progress_time = current_time
-                    except json.JSONDecodeError:
-                        # 如果不是完整JSON，尝试直接提取内容
-                        if '"content":"' in line_str:
-                            try:
-                                start_idx = line_str.find('"content":"') + len('"content":"')
-                                end_idx = line_str.find('"', start_idx)
-                                content = line_str[start_idx:end_idx]
-                                if content is not None:  # 检查content是否为None
-                                    self.response_text += content
-                                    total_chars += len(content)
-                                    # 发送内容更新信号，实现实时显示
-                                    self.content_update.emit(self.response_text)
-                                    progress = min(100, int(total_chars / 5000 * 100))
-                                    self.progress.emit(progress)
-                            except:
-                                # 如果提取失败，忽略这一行
-                                pass
-            
-        except requests.exceptions.Timeout:
-            error_msg = "API调用超时，可能是网络连接不稳定或服务器响应较慢。请检查网络连接或减小生成长度。"
-            print(error_msg)
-            self.error.emit(error_msg)
-            
-        except requests.exceptions.ConnectionError:
-            error_msg = "网络连接失败，请检查网络是否正常"
-            print(error_msg)
-            self.error.emit(error_msg)
-            
-        except requests.exceptions.HTTPError as e:
-            error_msg = f"HTTP错误: {str(e)}"
-            print(error_msg)
-            self.error.emit(error_msg)
-            
-        except Exception as e:
-            error_msg = f"ModelScope API调用错误: {str(e)}"
-            print(error_msg)
-            import traceback
-            print(f"异常堆栈: {traceback.format_exc()}")
-            self.error.emit(error_msg)
-        # 移除else分支，避免重复发送finished信号
-        # finished信号将在run方法的finally块中发送
-    
-    def _call_custom_api(self):
-        """调用自定义API"""
-        print(f"开始调用自定义API: {self.api_url}")
-        print(f"API格式: {self.api_format}")
-        
-        try:
-            # 解析自定义请求头
-            headers = {"Content-Type": "application/json"}
-            if self.custom_headers:
-                try:
-                    custom_headers = json.loads(self.custom_headers)
-                    headers.update(custom_headers)
-                    print(f"自定义请求头: {headers}")
-                except json.JSONDecodeError:
-                    print("警告：自定义请求头格式错误，请确保是有效的JSON格式")
-                    self.error.emit("自定义请求头格式错误，请确保是有效的JSON格式")
-                    return
-            else:
-                print("使用默认请求头")
-            
-            # 动态计算max_tokens，根据用户设置的字数限制
-            max_chars = self.max_chapter_length  # 直接使用用户设置的值
-            max_tokens = int(max_chars * 1.5)  # 转换为token数
-            
-            # 根据API格式构建请求数据
-            if self.api_format == "OpenAI格式":
-                data = {
-                    "model": self.model_name,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": self.prompt
-                        }
-                    ],
-                    "stream": True,  # 启用流式传输
-                    "max_tokens": max_tokens,  # 动态设置最大token数
-                    "temperature": 0.7
-                }
-            else:  # Ollama格式
-                data = {
-                    "model": self.model_name,
-                    "prompt": self.prompt,
-                    "stream": True,  # 启用流式传输
-                    "max_tokens": max_tokens,  # 动态设置最大token数
-                    "temperature": 0.7
-                }
-            
-            print(f"请求数据: {json.dumps(data, ensure_ascii=False)}")
-            
-            # 流式请求
-            print("发送API请求...")
-            with requests.post(self.api_url, headers=headers, 
-                              data=json.dumps(data), stream=True) as response:
+                timeout=request.timeout
+            ) as response:
                 print(f"响应状态码: {response.status_code}")
                 if response.status_code != 200:
                     error_msg = f"API调用失败: {response.status_code} - 服务器暂时不可用或配置有误"
@@ -482,116 +237,23 @@ class ApiCallThread(QThread):
                     except:
                         error_msg += f" - {response.text[:200]}"
                     print(error_msg)
-                    self.error.emit(error_msg)
+                    self._fail(error_msg)
                     return
-                    
+                
                 # 处理流式响应
-                print("开始处理流式响应...")
-                total_chars = 0
-                for line in response.iter_lines():
-                    if not self.running:  # 检查是否应该停止
-                        print("API调用被停止")
-                        return
-                        
-                    if line:
-                        # 根据API格式处理响应
-                        if self.api_format == "OpenAI格式":
-                            # 处理OpenAI格式的流式响应
-                            line_str = line.decode('utf-8')
-                            if line_str.startswith("data: "):
-                                line_str = line_str[6:]  # 移除"data: "前缀
-                                
-                            if line_str == "[DONE]":
-                                print("OpenAI API响应完成")
-                                break
-                                
-                            try:
-                                # 尝试解析为JSON
-                                chunk = json.loads(line_str)
-                                if 'choices' in chunk and len(chunk['choices']) > 0:
-                                    choice = chunk['choices'][0]
-                                    if 'delta' in choice and 'content' in choice['delta']:
-                                        content = choice['delta']['content']
-                                        if content is not None:  # 检查content是否为None
-                                            self.response_text += content
-                                            total_chars += len(content)
-                                            # 发送内容更新信号，实现实时显示
-                                            self.content_update.emit(self.response_text)
-                                            # 计算进度（假设最大5000字符）
-                                            progress = min(100, int(total_chars / 5000 * 100))
-                                            # 限制进度更新频率
-                                            current_time = time.time()
-                                            if (progress - self.last_progress_value >= 5 or 
-                                                current_time - self.last_progress_time >= 1.0):
-                                                self.progress.emit(progress)
-                                                self.last_progress_value = progress
-                                                self.last_progress_time = current_time
-                            except json.JSONDecodeError:
-                                # 如果不是完整JSON，尝试直接提取内容
-                                if '"content":"' in line_str:
-                                    try:
-                                        start_idx = line_str.find('"content":"') + len('"content":"')
-                                        end_idx = line_str.find('"', start_idx)
-                                        content = line_str[start_idx:end_idx]
-                                        if content is not None:  # 检查content是否为None
-                                            self.response_text += content
-                                            total_chars += len(content)
-                                            # 发送内容更新信号，实现实时显示
-                                            self.content_update.emit(self.response_text)
-                                            progress = min(100, int(total_chars / 5000 * 100))
-                                            self.progress.emit(progress)
-                                    except:
-                                        # 如果提取失败，忽略这一行
-                                        pass
-                        else:  # Ollama格式
-                            # 处理Ollama格式的流式响应
-                            try:
-                                # 尝试解析为JSON
-                                chunk = json.loads(line.decode('utf-8'))
-                                if 'response' in chunk and chunk['response'] is not None:
-                                    self.response_text += chunk['response']
-                                    total_chars += len(chunk['response'])
-                                    # 发送内容更新信号，实现实时显示
-                                    self.content_update.emit(self.response_text)
-                                    # 计算进度（假设最大5000字符）
-                                    progress = min(100, int(total_chars / 5000 * 100))
-                                    # 限制进度更新频率
-                                    current_time = time.time()
-                                    if (progress - self.last_progress_value >= 5 or 
-                                        current_time - self.last_progress_time >= 1.0):
-                                        self.progress.emit(progress)
-                                        self.last_progress_value = progress
-                                        self.last_progress_time = current_time
-                            except json.JSONDecodeError:
-                                # 如果不是完整JSON，尝试直接提取文本内容
-                                line_str = line.decode('utf-8')
-                                if 'response' in line_str:
-                                    # 尝试提取response内容
-                                    try:
-                                        start_idx = line_str.find('"response":"') + len('"response":"')
-                                        end_idx = line_str.find('"', start_idx)
-                                        response_chunk = line_str[start_idx:end_idx]
-                                        self.response_text += response_chunk
-                                        total_chars += len(response_chunk)
-                                        # 发送内容更新信号，实现实时显示
-                                        self.content_update.emit(self.response_text)
-                                        progress = min(100, int(total_chars / 5000 * 100))
-                                        # 限制进度更新频率
-                                        current_time = time.time()
-                                        if (progress - self.last_progress_value >= 5 or 
-                                            current_time - self.last_progress_time >= 1.0):
-                                            self.progress.emit(progress)
-                                            self.last_progress_value = progress
-                                            self.last_progress_time = current_time
-                                    except:
-                                        # 如果提取失败，忽略这一行
-                                        pass
-        except Exception as e:
-            error_msg = f"自定义API调用错误: {str(e)}"
+                if not self._consume_stream(response, request.stream_format):
+                    print("API调用被停止")
+            
+        except requests.exceptions.Timeout:
+            error_msg = "API调用超时，可能是网络连接不稳定或服务器响应较慢。请检查网络连接或减小生成长度。"
+            print(error_msg)
+            self._fail(error_msg)
+            
+        except requests.exceptions.ConnectionError:
+            error_msg = "网络连接失败，请检查网络是否正常"
             print(error_msg)
-            self.error.emit(error_msg)
-        # 移除else分支，避免重复发送finished信号
-        # finished信号将在run方法的finally块中发送
+            self._fail(error_msg)
+        # 其他异常由run统一处理；finished信号在run方法的finally块中发送
     
     def stop(self):
         """停止API调用线程"""
@@ -607,6 +269,349 @@ class ApiCallThread(QThread):
         print("[调试] ApiCallThread 已完全停止")
 
 
+class AsyncApiCall(QObject):
+    """基于异步生成引擎的API调用，信号和start/stop/wait接口与ApiCallThread一致
+
+    请求在生成引擎的后台事件循环中执行，所有调用共用一个线程，
+    信号从引擎线程发出，由Qt以队列方式送到接收方所在线程。
+    """
+    progress = pyqtSignal(int)  # 进度信号
+    finished = pyqtSignal(str, str)  # 完成信号，传递响应文本和状态
+    error = pyqtSignal(str)  # 错误信号
+    content_delta = pyqtSignal(str, int)  # 内容增量信号：新增文本片段，片段在完整响应中的起始偏移
+
+    def __init__(self, api_type, api_url, api_key, prompt, model_name, api_format=None, custom_headers=None, max_chapter_length=5000):
+        super().__init__()
+        self.api_type = api_type
+        self.api_url = api_url
+        self.api_key = api_key
+        self.prompt = prompt
+        self.model_name = model_name
+        self.api_format = api_format
+        self.custom_headers = custom_headers
+        self.max_chapter_length = max_chapter_length  # 最大章节字数限制
+        self.response_text = ""  # 存储响应内容
+        self.journal = None  # 生成日志，设置后流式内容同时记录到磁盘
+        self.ollama_timer = None  # Ollama首字延迟计时
+        self.job = None  # 生成引擎中的任务
+        self.last_progress_time = 0  # 上次进度更新时间
+        self.last_progress_value = 0  # 上次进度值
+
+    def start(self):
+        """把请求提交给生成引擎，立即返回"""
+        print(f"AsyncApiCall开始运行，API类型: {self.api_type}")
+        try:
+            request = build_provider_request(self.api_type, self.api_url, self.api_key, self.model_name,
+                                             self.prompt, self.api_format, self.custom_headers,
+                                             self.max_chapter_length,
+                                             **ollama_request_fields(self.api_type, self.api_url,
+                                                                     self.model_name, self.prompt))
+        except ValueError as e:
+            print(str(e))
+            self.error.emit(str(e))
+            self.finished.emit("", "error")
+            return
+        report_prompt_prefix(self.api_type, self.api_url, self.model_name, self.prompt)
+        self.ollama_timer = start_ollama_request(self.api_type, self.api_url, self.model_name)
+        self.job = get_engine().submit(request, on_delta=self._on_delta,
+                                       on_done=self._on_done, on_error=self.error.emit)
+
+    def _on_delta(self, chunk, offset):
+        """引擎线程中调用：转发内容增量并按频率限制更新进度"""
+        if self.ollama_timer is not None:
+            self.ollama_timer.first_token()
+        if self.journal is not None:
+            self.journal.append(chunk)
+        self.content_delta.emit(chunk, offset)
+        # 计算进度（假设最大5000字符）
+        progress = min(100, int((offset + len(chunk)) / 5000 * 100))
+        current_time = time.time()
+        if (progress - self.last_progress_value >= 5 or 
+            current_time - self.last_progress_time >= 1.0):
+            self.progress.emit(progress)
+            self.last_progress_value = progress
+            self.last_progress_time = current_time
+
+    def _on_done(self, response_text, status):
+        """引擎线程中调用：任务结束（成功、出错或被取消）时触发finished信号"""
+        self.response_text = response_text
+        print(f"API调用完成，状态: {status}, response长度: {len(response_text)}")
+        print(f"[连接池] {self.api_url} 连接统计: {get_engine().stats(self.api_url)}")
+        self.finished.emit(response_text, status)
+
+    def isRunning(self):
+        return self.job is not None and not self.job.is_done()
+
+    def wait(self, msecs=None):
+        """等待请求结束，返回是否已结束"""
+        if self.job is None:
+            return True
+        return self.job.wait(None if msecs is None else msecs / 1000)
+
+    def stop(self):
+        """取消请求并等待引擎确认"""
+        print("[调试] AsyncApiCall.stop() 被调用")
+        if self.job is not None:
+            self.job.cancel()
+            if not self.wait(2000):
+                print("[调试] AsyncApiCall 未在2秒内停止")
+        print("[调试] AsyncApiCall 已停止")
+
+    def terminate(self):
+        """与QThread接口保持一致，异步请求直接取消即可"""
+        if self.job is not None:
+            self.job.cancel()
+
+    def quit(self):
+        self.terminate()
+
+
+def create_api_call(api_type, api_url, api_key, prompt, model_name, api_format=None, custom_headers=None, max_chapter_length=5000):
+    """创建API调用对象：安装了aiohttp时使用异步生成引擎，否则退回到每次调用一个线程的ApiCallThread"""
+    if ENGINE_AVAILABLE:
+        return AsyncApiCall(api_type, api_url, api_key, prompt, model_name, api_format, custom_headers, max_chapter_length)
+    return ApiCallThread(api_type, api_url, api_key, prompt, model_name, api_format, custom_headers, max_chapter_length)
+
+
+class StreamRenderer(QObject):
+    """流式内容渲染器：把收到的增量先缓存起来，按固定帧率一次性追加到文本框
+
+    快速的服务商每秒会推送几百个片段，逐个插入并滚动会占满GUI线程。
+    这里每帧最多插入一次、滚动一次，不强制重绘，由Qt在下一次绘制时统一刷新。
+    """
+
+    DEFAULT_FPS = 30
+
+    def __init__(self, text_edit, fps=DEFAULT_FPS, status_bar=None, parent=None):
+        super().__init__(parent)
+        self.text_edit = text_edit
+        self.status_bar = status_bar
+        self.pending = []  # 尚未显示的片段
+        self.clear_pending = False  # 下一帧显示前先清空文本框（新一轮生成开始）
+        self.status_message = None  # 下一帧要显示的状态栏消息
+        self.timer = QTimer(self)
+        self.timer.setInterval(max(1, int(1000 / fps)))
+        self.timer.timeout.connect(self.flush)
+
+    def append(self, chunk, offset, status_message=None):
+        """缓存一个增量片段；offset为0表示新一轮生成，显示前清空旧内容"""
+        perf.incr("stream_render_deltas")
+        if offset == 0:
+            # 新一轮生成的第一个片段，之前缓存的片段不再显示
+            self.pending = []
+            self.clear_pending = True
+        if chunk:
+            self.pending.append(chunk)
+        if status_message is not None:
+            self.status_message = status_message
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """把缓存的片段一次性追加到文本框末尾，并滚动到底部"""
+        if not self.pending and not self.clear_pending:
+            self.timer.stop()
+            if self.status_message is not None and self.status_bar is not None:
+                self.status_bar.showMessage(self.status_message)
+                self.status_message = None
+            return
+        perf.incr("stream_render_flushes")
+        if self.clear_pending:
+            self.text_edit.clear()
+            self.clear_pending = False
+        if self.pending:
+            text = "".join(self.pending)
+            self.pending = []
+            cursor = QTextCursor(self.text_edit.document())
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(text)
+        if self.status_message is not None and self.status_bar is not None:
+            self.status_bar.showMessage(self.status_message)
+            self.status_message = None
+        scroll_bar = self.text_edit.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+
+    def discard(self):
+        """丢弃尚未显示的片段（生成结束后界面会直接设置完整内容）"""
+        self.pending = []
+        self.clear_pending = False
+        self.status_message = None
+        self.timer.stop()
+
+    def reset(self):
+        """丢弃尚未显示的片段并立即清空文本框"""
+        self.discard()
+        self.text_edit.clear()
+
+
+def _chapter_sort_key(file_name):
+    """章节文件名按章节号排序，章节号相同时按文件名"""
+    match = re.search(r'第(\d+)章', file_name)
+    return (int(match.group(1)) if match else 0, file_name)
+
+
+class ProjectCatalog(QObject):
+    """保存目录中章节文件和大纲文件的目录，由QFileSystemWatcher驱动增量更新
+
+    建立时扫描一次保存目录和outlines目录；之后只在监视到目录变化时重新列出变化的那个目录，
+    与已知的文件名比较得到增删，只对新增或被改动的大纲文件取修改时间。
+    短时间内的多次变化（批量生成连续保存章节）合并为一次更新。
+    润色页的章节下拉框和启动时的大纲加载都从这里取数据，切换页面不再扫描目录。
+    """
+
+    REFRESH_DELAY_MS = 200  # 目录变化后等待这么久再更新，合并连续的变化
+    chapters_changed = pyqtSignal()
+    outlines_changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.root = None
+        self.outline_dir = None
+        self.chapter_files = []  # 章节文件名，按章节号排序
+        self.outlines = {}  # 大纲文件名 -> 修改时间
+        self._dirty_dirs = set()
+        self._dirty_outlines = set()
+        self._ancestor = None  # 保存目录还不存在时监视的最近一级已存在的上级目录
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._on_directory_changed)
+        self.watcher.fileChanged.connect(self._on_file_changed)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.REFRESH_DELAY_MS)
+        self.timer.timeout.connect(self.apply_changes)
+
+    @staticmethod
+    def is_chapter_file(name):
+        return name.startswith("第") and name.endswith("章.txt")
+
+    @staticmethod
+    def is_outline_file(name):
+        return name.endswith("_outline.txt") or name.endswith("大纲.txt")
+
+    def set_root(self, save_path):
+        """切换到另一个保存目录，目录不变时什么也不做"""
+        root = os.path.abspath(save_path)
+        if root == self.root:
+            return
+        paths = self.watcher.directories() + self.watcher.files()
+        if paths:
+            self.watcher.removePaths(paths)
+        self.root = root
+        self.outline_dir = os.path.join(root, "outlines")
+        self._ancestor = None
+        self._dirty_dirs.clear()
+        self._dirty_outlines.clear()
+        self.timer.stop()
+        self.chapter_files = sorted(self._list_names(self.root, self.is_chapter_file), key=_chapter_sort_key)
+        self.outlines = {}
+        self._update_outlines(self._list_names(self.outline_dir, self.is_outline_file), set())
+        self._watch()
+        perf.incr("project_catalog_full_scans")
+        self.chapters_changed.emit()
+        self.outlines_changed.emit()
+
+    def _list_names(self, directory, accept):
+        """列出目录中符合条件的文件名（只读目录项，不逐个stat），目录不存在时返回空集合"""
+        try:
+            with os.scandir(directory) as entries:
+                return {entry.name for entry in entries if accept(entry.name) and entry.is_file()}
+        except OSError:
+            return set()
+
+    def _watch(self):
+        """监视保存目录、大纲目录和各个大纲文件；保存目录还不存在时监视最近一级已存在的上级目录，
+        等保存目录被创建后再改为监视保存目录"""
+        watched = set(self.watcher.directories()) | set(self.watcher.files())
+        ancestor = None
+        if not os.path.isdir(self.root):
+            ancestor = os.path.dirname(self.root)
+            while ancestor and not os.path.isdir(ancestor) and os.path.dirname(ancestor) != ancestor:
+                ancestor = os.path.dirname(ancestor)
+            if not os.path.isdir(ancestor):
+                ancestor = None
+        if ancestor != self._ancestor:
+            if self._ancestor is not None and self._ancestor in watched:
+                self.watcher.removePath(self._ancestor)
+                watched.discard(self._ancestor)
+            self._ancestor = ancestor
+            if ancestor is not None and ancestor not in watched:
+                self.watcher.addPath(ancestor)
+                watched.add(ancestor)
+        paths = [path for path in [self.root, self.outline_dir] if os.path.isdir(path)]
+        paths += [os.path.join(self.outline_dir, name) for name in self.outlines]
+        paths = [path for path in paths if path not in watched and os.path.exists(path)]
+        if paths:
+            self.watcher.addPaths(paths)
+
+    def _update_outlines(self, names, changed):
+        """根据大纲目录的新文件名集合更新，只对新增和changed中的文件取修改时间，返回是否有变化"""
+        updated = False
+        for name in set(self.outlines) - names:
+            del self.outlines[name]
+            updated = True
+        for name in names:
+            if name in self.outlines and name not in changed:
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(self.outline_dir, name))
+            except OSError:
+                continue
+            if self.outlines.get(name) != mtime:
+                self.outlines[name] = mtime
+                updated = True
+        return updated
+
+    def _on_directory_changed(self, path):
+        self._dirty_dirs.add(os.path.abspath(path))
+        self.timer.start()
+
+    def _on_file_changed(self, path):
+        self._dirty_outlines.add(os.path.basename(path))
+        self.timer.start()
+
+    def apply_changes(self):
+        """处理积累的目录变化，只重新列出发生变化的目录"""
+        dirty_dirs, self._dirty_dirs = self._dirty_dirs, set()
+        dirty_outlines, self._dirty_outlines = self._dirty_outlines, set()
+        if self.root is None:
+            return
+        perf.incr("project_catalog_updates")
+        if self._ancestor is not None and os.path.isdir(self.root):
+            # 保存目录刚被创建（可能连同其中的文件），完整列出保存目录和大纲目录
+            dirty_dirs.update((self.root, self.outline_dir))
+        chapters_updated = False
+        if self.root in dirty_dirs:
+            names = self._list_names(self.root, self.is_chapter_file)
+            known = set(self.chapter_files)
+            if names != known:
+                kept = [name for name in self.chapter_files if name in names]
+                self.chapter_files = sorted(kept + list(names - known), key=_chapter_sort_key)
+                chapters_updated = True
+            # 大纲目录可能是刚创建的
+            if os.path.isdir(self.outline_dir) and self.outline_dir not in self.watcher.directories():
+                dirty_dirs.add(self.outline_dir)
+        outlines_updated = False
+        if self.outline_dir in dirty_dirs or dirty_outlines:
+            names = self._list_names(self.outline_dir, self.is_outline_file)
+            outlines_updated = self._update_outlines(names, dirty_outlines)
+        # 被替换（临时文件改名）的大纲文件会从监视列表中移除，重新加入
+        self._watch()
+        if chapters_updated:
+            self.chapters_changed.emit()
+        if outlines_updated:
+            self.outlines_changed.emit()
+
+    def latest_outline(self):
+        """最近修改的大纲，返回(小说标题, 文件路径)，没有时返回(None, None)"""
+        if not self.outlines:
+            return None, None
+        file_name = max(self.outlines, key=self.outlines.get)
+        if file_name.endswith("_outline.txt"):
+            title = file_name[:-len("_outline.txt")]
+        else:
+            title = file_name[:-len("大纲.txt")]
+        return title, os.path.join(self.outline_dir, file_name)
+
 
 class AutoSaveThread(QThread):
     """自动保存线程，用于在后台自动保存小说内容"""
@@ -652,8 +657,10 @@ class ChapterGenerator(QThread):
     progress = pyqtSignal(int, int, int)  # 当前章节，总章节，进度百分比
     finished = pyqtSignal()
     error = pyqtSignal(str, int)  # 错误信息，章节号
+    content_delta = pyqtSignal(int, str, int)  # 章节号，新增文本片段，片段起始偏移
 
-    def __init__(self, app, start_chapter, end_chapter, overwrite_existing=False, read_previous_chapter=True):
+    def __init__(self, app, start_chapter, end_chapter, overwrite_existing=False, read_previous_chapter=True, concurrency=1,
+                 job_store=None, batch_id=None):
         super().__init__()
         self.app = app
         self.start_chapter = start_chapter
@@ -664,6 +671,22 @@ class ChapterGenerator(QThread):
         self.paused = False
         self.current_chapter = start_chapter
         self.generation_queue = []  # 用于存储待生成的章节信息
+        # 读取上一章内容时各章依次依赖，只能逐章生成；否则最多同时生成concurrency章
+        self.concurrency = 1 if read_previous_chapter else max(1, concurrency)
+        self.parallel_lock = threading.RLock()  # 并行模式下保护以下状态
+        self.next_chapter = start_chapter  # 下一个待派发的章节
+        self.next_to_save = start_chapter  # 下一个待按顺序保存的章节
+        self.in_flight = {}  # 章节号 -> 进行中的API调用
+        self.partial_texts = {}  # 章节号 -> 已收到的流式内容
+        self.journals = {}  # 章节号 -> 生成日志，章节写盘完成后删除
+        self.completed = {}  # 章节号 -> (结果类型, 章节标题, 内容)，等待前面章节完成后保存
+        self.serial_chapter = None  # 逐章生成时正在生成的章节
+        self.preview_chapter = None  # 正在实时预览的章节
+        self.parallel_finished = False
+        self.job_store = job_store  # 持久化任务表，为None时不记录
+        self.batch_id = batch_id
+        # 继续被中断的任务时，任务表中已完成的章节直接跳过，不再读取章节文件
+        self.skip_chapters = job_store.chapters_to_skip(batch_id) if job_store is not None else set()
 
     def run(self):
         print(f"[调试] ChapterGenerator.run方法被调用，起始章节: {self.start_chapter}, 结束章节: {self.end_chapter}")
@@ -677,35 +700,38 @@ class ChapterGenerator(QThread):
         print(f"[调试] 当前章节设置为: {self.current_chapter}")
         
         # 开始异步生成章节
-        print(f"[调试] 准备调用QTimer.singleShot触发_generate_next_chapter")
-        QTimer.singleShot(100, self._generate_next_chapter)
-        print(f"[调试] QTimer.singleShot已调用")
+        if self.concurrency > 1:
+            QTimer.singleShot(100, self._start_parallel_generation)
+        else:
+            print(f"[调试] 准备调用QTimer.singleShot触发_generate_next_chapter")
+            QTimer.singleShot(100, self._generate_next_chapter)
+            print(f"[调试] QTimer.singleShot已调用")
         
         # 启动事件循环，确保QTimer能正常工作
         print(f"[调试] 启动事件循环")
         self.exec()
 
     def save_chapter(self, chapter_num, title, content):
-        """保存章节内容到文件"""
+        """把章节内容提交给后台写盘队列
+
+        提交了写入时返回True，写完后在任务表中记录完成（失败时记录失败）；
+        跳过保存或等待用户确认覆盖时返回False，由调用方直接记录。
+        """
         # 使用章节保存路径
-        chapter_save_path = self.chapter_path if hasattr(self, 'chapter_path') else "zhangjie"
+        file_path = self._chapter_file_path(chapter_num)
+        chapter_save_path = os.path.dirname(file_path)
         if not os.path.exists(chapter_save_path):
             try:
                 os.makedirs(chapter_save_path)
                 print(f"[调试] 创建章节目录: {chapter_save_path}")
             except Exception as e:
                 self.error.emit(f"创建章节目录失败: {str(e)}", chapter_num)
-                return
+                return False
         
         # 获取小说标题
         novel_title_input = getattr(self.app, 'novel_title_input', None)
         novel_title = novel_title_input.text().strip() if novel_title_input else "未命名小说"
         
-        # 使用简化的命名格式：第X章.txt
-        # 不再包含章节标题和小说标题，只使用章节号
-        file_name = f"第{chapter_num}章.txt"
-        file_path = os.path.join(chapter_save_path, file_name)
-        
         # 检查文件是否已存在
         if os.path.exists(file_path):
             # 根据文件行为设置决定如何处理已存在章节
@@ -717,32 +743,54 @@ class ChapterGenerator(QThread):
                     # 处理章节内容，移除可能存在的小说标题
                     processed_content = self._remove_novel_title_from_content(content, novel_title)
                     
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        file.write(processed_content)
-                    print(f"章节已覆盖保存到: {file_path}")
+                    self._queue_chapter_write(chapter_num, file_path, processed_content)
+                    print(f"章节已提交覆盖保存到: {file_path}")
+                    return True
                 except Exception as e:
                     self.error.emit(f"保存章节失败: {str(e)}", chapter_num)
-                return
+                return False
             elif file_behavior == "跳过":
                 # 跳过保存
                 print(f"第{chapter_num}章已存在，根据设置跳过保存")
-                return
+                return False
             else:  # "询问"
                 # 发送信号到主线程，让主线程处理用户选择
                 self.app.chapter_to_save = (chapter_num, title, content, file_path)
                 self.app.show_overwrite_dialog.emit(chapter_num, file_path)
-                return
+                return False
         
         # 如果文件不存在，直接保存
         try:
             # 处理章节内容，移除可能存在的小说标题
             processed_content = self._remove_novel_title_from_content(content, novel_title)
             
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(processed_content)
-            print(f"章节已保存到: {file_path}")
+            self._queue_chapter_write(chapter_num, file_path, processed_content)
+            print(f"章节已提交保存到: {file_path}")
+            return True
         except Exception as e:
             self.error.emit(f"保存章节失败: {str(e)}", chapter_num)
+        return False
+    
+    def _chapter_file_path(self, chapter_num):
+        """章节保存的文件路径，使用简化的命名格式：第X章.txt（不包含章节标题和小说标题）"""
+        chapter_save_path = self.chapter_path if hasattr(self, 'chapter_path') else "zhangjie"
+        return os.path.join(chapter_save_path, f"第{chapter_num}章.txt")
+
+    def _queue_chapter_write(self, chapter_num, file_path, content):
+        """提交章节写入，写完（已fsync）后才在任务表中记录完成，崩溃时不会把没写完的章节当作已完成"""
+        def on_written(error):
+            if error is None:
+                print(f"章节已保存到: {file_path}")
+                self._record_job(chapter_num, STATE_DONE)
+            else:
+                self._record_job(chapter_num, STATE_FAILED, f"保存章节失败: {error}")
+                self.error.emit(f"保存章节失败: {error}", chapter_num)
+            # 写盘成功后生成日志不再需要；失败时保留，下次启动可以恢复
+            self._release_journal(chapter_num, saved=error is None)
+        
+        self.app.record_chapter_version(file_path, chapter_num, content, KIND_GENERATE)
+        get_write_queue().write(file_path, content, fsync=True, on_done=on_written)
+        record_chapter_write(file_path, content)
     
     def extract_chapter_title(self, content):
         """从章节内容中提取章节标题"""
@@ -805,43 +853,7 @@ class ChapterGenerator(QThread):
     
     def _remove_novel_title_from_content(self, content, novel_title):
         """从章节内容中移除小说标题"""
-        if not novel_title or not content:
-            return content
-            
-        # 创建小说标题的可能格式
-        title_patterns = [
-            f"**《{novel_title}》**",  # Markdown格式 - 修复了模式匹配
-            f"《{novel_title}》",     # 普通格式
-            f"{novel_title}",         # 只有标题名
-        ]
-        
-        # 处理内容，移除小说标题
-        lines = content.split('\n')
-        processed_lines = []
-        
-        for line in lines:
-            should_remove_line = False
-            stripped_line = line.strip()
-            
-            # 检查是否是小说标题行
-            for pattern in title_patterns:
-                # 如果行中只有小说标题或者小说标题在行首，则移除整行
-                if stripped_line == pattern or stripped_line.startswith(pattern):
-                    should_remove_line = True
-                    break
-            
-            # 额外检查：如果行包含**《...》**格式，即使不完全匹配也尝试移除
-            if not should_remove_line and '**《' in stripped_line and '》**' in stripped_line:
-                # 提取标题名
-                match = re.search(r'\*\*《(.+?)》\*\*', stripped_line)
-                if match and match.group(1).strip() == novel_title:
-                    should_remove_line = True
-            
-            # 如果不是小说标题行，保留该行
-            if not should_remove_line:
-                processed_lines.append(line)
-        
-        return '\n'.join(processed_lines)
+        return remove_novel_title_from_content(content, novel_title)
     
     def _sanitize_filename(self, filename):
         """清理文件名中的非法字符"""
@@ -882,6 +894,7 @@ class ChapterGenerator(QThread):
         # 如果当前章节已经是最后一章，结束生成
         if self.current_chapter >= self.end_chapter:
             print("[调试] 所有章节生成完成，退出事件循环")
+            self._finish_job_batch()
             self.quit()  # 退出事件循环
             self.finished.emit()
             return
@@ -893,6 +906,116 @@ class ChapterGenerator(QThread):
         # 由于我们使用了异步方式，需要手动调用生成逻辑
         self._generate_next_chapter()
     
+    def _record_job(self, chapter, state, error=None):
+        """把章节状态写入任务表"""
+        if self.job_store is None:
+            return
+        try:
+            if state == STATE_DONE:
+                self.job_store.mark_done(self.batch_id, chapter)
+            elif state == STATE_FAILED:
+                self.job_store.mark_failed(self.batch_id, chapter, error)
+            else:
+                self.job_store.mark_in_flight(self.batch_id, chapter)
+        except Exception as e:
+            print(f"[任务表] 记录第{chapter}章状态失败: {e}")
+    
+    def _finish_job_batch(self):
+        """所有章节处理完后关闭任务，之后不再提示继续"""
+        if self.job_store is None:
+            return
+        try:
+            self.job_store.finish_batch(self.batch_id)
+            print(f"[任务表] 批量任务{self.batch_id}完成: {self.job_store.counts(self.batch_id)}")
+        except Exception as e:
+            print(f"[任务表] 更新任务状态失败: {e}")
+    
+    def _find_chapter_file(self, chapter, title):
+        """查找已保存的章节文件，兼容新旧文件名格式，找不到返回None"""
+        return find_chapter_file(self.app.save_path, chapter, title)
+    
+    def _read_existing_chapter(self, chapter, file_path):
+        """根据文件行为设置判断已存在章节是否跳过生成，跳过时返回文件内容，需要重新生成时返回None"""
+        file_behavior = getattr(self.app, 'file_behavior', "询问")
+        
+        if file_behavior == "覆盖":
+            print(f"第{chapter}章已存在，根据设置将覆盖生成")
+            return None
+        if file_behavior != "跳过" and self.overwrite_existing:
+            # "询问"模式下由开始生成前用户的选择决定
+            print(f"第{chapter}章已存在，根据用户选择将覆盖生成")
+            return None
+        
+        try:
+            print(f"第{chapter}章已存在，准备读取文件内容")
+            return get_write_queue().read_text(file_path)
+        except Exception as e:
+            print(f"读取已存在章节失败: {e}")
+            # 如果读取失败，继续生成新章节
+            print(f"将重新生成第{chapter}章")
+            return None
+    
+    def _build_chapter_prompt(self, chapter, title, previous_chapter_content=""):
+        """构建生成某一章的提示词"""
+        # 在配置的字数范围内随机选择一个目标字数
+        target_length = random.randint(self.app.min_chapter_length, self.app.max_chapter_length)
+        # 读取前文时用故事记忆组装有预算上限的上下文（前情提要、最近章节概要、上一章结尾）
+        story_context = ""
+        if self.read_previous_chapter and chapter > 1:
+            story_context = self.app.story_context(chapter, previous_chapter_content or None)
+        return build_chapter_prompt(title, chapter, self.app.outline_text.toPlainText(),
+                                    self.app.hero_name.text(), self.app.heroine_name.text(),
+                                    self.app.pov_combo.currentText(), self.app.lang_combo.currentText(),
+                                    self.app.rhythm_combo.currentText(), target_length, previous_chapter_content,
+                                    story_context)
+    
+    def _create_chapter_api_call(self, chapter, prompt):
+        """为某一章创建API调用对象"""
+        api_format = getattr(self.app, 'api_format', None)
+        custom_headers = getattr(self.app, 'custom_headers', None)
+        
+        print(f"生成第{chapter}章: API类型={self.app.api_type}, 模型={self.app.model_name}")
+        if self.app.api_type == "自定义":
+            print(f"API格式: {api_format}")
+            print(f"自定义请求头: {custom_headers}")
+        
+        api_call = create_api_call(self.app.api_type, self.app.api_url, self.app.api_key, prompt, self.app.model_name, api_format, custom_headers)
+        self.journals[chapter] = self.app.start_generation_journal(api_call, JOURNAL_CHAPTER, chapter, prompt)
+        return api_call
+    
+    def _release_journal(self, chapter, saved):
+        """一章处理完毕：已保存时删除生成日志（生成出错的除外），否则保留供下次启动恢复"""
+        journal = self.journals.pop(chapter, None)
+        if journal is None:
+            return
+        if saved:
+            journal.finish()
+        else:
+            journal.close()
+    
+    def _title_from_response(self, chapter, response_text):
+        """从生成的章节内容中提取章节标题，没有标题行时根据内容生成"""
+        chapter_title = ""
+        lines = response_text.split('\n')
+        for line in lines:
+            line = line.strip()
+            # 检查是否是章节标题行
+            if line.startswith(f"第{chapter}章："):
+                # 提取章节标题（去掉"第X章："前缀）
+                chapter_title = line[len(f"第{chapter}章："):].strip()
+                # 清理标题中的Markdown标记
+                chapter_title = chapter_title.replace('**', '').replace('*', '').strip()
+                # 如果标题太长，截取前15个字符
+                if len(chapter_title) > 15:
+                    chapter_title = chapter_title[:15] + "..."
+                break
+        
+        # 如果没有找到章节标题，根据章节内容生成一个
+        if not chapter_title:
+            # 取前200字符作为预览，使用智能标题生成方法
+            chapter_title = self._generate_smart_title(response_text[:200], chapter)
+        return chapter_title
+    
     def _generate_next_chapter(self):
         """生成下一章的内部方法"""
         print(f"[调试] _generate_next_chapter方法被调用")
@@ -904,6 +1027,14 @@ class ChapterGenerator(QThread):
         progress = int((chapter - self.start_chapter) / total_chapters * 100)
         self.progress.emit(chapter, self.end_chapter, progress)
         
+        # 任务表中已完成的章节直接跳过
+        if chapter in self.skip_chapters:
+            print(f"第{chapter}章在任务表中已完成，跳过")
+            progress = int((chapter - self.start_chapter + 1) / total_chapters * 100)
+            self.progress.emit(chapter, self.end_chapter, progress)
+            QTimer.singleShot(0, self.continue_generation)
+            return
+        
         # 检查章节是否已存在
         # 使用最新的文件名格式：第X章.txt 或旧格式 第X章_《小说标题》.txt
         save_path = self.app.save_path
@@ -914,220 +1045,75 @@ class ChapterGenerator(QThread):
         title = self.app.novel_title_input.text().strip()
         title = title if title else "未命名小说"
         
-        # 首先检查最新格式的文件是否存在
-        latest_format_file = os.path.join(save_path, f"第{chapter}章.txt")
-        
-        # 如果找到了最新格式的文件，使用它
-        if os.path.exists(latest_format_file):
-            file_path = latest_format_file
-        else:
-            # 检查新格式的文件是否存在
-            new_format_file = os.path.join(save_path, f"第{chapter}章.txt")
-            
-            # 如果找到了新格式的文件，使用它
-            if os.path.exists(new_format_file):
-                file_path = new_format_file
-            else:
-                # 尝试旧格式：第X章：标题_小说标题.txt
-                import glob
-                pattern = os.path.join(save_path, f"第{chapter}章*_{title}.txt")
-                matching_files = glob.glob(pattern)
-                
-                # 如果没有找到新格式的文件，检查旧格式的文件
-                old_format_file = os.path.join(save_path, f"第{chapter}章_{title}.txt")
-                if os.path.exists(old_format_file):
-                    matching_files.append(old_format_file)
-                
-                file_path = matching_files[0] if matching_files else None
-        
+        file_path = self._find_chapter_file(chapter, title)
         print(f"检查第{chapter}章文件是否存在: {file_path if file_path else '未找到'}")
-        if file_path and os.path.exists(file_path):
-            # 根据文件行为设置决定如何处理已存在章节
-            file_behavior = getattr(self.app, 'file_behavior', "询问")
-            
-            if file_behavior == "覆盖":
-                print(f"第{chapter}章已存在，根据设置将覆盖生成")
-            elif file_behavior == "跳过":
+        if file_path:
+            content = self._read_existing_chapter(chapter, file_path)
+            if content is not None:
                 # 跳过已存在章节
-                try:
-                    print(f"第{chapter}章已存在，根据设置将跳过生成")
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        content = file.read()
-                    self.chapter_generated.emit(chapter, content)
-                    
-                    # 更新进度
-                    progress = int((chapter - self.start_chapter + 1) / total_chapters * 100)
-                    self.progress.emit(chapter, self.end_chapter, progress)
-                    
-                    print(f"第{chapter}章已存在，跳过生成")
-                    # 继续生成下一章
-                    QTimer.singleShot(100, self.continue_generation)
-                    return
-                except Exception as e:
-                    print(f"读取已存在章节失败: {e}")
-                    # 如果读取失败，继续生成新章节
-                    print(f"将重新生成第{chapter}章")
-            else:  # "询问"
-                # 如果章节已存在，根据overwrite_existing标志决定是否跳过
-                if self.overwrite_existing:
-                    print(f"第{chapter}章已存在，根据用户选择将覆盖生成")
-                else:
-                    # 跳过已存在章节
-                    try:
-                        print(f"第{chapter}章已存在，准备读取文件内容")
-                        with open(file_path, 'r', encoding='utf-8') as file:
-                            content = file.read()
-                        self.chapter_generated.emit(chapter, content)
-                        
-                        # 更新进度
-                        progress = int((chapter - self.start_chapter + 1) / total_chapters * 100)
-                        self.progress.emit(chapter, self.end_chapter, progress)
-                        
-                        print(f"第{chapter}章已存在，跳过生成")
-                        # 继续生成下一章
-                        QTimer.singleShot(100, self.continue_generation)
-                        return
-                    except Exception as e:
-                        print(f"读取已存在章节失败: {e}")
-                        # 如果读取失败，继续生成新章节
-                        print(f"将重新生成第{chapter}章")
+                self._record_job(chapter, STATE_DONE)
+                self.chapter_generated.emit(chapter, content)
+                
+                # 更新进度
+                progress = int((chapter - self.start_chapter + 1) / total_chapters * 100)
+                self.progress.emit(chapter, self.end_chapter, progress)
+                
+                print(f"第{chapter}章已存在，跳过生成")
+                # 继续生成下一章
+                QTimer.singleShot(100, self.continue_generation)
+                return
         
         try:
-            # 获取小说标题（已在上面获取）
-            # title = self.app.novel_title_input.text().strip()
-            # title = title if title else "未命名小说"
-            
-            # 在配置的字数范围内随机选择一个目标字数
-            target_length = random.randint(self.app.min_chapter_length, self.app.max_chapter_length)
-            
             # 读取上一章内容（如果存在且用户选择了该选项）
             previous_chapter_content = ""
             if self.read_previous_chapter and chapter > self.start_chapter:  # 不是第一章且用户选择了读取上一章内容
                 prev_chapter = chapter - 1
-                save_path = self.app.save_path
-                
-                # 首先尝试最新格式：第X章.txt
-                latest_format_file = os.path.join(save_path, f"第{prev_chapter}章.txt")
-                
-                # 如果找到了最新格式的文件，使用它
-                if os.path.exists(latest_format_file):
-                    prev_file_path = latest_format_file
-                else:
-                    # 尝试新格式：第X章.txt
-                    new_format_file = os.path.join(save_path, f"第{prev_chapter}章.txt")
-                    
-                    # 如果找到了新格式的文件，使用它
-                    if os.path.exists(new_format_file):
-                        prev_file_path = new_format_file
-                    else:
-                        # 尝试旧格式：第X章：标题_小说标题.txt
-                        import glob
-                        pattern = os.path.join(save_path, f"第{prev_chapter}章*_{title}.txt")
-                        matching_files = glob.glob(pattern)
-                        
-                        # 如果没有找到新格式的文件，检查旧格式的文件
-                        old_format_file = os.path.join(save_path, f"第{prev_chapter}章_{title}.txt")
-                        if os.path.exists(old_format_file):
-                            matching_files.append(old_format_file)
-                        
-                        prev_file_path = matching_files[0] if matching_files else None
+                prev_file_path = self._find_chapter_file(prev_chapter, title)
                 
-                if prev_file_path and os.path.exists(prev_file_path):
+                if prev_file_path:
                     try:
-                        with open(prev_file_path, 'r', encoding='utf-8') as file:
-                            previous_chapter_content = file.read()
+                        # 上一章可能还在写盘队列中，此时直接取提交的内容
+                        previous_chapter_content = get_write_queue().read_text(prev_file_path)
                         print(f"已读取第{prev_chapter}章内容作为上下文，长度: {len(previous_chapter_content)}")
                     except Exception as e:
                         print(f"读取上一章内容失败: {e}")
                 else:
                     print(f"未找到第{prev_chapter}章文件，无法读取上一章内容")
             
-            # 优化提示词
-            prompt = f"请根据以下小说大纲生成《{title}》的第{chapter}章内容：\n"
-            prompt += self.app.outline_text.toPlainText() + "\n\n"
-            
-            # 添加男女主角信息到提示词
-            hero_name = self.app.hero_name.text().strip() if self.app.hero_name.text().strip() else "男主角"
-            heroine_name = self.app.heroine_name.text().strip() if self.app.heroine_name.text().strip() else "女主角"
-            
-            prompt += f"【重要角色信息】\n"
-            prompt += f"男主角：{hero_name}\n"
-            prompt += f"女主角：{heroine_name}\n"
-            prompt += f"请确保在章节内容中正确使用以上角色名字，不要混淆男女主角的名字。\n\n"
-            
-            # 如果有上一章内容，添加到提示词中
-            if previous_chapter_content:
-                # 获取上一章的最后部分（限制长度以避免提示词过长）
-                prev_content_end = previous_chapter_content[-1000:] if len(previous_chapter_content) > 1000 else previous_chapter_content
-                prompt += f"上一章（第{chapter-1}章）结尾内容：\n{prev_content_end}\n\n"
-                prompt += f"请确保新章节与上一章内容衔接自然，情节连贯。\n\n"
-            
-            prompt += f"章节具体要求：\n"
-            prompt += f"- 保持{self.app.pov_combo.currentText()}视角\n"
-            prompt += f"- 使用{self.app.lang_combo.currentText()}风格\n"
-            prompt += f"- 节奏：{self.app.rhythm_combo.currentText()}\n"
-            prompt += f"- 字数：约{target_length}字\n"
-            prompt += f"- 必须在章节开头添加一个吸引人的章节标题，格式为'第{chapter}章：[章节标题]'\n"
-            prompt += f"- 章节标题必须独特且能反映本章主要情节，避免重复使用相同标题\n"
-            prompt += f"- 章节标题应该简洁明了，不超过15个字，能够概括本章的核心事件或情感变化\n"
-            prompt += f"- 重要：不要在章节内容中添加小说标题'《{title}》'，章节内容直接从章节标题开始\n"
-            prompt += f"- 特别注意：必须正确使用角色名字，男主角是{hero_name}，女主角是{heroine_name}，不要混淆\n"
-            
-            # 调用API生成章节 - 使用流式API线程
-            api_format = getattr(self.app, 'api_format', None)
-            custom_headers = getattr(self.app, 'custom_headers', None)
-            
-            print(f"生成第{chapter}章: API类型={self.app.api_type}, 模型={self.app.model_name}")
-            if self.app.api_type == "自定义":
-                print(f"API格式: {api_format}")
-                print(f"自定义请求头: {custom_headers}")
+            prompt = self._build_chapter_prompt(chapter, title, previous_chapter_content)
             
             # 使用信号槽机制处理API响应，避免阻塞UI
-            self.api_thread = ApiCallThread(self.app.api_type, self.app.api_url, self.app.api_key, prompt, self.app.model_name, api_format, custom_headers)
+            self.api_thread = self._create_chapter_api_call(chapter, prompt)
             
             # 创建临时变量来保存当前章节信息，供回调函数使用
             current_chapter_info = {
                 'chapter': chapter,
                 'title': title,
-                'total_chapters': total_chapters
+                'total_chapters': total_chapters,
+                'failed': False
             }
             
             # 定义API完成的回调函数
             def on_api_finished(response_text, status):
                 print(f"[调试] API完成回调被调用，状态: {status}, 响应长度: {len(response_text) if response_text else 0}")
+                self.serial_chapter = None
                 
                 if status == "success" and response_text:
                     print(f"[调试] 第{current_chapter_info['chapter']}章生成完成，长度: {len(response_text)}")
                     
                     # 提取章节标题
-                    chapter_title = ""
-                    lines = response_text.split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        # 检查是否是章节标题行
-                        if line.startswith(f"第{current_chapter_info['chapter']}章："):
-                            # 提取章节标题（去掉"第X章："前缀）
-                            chapter_title = line[len(f"第{current_chapter_info['chapter']}章："):].strip()
-                            # 清理标题中的Markdown标记
-                            chapter_title = chapter_title.replace('**', '').replace('*', '').strip()
-                            # 如果标题太长，截取前15个字符
-                            if len(chapter_title) > 15:
-                                chapter_title = chapter_title[:15] + "..."
-                            break
-                    
-                    # 如果没有找到章节标题，根据章节内容生成一个
-                    if not chapter_title:
-                        # 尝试从内容中提取关键信息作为标题
-                        content_preview = response_text[:200]  # 取前200字符作为预览
-                        # 使用智能标题生成方法
-                        chapter_title = self._generate_smart_title(content_preview, current_chapter_info['chapter'])
+                    chapter_title = self._title_from_response(current_chapter_info['chapter'], response_text)
                     
                     # 保存章节内容
                     try:
-                        self.save_chapter(current_chapter_info['chapter'], chapter_title, response_text)
-                        print(f"[调试] 第{current_chapter_info['chapter']}章已保存")
+                        if not self.save_chapter(current_chapter_info['chapter'], chapter_title, response_text):
+                            # 没有写文件（跳过或等待确认覆盖）时直接记录完成
+                            self._record_job(current_chapter_info['chapter'], STATE_DONE)
+                            self._release_journal(current_chapter_info['chapter'], saved=True)
+                        print(f"[调试] 第{current_chapter_info['chapter']}章已提交保存")
                     except Exception as e:
                         print(f"[调试] 保存第{current_chapter_info['chapter']}章失败: {e}")
+                        self._release_journal(current_chapter_info['chapter'], saved=False)
                     
                     # 发送信号通知主窗口更新UI
                     print(f"[调试] 即将发送chapter_generated信号，章节号: {current_chapter_info['chapter']}, 内容长度: {len(response_text)}")
@@ -1142,28 +1128,34 @@ class ChapterGenerator(QThread):
                     QTimer.singleShot(100, self.continue_generation)
                 else:
                     print(f"[调试] API响应为空或失败，状态: {status}")
-                    self.error.emit(f"第{current_chapter_info['chapter']}章生成为空内容", current_chapter_info['chapter'])
+                    # 出错时已在on_api_error中提示并记录过
+                    if not current_chapter_info['failed']:
+                        self.error.emit(f"第{current_chapter_info['chapter']}章生成为空内容", current_chapter_info['chapter'])
+                        self._record_job(current_chapter_info['chapter'], STATE_FAILED, "生成为空内容")
+                    # 用户停止时不保留日志，出错中断的保留已生成的部分
+                    self._release_journal(current_chapter_info['chapter'], saved=status == "cancelled")
                     # 继续生成下一章
                     QTimer.singleShot(100, self.continue_generation)
             
             # 定义API错误的回调函数
+            # API调用出错后仍会触发finished信号，由on_api_finished继续生成下一章，避免跳过章节
             def on_api_error(error_msg):
+                current_chapter_info['failed'] = True
                 self.error.emit(f"生成第{current_chapter_info['chapter']}章时出错: {error_msg}", current_chapter_info['chapter'])
-                # 继续生成下一章
-                QTimer.singleShot(100, self.continue_generation)
+                self._record_job(current_chapter_info['chapter'], STATE_FAILED, error_msg)
             
-            # 定义内容更新的回调函数
-            def on_content_update(content):
-                """处理API返回的内容更新，实现实时显示"""
-                # 发送批量内容更新信号，以便主窗口可以区分是批量生成还是单章生成
-                if hasattr(self.app, 'on_batch_content_update'):
-                    self.app.on_batch_content_update(current_chapter_info['chapter'], content)
+            # 定义内容增量的回调函数
+            def on_content_delta(chunk, offset):
+                """转发API返回的内容增量，由主窗口在GUI线程中追加显示"""
+                self.content_delta.emit(current_chapter_info['chapter'], chunk, offset)
             
             # 连接信号
             self.api_thread.finished.connect(on_api_finished)
             self.api_thread.error.connect(on_api_error)
-            # 新增：连接内容更新信号，实现实时显示
-            self.api_thread.content_update.connect(on_content_update)
+            # 连接内容增量信号，实现实时显示
+            self.api_thread.content_delta.connect(on_content_delta)
+            self._record_job(chapter, STATE_IN_FLIGHT)
+            self.serial_chapter = chapter
             self.api_thread.start()
             
             # 暂停当前循环，等待API响应
@@ -1175,6 +1167,144 @@ class ChapterGenerator(QThread):
             # 继续生成下一章
             QTimer.singleShot(100, self.continue_generation)
             
+    def _start_parallel_generation(self):
+        """并行模式：不读取上一章内容时各章互不依赖，保持最多concurrency个章节请求同时进行"""
+        print(f"[调试] 并行批量生成，同时进行的章节请求数: {self.concurrency}")
+        save_path = self.app.save_path
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        self._fill_parallel_slots()
+    
+    def _fill_parallel_slots(self):
+        """在并发上限内派发后续章节；全部章节保存完后结束生成"""
+        with self.parallel_lock:
+            while self.running and len(self.in_flight) < self.concurrency and self.next_chapter <= self.end_chapter:
+                chapter = self.next_chapter
+                self.next_chapter += 1
+                self._dispatch_parallel_chapter(chapter)
+            self._update_preview_chapter()
+            
+            if (self.running and not self.in_flight and self.next_chapter > self.end_chapter
+                    and self.next_to_save > self.end_chapter and not self.parallel_finished):
+                print("[调试] 所有章节生成完成，退出事件循环")
+                self.parallel_finished = True
+                self._finish_job_batch()
+                self.quit()  # 退出事件循环
+                self.finished.emit()
+    
+    def _dispatch_parallel_chapter(self, chapter):
+        """派发一章的生成请求，已存在且需要跳过的章节直接记为完成"""
+        if chapter in self.skip_chapters:
+            print(f"第{chapter}章在任务表中已完成，跳过")
+            self._settle_parallel_chapter(chapter, ("resumed", "", ""))
+            return
+        
+        title = self.app.novel_title_input.text().strip()
+        title = title if title else "未命名小说"
+        
+        file_path = self._find_chapter_file(chapter, title)
+        if file_path:
+            content = self._read_existing_chapter(chapter, file_path)
+            if content is not None:
+                print(f"第{chapter}章已存在，跳过生成")
+                self._settle_parallel_chapter(chapter, ("existing", "", content))
+                return
+        
+        try:
+            prompt = self._build_chapter_prompt(chapter, title)
+            api_call = self._create_chapter_api_call(chapter, prompt)
+        except Exception as e:
+            self.error.emit(f"生成第{chapter}章时出错: {str(e)}", chapter)
+            self._settle_parallel_chapter(chapter, ("failed", "", str(e)))
+            return
+        
+        self.in_flight[chapter] = api_call
+        self.partial_texts[chapter] = StreamTextBuffer()
+        api_call.finished.connect(lambda response_text, status, chapter=chapter: self._on_parallel_finished(chapter, response_text, status))
+        api_call.error.connect(lambda error_msg, chapter=chapter: self._on_parallel_error(chapter, error_msg))
+        api_call.content_delta.connect(lambda chunk, offset, chapter=chapter: self._on_parallel_delta(chapter, chunk, offset))
+        self._record_job(chapter, STATE_IN_FLIGHT)
+        api_call.start()
+    
+    def _on_parallel_finished(self, chapter, response_text, status):
+        with self.parallel_lock:
+            if chapter not in self.in_flight:
+                # 已经按出错处理过
+                return
+            if status == "success" and response_text:
+                print(f"[调试] 第{chapter}章生成完成，长度: {len(response_text)}")
+                chapter_title = self._title_from_response(chapter, response_text)
+                self._settle_parallel_chapter(chapter, ("generated", chapter_title, response_text))
+            else:
+                print(f"[调试] 第{chapter}章API响应为空或失败，状态: {status}")
+                if status != "cancelled":
+                    self.error.emit(f"第{chapter}章生成为空内容", chapter)
+                self._release_journal(chapter, saved=status == "cancelled")
+                self._settle_parallel_chapter(chapter, ("failed", "", "生成为空内容"))
+        self._fill_parallel_slots()
+    
+    def _on_parallel_error(self, chapter, error_msg):
+        with self.parallel_lock:
+            if chapter not in self.in_flight:
+                return
+            self.error.emit(f"生成第{chapter}章时出错: {error_msg}", chapter)
+            self._release_journal(chapter, saved=False)
+            self._settle_parallel_chapter(chapter, ("failed", "", error_msg))
+        self._fill_parallel_slots()
+    
+    def _on_parallel_delta(self, chapter, chunk, offset):
+        """记录各章的流式内容，只把预览章节的增量转发给主窗口"""
+        buffer = self.partial_texts.get(chapter)
+        if buffer is None:
+            return
+        buffer.append(chunk)
+        if chapter == self.preview_chapter:
+            self.content_delta.emit(chapter, chunk, offset)
+    
+    def _update_preview_chapter(self):
+        """预览始终跟随仍在生成的最小章节号，切换时先补发该章已收到的内容"""
+        preview = min(self.in_flight) if self.in_flight else None
+        if preview == self.preview_chapter:
+            return
+        self.preview_chapter = preview
+        if preview is not None:
+            text = self.partial_texts[preview].getvalue()
+            if text:
+                self.content_delta.emit(preview, text, 0)
+    
+    def _settle_parallel_chapter(self, chapter, result):
+        """记录一章的结果，并按章节顺序保存已经可以保存的章节
+
+        结果类型：generated（新生成）、existing（已存在被跳过）、resumed（任务表中已完成）、failed（失败，内容为错误信息）
+        """
+        self.in_flight.pop(chapter, None)
+        self.partial_texts.pop(chapter, None)
+        self.completed[chapter] = result
+        
+        total_chapters = self.end_chapter - self.start_chapter + 1
+        while self.next_to_save in self.completed:
+            save_chapter = self.next_to_save
+            kind, chapter_title, content = self.completed.pop(save_chapter)
+            if kind == "generated":
+                try:
+                    if not self.save_chapter(save_chapter, chapter_title, content):
+                        # 没有写文件（跳过或等待确认覆盖）时直接记录完成
+                        self._record_job(save_chapter, STATE_DONE)
+                        self._release_journal(save_chapter, saved=True)
+                    print(f"[调试] 第{save_chapter}章已提交保存")
+                except Exception as e:
+                    print(f"[调试] 保存第{save_chapter}章失败: {e}")
+                    self._release_journal(save_chapter, saved=False)
+            elif kind == "existing":
+                self._record_job(save_chapter, STATE_DONE)
+            elif kind == "failed":
+                self._record_job(save_chapter, STATE_FAILED, content)
+            if kind in ("generated", "existing"):
+                self.chapter_generated.emit(save_chapter, content)
+            self.next_to_save += 1
+            progress = int((save_chapter - self.start_chapter + 1) / total_chapters * 100)
+            self.progress.emit(save_chapter, self.end_chapter, progress)
+            
     def _generate_smart_title(self, content_preview, chapter_num):
         """智能生成章节标题，根据内容自动提取关键词"""
         import re
@@ -1314,6 +1444,23 @@ class ChapterGenerator(QThread):
                 self.api_thread.terminate()
                 self.api_thread.wait(1000)  # 再等待1秒确保终止
             print(f"[调试] API调用线程已停止")
+        # 逐章生成时事件循环会先于完成回调退出，这里直接按用户停止处理进行中章节的生成日志
+        chapter = self.serial_chapter
+        if chapter is not None:
+            self.serial_chapter = None
+            self._release_journal(chapter, saved=True)
+        # 停止并行模式下所有进行中的章节请求。请求被清出in_flight后完成回调不再处理，
+        # 这里直接按用户停止处理它们的生成日志（与逐章生成时一致），并保存已经生成完、还在等前面章节的章节
+        with self.parallel_lock:
+            in_flight = list(self.in_flight.values())
+            for chapter in list(self.in_flight):
+                self._release_journal(chapter, saved=True)
+            self.in_flight.clear()
+            self.partial_texts.clear()
+            self._save_completed_on_stop()
+        for api_call in in_flight:
+            if api_call.isRunning():
+                api_call.stop()
         # 退出事件循环
         self.quit()
         print(f"[调试] 已调用quit()退出事件循环")
@@ -1323,6 +1470,34 @@ class ChapterGenerator(QThread):
             self.terminate()
         print(f"[调试] ChapterGenerator已完全停止")
         
+    def _save_completed_on_stop(self):
+        """停止时保存排在未完成章节之后、已经生成完的章节
+
+        这些章节原本要等前面的章节完成后按顺序保存。"询问"模式下文件已存在时不弹出覆盖确认，
+        保留生成日志，下次启动时可以恢复。
+        """
+        file_behavior = getattr(self.app, 'file_behavior', "询问")
+        for chapter in sorted(self.completed):
+            kind, chapter_title, content = self.completed.pop(chapter)
+            if kind == "existing":
+                self._record_job(chapter, STATE_DONE)
+            elif kind == "failed":
+                self._record_job(chapter, STATE_FAILED, content)
+            if kind != "generated":
+                continue
+            if file_behavior == "询问" and os.path.exists(self._chapter_file_path(chapter)):
+                print(f"[调试] 停止生成：第{chapter}章已存在，保留生成日志供下次启动恢复")
+                self._release_journal(chapter, saved=False)
+                continue
+            try:
+                if not self.save_chapter(chapter, chapter_title, content):
+                    self._record_job(chapter, STATE_DONE)
+                    self._release_journal(chapter, saved=True)
+                print(f"[调试] 停止生成：第{chapter}章已提交保存")
+            except Exception as e:
+                print(f"[调试] 保存第{chapter}章失败: {e}")
+                self._release_journal(chapter, saved=False)
+
     def pause(self):
         """暂停生成"""
         self.paused = True
@@ -1388,7 +1563,7 @@ class ApiTestThread(QThread):
             print(f"请求数据: {json.dumps(data)}")
             
             # 发送请求
-            response = requests.post(self.api_url, json=data, timeout=30)
+            response = get_session(self.api_url, self.api_type).post(self.api_url, json=data, timeout=30)
             
             print(f"响应状态码: {response.status_code}")
             print(f"响应头: {dict(response.headers)}")
@@ -1459,7 +1634,7 @@ class ApiTestThread(QThread):
             print(f"请求头: {json.dumps({k: v if k != 'Authorization' else 'Bearer ***' for k, v in headers.items()})}")
             
             # 发送请求
-            response = requests.post(self.api_url, json=data, headers=headers, timeout=30)
+            response = get_session(self.api_url, self.api_type).post(self.api_url, json=data, headers=headers, timeout=30)
             
             print(f"响应状态码: {response.status_code}")
             print(f"响应头: {dict(response.headers)}")
@@ -1534,7 +1709,7 @@ class ApiTestThread(QThread):
             print(f"请求头: {json.dumps({k: v if k != 'Authorization' else 'Bearer ***' for k, v in headers.items()})}")
             
             # 发送请求
-            response = requests.post(self.api_url, json=data, headers=headers, timeout=30)
+            response = get_session(self.api_url, self.api_type).post(self.api_url, json=data, headers=headers, timeout=30)
             
             print(f"响应状态码: {response.status_code}")
             print(f"响应头: {dict(response.headers)}")
@@ -1907,28 +2082,15 @@ class SettingsDialog(QDialog):
         # 保存当前API类型的配置
         if hasattr(self, 'api_type') and hasattr(self, 'api_url') and hasattr(self, 'api_key'):
             try:
-                # 加载现有参数
-                existing_params = {}
-                if os.path.exists("user_params.json"):
-                    with open("user_params.json", "r", encoding="utf-8") as f:
-                        existing_params = json.load(f)
-                
-                # 确保api_configs存在
-                if "api_configs" not in existing_params:
-                    existing_params["api_configs"] = {}
-                
-                # 保存当前API类型的配置
-                existing_params["api_configs"][self.api_type] = {
-                    "api_url": self.api_url,
-                    "api_key": self.api_key,
-                    "model_name": self.model_name,
-                    "api_format": self.api_format,
-                    "custom_headers": self.custom_headers
-                }
-                
-                # 保存更新后的参数
-                with open("user_params.json", "w", encoding="utf-8") as f:
-                    json.dump(existing_params, f, ensure_ascii=False, indent=4)
+                # 写入内存中的用户参数，由主窗口的自动保存写入文件
+                get_config_document(USER_PARAMS_PATH).update_api_config(
+                    self.api_type,
+                    api_url=self.api_url,
+                    api_key=self.api_key,
+                    model_name=self.model_name,
+                    api_format=self.api_format,
+                    custom_headers=self.custom_headers,
+                )
                 
                 print(f"已保存 {self.api_type} 的配置")
             except Exception as e:
@@ -2014,24 +2176,21 @@ class SettingsDialog(QDialog):
         
         # 尝试加载已保存的该API类型的配置
         try:
-            if os.path.exists("user_params.json"):
-                with open("user_params.json", "r", encoding="utf-8") as f:
-                    params = json.load(f)
-                    
-                    if "api_configs" in params and api_type in params["api_configs"]:
-                        config = params["api_configs"][api_type]
-                        self.api_url_edit.setText(config.get("api_url", ""))
-                        self.api_key_edit.setText(config.get("api_key", ""))
-                        
-                        # 设置选中的模型
-                        model_name = config.get("model_name", "")
-                        if model_name:
-                            for i in range(self.model_list_widget.count()):
-                                if self.model_list_widget.item(i).text() == model_name:
-                                    self.model_list_widget.setCurrentRow(i)
-                                    break
-                        
-                        print(f"已加载 {api_type} 的已保存配置")
+            # 从内存中的用户参数读取（可能包含尚未写盘的修改）
+            config = get_config_document(USER_PARAMS_PATH).api_config(api_type)
+            if config:
+                self.api_url_edit.setText(config.get("api_url", ""))
+                self.api_key_edit.setText(config.get("api_key", ""))
+                
+                # 设置选中的模型
+                model_name = config.get("model_name", "")
+                if model_name:
+                    for i in range(self.model_list_widget.count()):
+                        if self.model_list_widget.item(i).text() == model_name:
+                            self.model_list_widget.setCurrentRow(i)
+                            break
+                
+                print(f"已加载 {api_type} 的已保存配置")
         except Exception as e:
             print(f"加载已保存配置失败: {e}")
     
@@ -2176,8 +2335,7 @@ class SettingsDialog(QDialog):
         """保存自定义模型列表"""
         custom_models_file = "custom_ollama_models.json"
         try:
-            with open(custom_models_file, 'w', encoding='utf-8') as f:
-                json.dump({"custom_models": custom_models}, f, ensure_ascii=False)
+            get_write_queue().write(custom_models_file, json.dumps({"custom_models": custom_models}, ensure_ascii=False))
         except Exception as e:
             print(f"保存自定义模型失败: {str(e)}")
             # 创建自定义警告消息框
@@ -2226,8 +2384,7 @@ class SettingsDialog(QDialog):
         """保存自定义SiliconFlow模型列表"""
         custom_models_file = "custom_siliconflow_models.json"
         try:
-            with open(custom_models_file, 'w', encoding='utf-8') as f:
-                json.dump({"custom_models": custom_models}, f, ensure_ascii=False)
+            get_write_queue().write(custom_models_file, json.dumps({"custom_models": custom_models}, ensure_ascii=False))
         except Exception as e:
             print(f"保存自定义SiliconFlow模型失败: {str(e)}")
             # 创建自定义警告消息框
@@ -2276,8 +2433,7 @@ class SettingsDialog(QDialog):
         """保存自定义ModelScope模型列表"""
         custom_models_file = "custom_modelscope_models.json"
         try:
-            with open(custom_models_file, 'w', encoding='utf-8') as f:
-                json.dump({"custom_models": custom_models}, f, ensure_ascii=False)
+            get_write_queue().write(custom_models_file, json.dumps({"custom_models": custom_models}, ensure_ascii=False))
         except Exception as e:
             print(f"保存自定义ModelScope模型失败: {str(e)}")
             # 创建自定义警告消息框
@@ -2804,10 +2960,97 @@ class SettingsDialog(QDialog):
         # 调用父类的accept方法关闭对话框
         super().accept()
 
+class ChapterHistoryDialog(QDialog):
+    """章节版本历史：查看各版本、并排对比、恢复"""
+
+    def __init__(self, history, chapter_num, current_text, parent=None):
+        super().__init__(parent)
+        self.history = history
+        self.chapter_num = chapter_num
+        self.current_text = current_text
+        self.restore_version = None  # 用户选择恢复的版本号
+        self.setWindowTitle(f"第{chapter_num}章 版本历史")
+        self.resize(1000, 640)
+
+        layout = QVBoxLayout(self)
+        splitter = QSplitter(Qt.Horizontal)
+        self.version_list = QListWidget()
+        # 选中一个版本时与当前内容对比，选中两个版本时对比这两个版本
+        self.version_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        for item in reversed(history.versions(chapter_num)):
+            created = datetime.fromtimestamp(item["updated_at"]).strftime("%m-%d %H:%M")
+            label = f"版本{item['version']}  {KIND_LABELS.get(item['kind'], item['kind'])}  {created}  {item['length']}字"
+            if item["note"]:
+                label += f"  ({item['note']})"
+            self.version_list.addItem(label)
+            self.version_list.item(self.version_list.count() - 1).setData(Qt.UserRole, item["version"])
+        self.version_list.itemSelectionChanged.connect(self.show_preview)
+        splitter.addWidget(self.version_list)
+
+        self.preview = QTextEdit()
+        self.preview.setReadOnly(True)
+        splitter.addWidget(self.preview)
+        splitter.setSizes([260, 740])
+        layout.addWidget(splitter)
+
+        button_layout = QHBoxLayout()
+        self.compare_button = QPushButton("对比")
+        self.compare_button.clicked.connect(self.show_compare)
+        self.restore_button = QPushButton("恢复此版本")
+        self.restore_button.clicked.connect(self.restore_selected)
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.reject)
+        button_layout.addWidget(self.compare_button)
+        button_layout.addWidget(self.restore_button)
+        button_layout.addStretch()
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+        if self.version_list.count():
+            self.version_list.setCurrentRow(0)
+
+    def selected_versions(self):
+        """选中的版本号，从旧到新"""
+        return sorted(item.data(Qt.UserRole) for item in self.version_list.selectedItems())
+
+    def show_preview(self):
+        versions = self.selected_versions()
+        self.restore_button.setEnabled(len(versions) == 1)
+        self.compare_button.setText("对比所选的两个版本" if len(versions) == 2 else "与当前内容对比")
+        self.compare_button.setEnabled(len(versions) in (1, 2))
+        if len(versions) == 1:
+            self.preview.setPlainText(self.history.text(self.chapter_num, versions[0]))
+
+    def show_compare(self):
+        """并排显示差异"""
+        versions = self.selected_versions()
+        if len(versions) == 2:
+            old_text = self.history.text(self.chapter_num, versions[0])
+            new_text = self.history.text(self.chapter_num, versions[1])
+            old_label, new_label = f"版本{versions[0]}", f"版本{versions[1]}"
+        elif len(versions) == 1:
+            old_text = self.history.text(self.chapter_num, versions[0])
+            new_text = self.current_text
+            old_label, new_label = f"版本{versions[0]}", "当前内容"
+        else:
+            return
+        html = difflib.HtmlDiff(wrapcolumn=32).make_table(
+            old_text.split('\n'), new_text.split('\n'), old_label, new_label, context=True, numlines=2)
+        self.preview.setHtml(html)
+
+    def restore_selected(self):
+        versions = self.selected_versions()
+        if len(versions) != 1:
+            return
+        self.restore_version = versions[0]
+        self.accept()
+
+
 class CompactNovelGeneratorApp(QMainWindow):
     """紧凑型小说生成器主应用"""
     # 添加处理覆盖对话框的信号
     show_overwrite_dialog = pyqtSignal(int, str)  # 章节号，文件路径
+    write_failed = pyqtSignal(str, str)  # 后台写盘失败：文件路径，错误信息
     
     def __init__(self):
         print("[调试] CompactNovelGeneratorApp构造函数开始执行")
@@ -2822,19 +3065,37 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.min_chapter_length = 3500  # 默认最小章节字数
         self.max_chapter_length = 5000  # 默认最大章节字数
         self.file_behavior = "询问"  # 文件存在时的行为，默认为询问
+        self.batch_concurrency = dict(DEFAULT_BATCH_CONCURRENCY)  # 各服务商批量生成时同时生成的章节数
         self.save_path = "novels"  # 默认保存路径
         self.chapter_counter = 1  # 章节计数器
         self.batch_generator = None  # 批量生成线程
+        self.batch_preview_chapter = None  # 批量生成时正在实时预览的章节
+        self.batch_preview_perf_start = None  # 批量实时预览开始时的性能计数
         self.auto_save_thread = None  # 自动保存线程
         self.current_chapter_content = ""  # 当前章节内容，用于UI更新
         self.chapter_to_save = None  # 待保存的章节信息 (chapter_num, title, content, file_path)
+        self.streaming_chapter = None  # 正在流式生成的章节号，生成期间编辑器自动保存不写这一章
+        self.generated_chapter_paths = set()  # 本次运行中由生成完成时自动保存写入的章节文件，再次生成时可以覆盖
         self.is_initializing = True  # 初始化标志，避免在初始化时显示提示
         self.auto_save_timer = None  # 自动保存设置定时器
+        self.user_config = get_config_document(USER_PARAMS_PATH)  # user_params.json在内存中的唯一副本
+        # 输入变化时只标记对应产物，定时器到期后只保存改过的产物
+        self.persistence = PersistenceManager()
+        self.persistence.register("user_params", self.save_user_config)
+        self.persistence.register("novel_params", self.save_novel_params)
+        self.persistence.register("outline", self.save_outline_from_editor)
+        self.persistence.register("chapter", self.save_chapter_from_editor)
         print("[调试] 基本参数初始化完成，即将调用init_ui()")
         self.init_ui()
         print("[调试] UI初始化完成，即将连接信号")
+        # 流式内容按固定帧率合并显示
+        self.chapter_renderer = StreamRenderer(self.chapter_text, status_bar=self.status_bar, parent=self)
+        self.outline_renderer = StreamRenderer(self.outline_text, status_bar=self.status_bar, parent=self)
         # 连接信号到处理方法
         self.show_overwrite_dialog.connect(self.on_show_overwrite_dialog)  # 连接信号到处理方法
+        # 后台写盘失败时在状态栏提示（写盘线程发出信号，界面线程处理）
+        self.write_failed.connect(self.on_write_failed)
+        get_write_queue().add_error_listener(self.write_failed.emit)
         print("[调试] 信号连接完成，即将调用load_parameters()")
         # 加载已保存的参数
         self.load_parameters()
@@ -2856,9 +3117,17 @@ class CompactNovelGeneratorApp(QMainWindow):
         # 初始化自动保存设置定时器
         self.init_auto_save_timer()
         
+        # 窗口显示后检查上次没有生成完的内容
+        QTimer.singleShot(0, self.recover_partial_generations)
+        
         # 加载所有设置
         print("[调试] 正在加载所有设置...")
         self.load_all_settings()
+        # 加载过程中填充输入框产生的修改标记不需要保存
+        self.persistence.discard()
+        
+        # 窗口显示后检查是否有被中断的批量生成任务
+        QTimer.singleShot(1000, self.check_unfinished_batch)
     
     def init_auto_save_timer(self):
         """初始化自动保存设置定时器"""
@@ -2867,8 +3136,10 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.auto_save_timer.setSingleShot(True)  # 设置为单次触发
         print("[调试] 自动保存定时器初始化完成")
     
-    def trigger_auto_save_settings(self):
-        """触发自动保存设置定时器"""
+    def trigger_auto_save_settings(self, artifact=None):
+        """标记产物有修改并触发自动保存设置定时器，5秒内的多次修改合并为一次保存"""
+        if artifact is not None:
+            self.persistence.mark_dirty(artifact)
         if self.auto_save_timer:
             # 如果定时器正在运行，先停止
             if self.auto_save_timer.isActive():
@@ -2922,60 +3193,32 @@ class CompactNovelGeneratorApp(QMainWindow):
             print(f"加载所有设置失败: {str(e)}")
             self.status_bar.showMessage(f"加载设置失败: {str(e)}", 3000)
     
+    def chapter_index(self):
+        """当前保存目录的章节文件索引"""
+        return get_chapter_index(self.save_path)
+
     def load_current_chapter_content(self):
         """加载当前章节内容"""
         try:
             # 获取当前章节号
             current_chapter = self.chapter_number.value()
+            perf.incr("chapter_view_loads")
             
             # 获取小说标题
             title = self.novel_title_input.text().strip()
             title = title if title else "未命名小说"
             
-            # 首先尝试最新格式：第X章.txt
-            latest_format_file = os.path.join(self.save_path, f"第{current_chapter}章.txt")
-            
-            # 如果找到了最新格式的文件，使用它
-            if os.path.exists(latest_format_file):
-                chapter_file = latest_format_file
-            else:
-                # 尝试新格式：第X章.txt
-                new_format_file = os.path.join(self.save_path, f"第{current_chapter}章.txt")
-                
-                # 如果找到了新格式的文件，使用它
-                if os.path.exists(new_format_file):
-                    chapter_file = new_format_file
-                else:
-                    # 尝试旧格式：第X章：标题_小说标题.txt
-                    import glob
-                    pattern = os.path.join(self.save_path, f"第{current_chapter}章*_{title}.txt")
-                    matching_files = glob.glob(pattern)
-                    
-                    # 如果找到了旧格式的文件，使用第一个匹配的文件
-                    if matching_files:
-                        chapter_file = matching_files[0]
-                    else:
-                        # 尝试其他可能的旧文件名格式
-                        possible_files = [
-                            f"第{current_chapter}章.txt",  # 最旧的格式
-                            f"第{current_chapter:03d}章.txt",  # 带零的旧格式
-                            f"第{current_chapter}章_{title}.txt",  # 带小说标题的格式
-                            f"第{current_chapter:03d}章_{title}.txt"  # 带零和小说标题的格式
-                        ]
-                        
-                        chapter_file = None
-                        for file_name in possible_files:
-                            test_path = os.path.join(self.save_path, file_name)
-                            if os.path.exists(test_path):
-                                chapter_file = test_path
-                                break
+            # 从章节索引查找：第X章.txt、第00X章.txt或带小说标题的旧格式
+            chapter_file = self.chapter_index().find_path(current_chapter, title)
             
             # 如果章节文件存在，则加载内容
-            if chapter_file and os.path.exists(chapter_file):
-                with open(chapter_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    self.chapter_text.setPlainText(content)
-                    print(f"[调试] 已加载第{current_chapter}章内容")
+            if chapter_file:
+                perf.incr("chapter_view_file_reads")
+                # 刚提交、还在写盘队列中的章节直接取提交的内容
+                content = get_write_queue().read_text(chapter_file)
+                content_cache.remember(chapter_file, content)
+                self.chapter_text.setPlainText(content)
+                print(f"[调试] 已加载第{current_chapter}章内容")
             else:
                 print(f"[调试] 未找到第{current_chapter}章文件")
         except Exception as e:
@@ -3522,6 +3765,9 @@ class CompactNovelGeneratorApp(QMainWindow):
     def switch_page(self, index):
         """切换页面"""
         self.content_stack.setCurrentIndex(index)
+        if index == 4:
+            # 润色页：保存目录改变过时切换章节目录，目录内的变化已由文件监视增量更新
+            self.project_catalog()
         # 更新侧边栏按钮状态
         self.sidebar_input_button.setChecked(index == 0)
         self.sidebar_outline_button.setChecked(index == 1)
@@ -4157,7 +4403,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.rhythm_combo.currentTextChanged.connect(self.update_prompt)
         self.word_count.textChanged.connect(self.update_prompt)
         
-        # 为所有输入框添加自动保存功能
+        # 为所有输入框添加自动保存功能（标记小说参数有修改，由定时器合并保存）
         self.novel_title_input.textChanged.connect(self.auto_save_novel_params)
         self.bg_text.textChanged.connect(self.auto_save_novel_params)
         self.hero_name.textChanged.connect(self.auto_save_novel_params)
@@ -4177,27 +4423,6 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.lang_combo.currentTextChanged.connect(self.auto_save_novel_params)
         self.rhythm_combo.currentTextChanged.connect(self.auto_save_novel_params)
         self.word_count.textChanged.connect(self.auto_save_novel_params)
-        
-        # 当输入变化时触发自动保存
-        self.novel_title_input.textChanged.connect(self.trigger_auto_save_settings)
-        self.bg_text.textChanged.connect(self.trigger_auto_save_settings)
-        self.hero_name.textChanged.connect(self.trigger_auto_save_settings)
-        self.hero_age.valueChanged.connect(self.trigger_auto_save_settings)
-        self.hero_job.textChanged.connect(self.trigger_auto_save_settings)
-        self.hero_family.textChanged.connect(self.trigger_auto_save_settings)
-        self.hero_desc.textChanged.connect(self.trigger_auto_save_settings)
-        self.heroine_name.textChanged.connect(self.trigger_auto_save_settings)
-        self.heroine_age.valueChanged.connect(self.trigger_auto_save_settings)
-        self.heroine_job.textChanged.connect(self.trigger_auto_save_settings)
-        self.heroine_family.textChanged.connect(self.trigger_auto_save_settings)
-        self.heroine_desc.textChanged.connect(self.trigger_auto_save_settings)
-        self.rel_text.textChanged.connect(self.trigger_auto_save_settings)
-        self.plot_text.textChanged.connect(self.trigger_auto_save_settings)
-        self.genre_combo.currentTextChanged.connect(self.trigger_auto_save_settings)
-        self.pov_combo.currentTextChanged.connect(self.trigger_auto_save_settings)
-        self.lang_combo.currentTextChanged.connect(self.trigger_auto_save_settings)
-        self.rhythm_combo.currentTextChanged.connect(self.trigger_auto_save_settings)
-        self.word_count.textChanged.connect(self.trigger_auto_save_settings)
 
     def setup_outline_page(self):
         """设置小说大纲页面"""
@@ -4239,7 +4464,7 @@ class CompactNovelGeneratorApp(QMainWindow):
             }
         """)
         # 当大纲内容变化时触发自动保存
-        self.outline_text.textChanged.connect(self.trigger_auto_save_settings)
+        self.outline_text.textChanged.connect(lambda: self.trigger_auto_save_settings("outline"))
         outline_layout.addWidget(self.outline_text)
         layout.addWidget(outline_group)
         
@@ -4325,6 +4550,10 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.save_button.setEnabled(False)
         self.save_button.clicked.connect(self.save_result)
         
+        self.history_button = QPushButton("版本历史")
+        self.history_button.setStyleSheet(self.get_button_style())
+        self.history_button.clicked.connect(self.show_chapter_history)
+        
         chapter_control_layout.addWidget(chapter_label)
         chapter_control_layout.addWidget(self.chapter_number)
         chapter_control_layout.addWidget(self.prev_chapter_button)
@@ -4347,6 +4576,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         chapter_control_layout.addWidget(self.generate_chapter_button)
         chapter_control_layout.addWidget(self.save_button)
+        chapter_control_layout.addWidget(self.history_button)
         
         # 设置按钮的拉伸因子，使它们均匀分布
         chapter_control_layout.setStretchFactor(chapter_label, 0)
@@ -4356,6 +4586,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         chapter_control_layout.setStretchFactor(self.single_read_previous_chapter_checkbox, 0)
         chapter_control_layout.setStretchFactor(self.generate_chapter_button, 1)
         chapter_control_layout.setStretchFactor(self.save_button, 1)
+        chapter_control_layout.setStretchFactor(self.history_button, 1)
         
         self.chapter_text = QTextEdit()
         self.chapter_text.setReadOnly(False)
@@ -4380,7 +4611,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.update_default_text()
         
         # 当章节内容变化时触发自动保存
-        self.chapter_text.textChanged.connect(self.trigger_auto_save_settings)
+        self.chapter_text.textChanged.connect(lambda: self.trigger_auto_save_settings("chapter"))
         
 
         
@@ -4472,7 +4703,24 @@ class CompactNovelGeneratorApp(QMainWindow):
                 height: 16px;
             }
         """)
-        batch_layout.addWidget(self.read_previous_chapter_checkbox, 1, 0, 1, 6)
+        batch_layout.addWidget(self.read_previous_chapter_checkbox, 1, 0, 1, 4)
+        
+        # 同时生成的章节数（仅在不读取上一章内容时生效，按服务商分别记忆）
+        concurrency_layout = QHBoxLayout()
+        concurrency_label = QLabel("同时生成:")
+        concurrency_label.setStyleSheet("font-size: 13px; color: #374151;")
+        self.batch_concurrency_spin = QSpinBox()
+        self.batch_concurrency_spin.setRange(1, 16)
+        self.batch_concurrency_spin.setSuffix(" 章")
+        self.batch_concurrency_spin.setToolTip("不读取上一章内容时各章互不依赖，可同时生成多章，按章节顺序保存；各服务商分别设置")
+        self.batch_concurrency_spin.setValue(self.batch_concurrency.get(self.api_type, 1))
+        self.batch_concurrency_spin.setEnabled(not self.read_previous_chapter_checkbox.isChecked())
+        self.batch_concurrency_spin.valueChanged.connect(self.on_batch_concurrency_changed)
+        self.read_previous_chapter_checkbox.toggled.connect(lambda checked: self.batch_concurrency_spin.setEnabled(not checked))
+        concurrency_layout.addWidget(concurrency_label)
+        concurrency_layout.addWidget(self.batch_concurrency_spin)
+        concurrency_layout.addStretch()
+        batch_layout.addLayout(concurrency_layout, 1, 4, 1, 2)
         
         # 批量生成进度条
         self.batch_progress_bar = QProgressBar()
@@ -4605,13 +4853,8 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         # 添加预设提示词选项
         self.preset_combo.addItem("请选择预设提示词...", "")
-        self.preset_combo.addItem("优化文笔和语言表达", "请优化本章节的文笔和语言表达，使文字更加优美流畅，增强文学性")
-        self.preset_combo.addItem("增强情感描写", "请重点增强本章节的情感描写，让人物情感更加细腻真实，增强读者共鸣")
-        self.preset_combo.addItem("提高可读性", "请优化本章节的可读性，使语言更加通俗易懂，段落结构更加清晰")
-        self.preset_combo.addItem("调整节奏和张力", "请优化本章节的节奏感和戏剧张力，使情节推进更加合理，增强吸引力")
-        self.preset_combo.addItem("丰富场景描写", "请丰富本章节的场景描写，让环境更加生动具体，增强画面感")
-        self.preset_combo.addItem("优化对话自然度", "请优化本章节的对话内容，使对话更加自然流畅，符合人物性格")
-        self.preset_combo.addItem("综合全面优化", "请对本章节进行全面优化，包括文笔、情感、节奏、对话等各个方面")
+        for preset_name, preset_prompt in POLISH_PRESETS:
+            self.preset_combo.addItem(preset_name, preset_prompt)
         
         self.preset_combo.currentTextChanged.connect(self.on_preset_selected)
         preset_layout.addWidget(self.preset_combo)
@@ -4696,35 +4939,40 @@ class CompactNovelGeneratorApp(QMainWindow):
         # 初始化章节列表
         self.load_chapter_list()
     
+    def project_catalog(self):
+        """当前保存目录的章节/大纲目录，保存目录改变时自动切换"""
+        if not hasattr(self, 'catalog'):
+            self.catalog = ProjectCatalog(self)
+            self.catalog.chapters_changed.connect(self.load_chapter_list)
+        self.catalog.set_root(getattr(self, 'save_path', 'novels'))
+        return self.catalog
+
     def load_chapter_list(self):
-        """加载章节列表"""
-        self.chapter_combo.clear()
-        
-        # 获取保存目录
-        save_path = getattr(self, 'save_path', 'novels')
-        if not os.path.exists(save_path):
+        """按章节目录更新润色页的章节下拉框，只增删有变化的项，保留当前选择"""
+        if not hasattr(self, 'chapter_combo'):
             return
-            
-        # 查找所有章节文件
-        chapter_files = []
-        for file_name in os.listdir(save_path):
-            if file_name.startswith("第") and file_name.endswith("章.txt"):
-                chapter_files.append(file_name)
-        
-        # 按章节号排序
-        chapter_files.sort(key=lambda x: self.extract_chapter_number(x))
-        
-        # 添加到下拉框
-        for file_name in chapter_files:
-            self.chapter_combo.addItem(file_name)
-    
-    def extract_chapter_number(self, file_name):
-        """从文件名中提取章节号"""
-        import re
-        match = re.search(r'第(\d+)章', file_name)
-        if match:
-            return int(match.group(1))
-        return 0
+        chapter_files = self.project_catalog().chapter_files
+        current = self.chapter_combo.currentText()
+        self.chapter_combo.blockSignals(True)
+        try:
+            # 两个列表都按章节号排序，逐项对齐，删除多余的项、插入缺少的项
+            wanted = set(chapter_files)
+            row = 0
+            for file_name in chapter_files:
+                while row < self.chapter_combo.count() and self.chapter_combo.itemText(row) not in wanted:
+                    self.chapter_combo.removeItem(row)
+                if row < self.chapter_combo.count() and self.chapter_combo.itemText(row) == file_name:
+                    row += 1
+                    continue
+                self.chapter_combo.insertItem(row, file_name)
+                row += 1
+            while self.chapter_combo.count() > row:
+                self.chapter_combo.removeItem(row)
+            index = self.chapter_combo.findText(current)
+            if index >= 0:
+                self.chapter_combo.setCurrentIndex(index)
+        finally:
+            self.chapter_combo.blockSignals(False)
     
     def start_polish_chapter(self):
         """开始润色章节"""
@@ -4763,19 +5011,10 @@ class CompactNovelGeneratorApp(QMainWindow):
             return
             
         # 构建润色prompt
-        prompt = f"请对以下小说章节进行润色优化：\n\n"
-        prompt += f"【原章节内容】\n{chapter_content}\n\n"
-        prompt += f"【润色要求】\n{polish_prompt}\n\n"
-        prompt += f"【润色说明】\n"
-        prompt += f"1. 保持原章节的核心情节和人物设定不变\n"
-        prompt += f"2. 重点优化文笔、语言表达和可读性\n"
-        prompt += f"3. 增强情感描写和场景氛围\n"
-        prompt += f"4. 提高对话的自然度和表现力\n"
-        prompt += f"5. 保持章节长度与原章节相近\n"
-        prompt += f"6. 使用纯中文输出，不要包含任何英文内容\n"
+        prompt = build_polish_prompt(chapter_content, polish_prompt)
         
         # 创建API调用线程
-        self.polish_thread = ApiCallThread(self.api_type, self.api_url, self.api_key, prompt, self.model_name,
+        self.polish_thread = create_api_call(self.api_type, self.api_url, self.api_key, prompt, self.model_name,
                                          api_format=self.api_format, custom_headers=self.custom_headers)
         self.polish_thread.finished.connect(self.on_polish_finished)
         self.polish_thread.error.connect(self.on_polish_error)
@@ -4787,6 +5026,12 @@ class CompactNovelGeneratorApp(QMainWindow):
     
     def on_polish_finished(self, response_text, status):
         """润色完成回调"""
+        if status != "success":
+            # 出错或被停止时不替换润色结果，避免把错误信息当成润色内容保存
+            self.polish_button.setEnabled(True)
+            self.status_bar.showMessage("润色已停止" if status == "cancelled" else "润色失败")
+            return
+        
         try:
             # 更新UI状态
             self.polish_button.setEnabled(True)
@@ -4867,7 +5112,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         new_file_path = os.path.join(save_path, new_file)
         
         # 检查文件是否已存在
-        if os.path.exists(new_file_path):
+        if get_write_queue().exists(new_file_path):
             reply = QMessageBox.question(self, "文件已存在", 
                                         f"文件 {new_file} 已存在，是否覆盖？",
                                         QMessageBox.Yes | QMessageBox.No)
@@ -4875,9 +5120,14 @@ class CompactNovelGeneratorApp(QMainWindow):
                 return
         
         try:
+            # 润色结果记入原章节的版本历史，作为旁支版本并注明实际保存的文件
+            original_path = os.path.join(getattr(self, 'save_path', 'novels'), original_file)
+            match = re.search(r'第(\d+)章', original_file)
+            if match:
+                self.record_chapter_version(original_path, int(match.group(1)), self.polished_content, KIND_POLISH,
+                                            note=f"保存为{new_file}")
             # 保存润色后的内容
-            with open(new_file_path, 'w', encoding='utf-8') as f:
-                f.write(self.polished_content)
+            get_write_queue().write(new_file_path, self.polished_content, fsync=True)
             
             # 显示成功消息
             QMessageBox.information(self, "保存成功", 
@@ -5031,32 +5281,10 @@ class CompactNovelGeneratorApp(QMainWindow):
         # 更新状态栏显示当前模型名称
         self.status_bar.showMessage(f"已切换到模型: {model_name}")
         
-        # 更新当前API配置中的模型名称
-        try:
-            # 加载现有参数
-            existing_params = {}
-            if os.path.exists("user_params.json"):
-                with open("user_params.json", "r", encoding="utf-8") as f:
-                    existing_params = json.load(f)
-            
-            # 确保api_configs存在
-            if "api_configs" not in existing_params:
-                existing_params["api_configs"] = {}
-            
-            # 确保当前API类型配置存在
-            if self.api_type not in existing_params["api_configs"]:
-                existing_params["api_configs"][self.api_type] = {}
-            
-            # 更新模型名称
-            existing_params["api_configs"][self.api_type]["model_name"] = model_name
-            
-            # 保存更新后的参数
-            with open("user_params.json", "w", encoding="utf-8") as f:
-                json.dump(existing_params, f, ensure_ascii=False, indent=4)
-            
+        # 更新当前API配置中的模型名称，由自动保存定时器写入文件
+        if self.user_config.update_api_config(self.api_type, model_name=model_name):
+            self.trigger_auto_save_settings("user_params")
             print(f"已更新模型配置: {self.api_type} -> {model_name}")
-        except Exception as e:
-            print(f"更新模型配置失败: {e}")
 
     def generate_outline(self):
         """生成小说大纲"""
@@ -5080,6 +5308,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.generate_button.setEnabled(False)
         self.stop_button.setEnabled(True)  # 点击生成大纲按钮后启用停止按钮
         self.set_app_status("忙碌")
+        self.warm_up_ollama()
         
         # 显示进度条
         self.progress_bar.setValue(0)
@@ -5095,30 +5324,16 @@ class CompactNovelGeneratorApp(QMainWindow):
         plot = self.plot_text.toPlainText()
         
         # 构建详细的大纲生成prompt
-        prompt = f"请为小说《{title}》生成详细的大纲。\n\n"
-        prompt += f"小说背景：{background}\n\n"
-        prompt += f"核心剧情：{plot}\n\n"
-        prompt += "请生成一个完整的小说大纲，包含以下内容：\n"
-        prompt += "1. 故事梗概（200-300字）\n"
-        prompt += "2. 主要人物介绍（主角、配角及其关系）\n"
-        prompt += "3. 故事结构（开端、发展、高潮、结局）\n"
-        prompt += "4. 主要情节线（至少3条）\n"
-        prompt += "5. 情感发展线（主角情感变化）\n"
-        prompt += "6. 关键转折点和冲突\n"
-        prompt += "7. 每章内容概要（至少10章）\n\n"
-        prompt += "要求：\n"
-        prompt += "- 大纲要详细具体，每个情节点都要有具体的场景和事件描述\n"
-        prompt += "- 人物关系要复杂立体，避免简单的善恶二元对立\n"
-        prompt += "- 情感线索要清晰，与主线剧情紧密结合\n"
-        prompt += "- 重要：请使用纯中文生成大纲，不要包含任何英文内容\n"
-        
-        self.api_thread = ApiCallThread(self.api_type, self.api_url, self.api_key, prompt, self.model_name,
+        prompt = build_outline_prompt(title, background, plot)
+        
+        self.api_thread = create_api_call(self.api_type, self.api_url, self.api_key, prompt, self.model_name,
                                        api_format=self.api_format, custom_headers=self.custom_headers)
+        self.start_generation_journal(self.api_thread, JOURNAL_OUTLINE, 0, prompt)
         self.api_thread.finished.connect(self.on_outline_ready)
         self.api_thread.error.connect(self.on_api_error)
         self.api_thread.progress.connect(self.on_progress)
-        # 新增：连接内容更新信号，实现实时显示
-        self.api_thread.content_update.connect(self.on_outline_content_update)
+        # 连接内容增量信号，实现实时显示
+        self.api_thread.content_delta.connect(self.on_outline_content_update)
         self.api_thread.start()
 
     def generate_chapter(self):
@@ -5131,6 +5346,8 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.generate_chapter_button.setEnabled(False)
         self.stop_button.setEnabled(True)
         self.set_app_status("忙碌")
+        # 读取前文、构建提示词的同时加载模型
+        self.warm_up_ollama()
         
         # 获取小说标题
         title = self.novel_title_input.text().strip()
@@ -5144,105 +5361,30 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.progress_bar.setValue(0)
         self.progress_label.setText(f"正在生成第{self.chapter_number.value()}章...")
         
-        # 优化提示词
-        prompt = f"请根据以下小说大纲生成《{title}》的第{self.chapter_number.value()}章内容：\n"
-        prompt += self.outline_text.toPlainText() + "\n\n"
-        
-        # 如果是第一章，添加特殊要求
-        if self.chapter_number.value() == 1:
-            prompt += "【第一章特殊要求】\n"
-            prompt += "1. 开篇必须在3秒内抓住读者注意力，使用以下三种开头类型之一：\n"
-            prompt += "   a) 冲突型开头：直接让主角面临危机或矛盾，不做铺垫\n"
-            prompt += "   b) 悬念型开头：用反常细节制造疑问，不解释只呈现不合理场景\n"
-            prompt += "   c) 情绪共鸣型开头：用细腻细节唤起读者情感，快速代入主角心境\n"
-            prompt += "2. 主角出场要有鲜明特点，通过具体行动展示性格而非描述\n"
-            prompt += "3. 在前500字内必须出现一个异常事件或转折点\n"
-            prompt += "4. 设置至少2个谜团或伏笔，为后续章节埋下线索\n"
-            prompt += "5. 结尾要留下强烈悬念，让读者迫切想知道后续发展\n"
-            prompt += "6. 避免平铺直叙的背景介绍，将背景信息融入情节发展中\n"
-            prompt += "7. 使用生动的感官描写（视觉、听觉、触觉等）营造氛围\n"
-            prompt += "8. 对话要简洁有力，每句对话都要推动情节或展示人物性格\n"
-            prompt += "9. 开篇避免使用天气描写、环境描写等常见套路，除非与情节直接相关\n"
-            prompt += "10. 确保第一段就出现核心冲突或悬念，不要慢慢铺垫\n\n"
-            prompt += "【情感冲突要求】\n"
-            prompt += "11. 必须包含'虐妻一时爽，追妻火葬场'元素，情节要狗血且富有张力\n"
-            prompt += "12. 主角与女主角之间要有误解、伤害与情感纠葛，为后续追妻情节埋下伏笔\n"
-            prompt += "13. 设计至少一个让读者心疼女主角的场景，展现主角的冷漠或误解\n"
-            prompt += "14. 在情感冲突中埋下后悔与救赎的种子，为后续追妻火葬场做铺垫\n\n"
-        
         # 如果用户选择了读取上一章内容，并且当前章节不是第一章，则读取上一章内容
+        prev_content = ""
+        story_context = ""
         if hasattr(self, 'single_read_previous_chapter_checkbox') and self.single_read_previous_chapter_checkbox.isChecked() and self.chapter_number.value() > 1:
             prev_chapter = self.chapter_number.value() - 1
             
-            # 尝试多种可能的文件名格式
-            possible_files = [
-                f"第{prev_chapter}章.txt",  # 旧格式
-                f"第{prev_chapter:03d}章.txt"  # 带零的旧格式
-            ]
+            prev_file_path = self.chapter_index().find_path(prev_chapter, title)
             
-            prev_file_path = None
-            for file_name in possible_files:
-                test_path = os.path.join(self.save_path, file_name)
-                if os.path.exists(test_path):
-                    prev_file_path = test_path
-                    break
-            
-            if prev_file_path and os.path.exists(prev_file_path):
+            if prev_file_path:
                 try:
-                    with open(prev_file_path, 'r', encoding='utf-8') as file:
-                        prev_content = file.read()
-                        # 只取上一章的最后1000个字符，避免上下文过长
-                        prev_content = prev_content[-1000:] if len(prev_content) > 1000 else prev_content
-                        prompt += f"上一章结尾内容：\n{prev_content}\n\n"
-                        prompt += f"请确保新章节与上一章内容衔接自然，情节连贯。\n\n"
-                        print(f"已读取第{prev_chapter}章内容作为上下文")
+                    prev_content = get_write_queue().read_text(prev_file_path)
+                    # 故事记忆组装有预算上限的上下文，失败时退回到上一章的最后1000个字符
+                    story_context = self.story_context(self.chapter_number.value(), prev_content)
+                    print(f"已读取第{prev_chapter}章内容作为上下文")
                 except Exception as e:
                     print(f"读取上一章内容失败: {e}")
             else:
                 print(f"未找到第{prev_chapter}章文件")
         
-        prompt += f"章节具体要求：\n"
-        prompt += f"- 保持{self.pov_combo.currentText()}视角\n"
-        prompt += f"- 使用{self.lang_combo.currentText()}风格\n"
-        prompt += f"- 节奏：{self.rhythm_combo.currentText()}\n"
-        prompt += f"- 字数：约{target_length}字\n"
-        prompt += f"- 重要：请使用纯中文生成章节内容，不要包含任何英文内容\n"
-        
-        # 添加情感冲突要求
-        prompt += "\n【情感冲突要求】\n"
-        prompt += "1. 必须包含'虐妻一时爽，追妻火葬场'元素，情节要狗血且富有张力\n"
-        prompt += "2. 主角与女主角之间要有误解、伤害与情感纠葛，为后续追妻情节埋下伏笔\n"
-        prompt += "3. 设计至少一个让读者心疼女主角的场景，展现主角的冷漠或误解\n"
-        prompt += "4. 在情感冲突中埋下后悔与救赎的种子，为后续追妻火葬场做铺垫\n"
-        prompt += "5. 情感冲突要激烈但不过度，保持角色性格的一致性\n"
-        prompt += "6. 每章都要有情感张力，让读者感受到'虐'的痛苦和'追'的渴望\n"
-        
-        # 添加通用写作技巧要求
-        prompt += "\n【写作技巧要求】\n"
-        prompt += "1. 每个段落都要有明确目的，要么推动情节，要么塑造人物，要么营造氛围\n"
-        prompt += "2. 使用'展示而非告知'的写作手法，通过具体行动和细节展示信息\n"
-        prompt += "3. 控制信息释放节奏，不要一次性揭示所有信息\n"
-        prompt += "4. 确保每个场景都有开头、发展和结尾\n"
-        prompt += "5. 使用多样化的句式结构，避免单调重复\n"
-        
-        # 添加口语化写作要求
-        prompt += "\n【口语化写作要求】\n"
-        prompt += "1. 使用自然流畅的口语化表达，避免过于书面化的词语\n"
-        prompt += "2. 减少华丽修饰词和形容词堆砌，保持简洁有力\n"
-        prompt += "3. 对话要贴近生活，使用人们日常交流的语言风格\n"
-        prompt += "4. 避免使用过于复杂的句式和生僻词汇\n"
-        prompt += "5. 叙述部分要像讲故事一样自然，不要有明显的AI写作痕迹\n"
-        prompt += "6. 适当使用口语化的语气词和感叹词，增强真实感\n"
-        prompt += "7. 避免过度解释和心理描写，让读者自行感受\n"
-        
-        # 如果不是第一章，添加章节衔接要求
-        if self.chapter_number.value() > 1:
-            prompt += "\n【章节衔接要求】\n"
-            prompt += "1. 开头要与上一章结尾自然衔接\n"
-            prompt += "2. 适当回顾上一章关键信息，但避免重复\n"
-            prompt += "3. 推进至少一个主要情节线\n"
-            prompt += "4. 引入新的冲突或发展现有冲突\n"
-            prompt += "5. 结尾要为下一章做好铺垫\n"
+        # 不随章节变化的说明和写作要求在前，本章的大纲概要、前文和目标字数在后，便于前缀缓存命中
+        prompt = build_single_chapter_prompt(title, self.chapter_number.value(), self.outline_text.toPlainText(),
+                                             self.pov_combo.currentText(), self.lang_combo.currentText(),
+                                             self.rhythm_combo.currentText(), target_length, prev_content,
+                                             story_context)
         
         # 输出API调用信息，用于调试
         print(f"正在调用API: 类型={self.api_type}, URL={self.api_url}, 模型={self.model_name}")
@@ -5251,14 +5393,16 @@ class CompactNovelGeneratorApp(QMainWindow):
             print(f"自定义请求头: {self.custom_headers}")
             
         # 创建API调用线程，传递最大章节字数限制
-        self.api_thread = ApiCallThread(self.api_type, self.api_url, self.api_key, prompt, self.model_name, 
+        self.api_thread = create_api_call(self.api_type, self.api_url, self.api_key, prompt, self.model_name, 
                                        api_format=self.api_format, custom_headers=self.custom_headers,
                                        max_chapter_length=self.max_chapter_length)
+        self.start_generation_journal(self.api_thread, JOURNAL_CHAPTER, self.chapter_number.value(), prompt)
+        self.streaming_chapter = self.chapter_number.value()
         self.api_thread.finished.connect(self.on_chapter_ready)
         self.api_thread.error.connect(self.on_api_error)
         self.api_thread.progress.connect(self.on_progress)
-        # 新增：连接内容更新信号，实现实时显示
-        self.api_thread.content_update.connect(self.on_content_update)
+        # 连接内容增量信号，实现实时显示
+        self.api_thread.content_delta.connect(self.on_content_update)
         self.api_thread.start()
 
     def prev_chapter(self):
@@ -5287,6 +5431,7 @@ class CompactNovelGeneratorApp(QMainWindow):
             return
             
         try:
+            perf.incr("chapter_view_loads")
             # 获取小说标题
             title = self.novel_title_input.text().strip()
             if not title:
@@ -5305,32 +5450,19 @@ class CompactNovelGeneratorApp(QMainWindow):
                     self.status_bar.showMessage(f"创建保存目录失败: {str(e)}")
                     return
             
-            # 尝试多种可能的文件名格式
-            possible_files = [
-                f"第{value}章.txt",  # 旧格式
-                f"第{value:03d}章.txt"  # 带零的旧格式
-            ]
-            
-            file_path = None
-            for file_name in possible_files:
-                test_path = os.path.join(self.save_path, file_name)
-                if os.path.exists(test_path):
-                    file_path = test_path
-                    break
-            
-            # 如果所有格式都不存在，使用新格式作为默认路径
-            if file_path is None:
-                file_path = os.path.join(self.save_path, f"第{value}章.txt")
+            # 从章节索引查找：第X章.txt、第00X章.txt或带小说标题的旧格式
+            file_path = self.chapter_index().find_path(value, title)
             
             # 检查文件是否存在
-            if os.path.exists(file_path):
+            if file_path:
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as file:
-                        content = file.read()
-                        self.chapter_text.setPlainText(content)
-                        self.save_button.setEnabled(True)
-                        self.status_bar.showMessage(f"已加载第{value}章内容")
-                        print(f"[调试] 成功加载第{value}章内容")
+                    perf.incr("chapter_view_file_reads")
+                    content = get_write_queue().read_text(file_path)
+                    content_cache.remember(file_path, content)
+                    self.chapter_text.setPlainText(content)
+                    self.save_button.setEnabled(True)
+                    self.status_bar.showMessage(f"已加载第{value}章内容")
+                    print(f"[调试] 成功加载第{value}章内容")
                 except Exception as e:
                     print(f"[调试] 加载章节内容失败: {e}")
                     self.status_bar.showMessage(f"加载第{value}章内容失败")
@@ -5341,7 +5473,7 @@ class CompactNovelGeneratorApp(QMainWindow):
                 self.chapter_text.clear()
                 self.save_button.setEnabled(False)
                 self.status_bar.showMessage(f"第{value}章尚未生成")
-                print(f"[调试] 第{value}章文件不存在: {file_path}")
+                print(f"[调试] 第{value}章文件不存在")
                 # 不显示提示信息，避免频繁弹窗
         except Exception as e:
             print(f"[调试] 章节号改变处理失败: {e}")
@@ -5356,32 +5488,20 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         # 构建文件路径
         chapter_num = self.chapter_number.value()
+        perf.incr("chapter_view_loads")
         
-        # 尝试多种可能的文件名格式
-        possible_files = [
-            f"第{chapter_num}章.txt",  # 旧格式
-            f"第{chapter_num:03d}章.txt"  # 带零的旧格式
-        ]
-        
-        file_path = None
-        for file_name in possible_files:
-            test_path = os.path.join(self.save_path, file_name)
-            if os.path.exists(test_path):
-                file_path = test_path
-                break
-        
-        # 如果所有格式都不存在，使用新格式作为默认路径
-        if file_path is None:
-            file_path = os.path.join(self.save_path, f"第{chapter_num}章.txt")
+        # 从章节索引查找：第X章.txt、第00X章.txt或带小说标题的旧格式
+        file_path = self.chapter_index().find_path(chapter_num, title)
         
         # 检查文件是否存在
-        if os.path.exists(file_path):
+        if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    self.chapter_text.setPlainText(content)
-                    self.save_button.setEnabled(True)
-                    self.status_bar.showMessage(f"已加载第{chapter_num}章内容")
+                perf.incr("chapter_view_file_reads")
+                content = get_write_queue().read_text(file_path)
+                content_cache.remember(file_path, content)
+                self.chapter_text.setPlainText(content)
+                self.save_button.setEnabled(True)
+                self.status_bar.showMessage(f"已加载第{chapter_num}章内容")
             except Exception as e:
                 print(f"加载章节内容失败: {e}")
                 self.status_bar.showMessage(f"加载第{chapter_num}章内容失败")
@@ -5441,23 +5561,16 @@ class CompactNovelGeneratorApp(QMainWindow):
         title = self.novel_title_input.text().strip()
         if not title:
             title = "未命名小说"
+        
+        # 同一范围的任务上次被中断时直接从中断处继续，不再逐个检查章节文件
+        unfinished = self.find_unfinished_batch(title)
+        if unfinished and (unfinished["start_chapter"], unfinished["end_chapter"]) == (start_chapter, end_chapter):
+            print(f"[任务表] 第{start_chapter}-{end_chapter}章有未完成的任务，从中断处继续")
+            self.resume_batch_generation(unfinished)
+            return
             
-        existing_chapters = []
-        for chapter in range(start_chapter, end_chapter + 1):
-            # 尝试多种可能的文件名格式
-            possible_files = [
-                f"第{chapter}章.txt",  # 旧格式
-                f"第{chapter:03d}章.txt"  # 带零的旧格式
-            ]
-            
-            chapter_exists = False
-            if os.path.exists(self.save_path):
-                for file_name in possible_files:
-                    file_path = os.path.join(self.save_path, file_name)
-                    if os.path.exists(file_path):
-                        existing_chapters.append(chapter)
-                        chapter_exists = True
-                        break
+        # 整个范围只扫描一次保存目录
+        existing_chapters = self.chapter_index().existing(range(start_chapter, end_chapter + 1), title)
         
         # 默认设置为跳过已存在章节
         overwrite_existing = False
@@ -5567,15 +5680,39 @@ class CompactNovelGeneratorApp(QMainWindow):
             if confirm_box.clickedButton() != yes_button:
                 return
         
+        # 获取用户选择的"读取上一章内容"选项
+        read_previous_chapter = self.read_previous_chapter_checkbox.isChecked()
+        # 不读取上一章内容时按当前服务商的设置同时生成多章
+        concurrency = 1 if read_previous_chapter else self.batch_concurrency.get(self.api_type, 1)
+        print(f"[调试] 批量生成并发数: {concurrency}")
+        
+        # 在任务表中登记本次批量生成，之前未完成的任务由本次替代
+        job_store = None
+        batch_id = None
+        try:
+            job_store = get_job_store(self.save_path)
+            if unfinished:
+                job_store.finish_batch(unfinished["id"])
+            batch_id = job_store.create_batch(title, start_chapter, end_chapter, read_previous_chapter,
+                                              overwrite_existing, concurrency)
+        except Exception as e:
+            print(f"[任务表] 登记批量任务失败，本次生成不记录进度: {e}")
+            job_store = None
+        
+        self._launch_batch_generator(start_chapter, end_chapter, overwrite_existing, read_previous_chapter,
+                                     concurrency, job_store, batch_id)
+    
+    def _launch_batch_generator(self, start_chapter, end_chapter, overwrite_existing, read_previous_chapter,
+                                concurrency, job_store=None, batch_id=None):
+        """创建并启动批量生成线程"""
         # 初始化批量生成状态
         self.batch_progress_bar.setValue(0)
         self.batch_progress_label.setText(f"准备生成章节 {start_chapter} 到 {end_chapter}")
         self.batch_generate_button.setEnabled(False)
         self.batch_stop_button.setEnabled(True)
         self.batch_stop_button.setStyleSheet(self.get_button_style())
-        
-        # 获取用户选择的"读取上一章内容"选项
-        read_previous_chapter = self.read_previous_chapter_checkbox.isChecked()
+        self._reset_batch_preview()
+        self._begin_ollama_batch()
         
         # 打印API配置信息
         print(f"[调试] API配置: 类型={self.api_type}, URL={self.api_url}, 模型={self.model_name}")
@@ -5585,7 +5722,8 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         # 创建批量生成线程
         print("[调试] 创建ChapterGenerator实例")
-        self.batch_generator = ChapterGenerator(self, start_chapter, end_chapter, overwrite_existing, read_previous_chapter)
+        self.batch_generator = ChapterGenerator(self, start_chapter, end_chapter, overwrite_existing, read_previous_chapter,
+                                                concurrency, job_store, batch_id)
         
         print("[调试] 连接信号")
         # 先断开所有可能存在的连接，避免重复连接导致的问题
@@ -5602,6 +5740,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.batch_generator.progress.connect(self.on_batch_progress)
         self.batch_generator.finished.connect(self.on_batch_finished)
         self.batch_generator.error.connect(self.on_batch_error)
+        self.batch_generator.content_delta.connect(self.on_batch_content_update)
         
         print("[调试] 启动线程")
         self.batch_generator.start()
@@ -5609,6 +5748,52 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         self.status_bar.showMessage(f"开始批量生成章节 {start_chapter}-{end_chapter}")
         self.set_app_status("忙碌")
+    
+    def find_unfinished_batch(self, novel_title=None):
+        """查找保存目录任务表中未完成的批量任务，没有任务表时不创建"""
+        if not os.path.exists(os.path.join(self.save_path, JOB_DB_NAME)):
+            return None
+        try:
+            return get_job_store(self.save_path).find_unfinished_batch(novel_title)
+        except Exception as e:
+            print(f"[任务表] 读取未完成任务失败: {e}")
+            return None
+    
+    def resume_batch_generation(self, batch):
+        """按任务表中记录的参数继续被中断的批量生成，已完成的章节直接跳过"""
+        if hasattr(self, 'batch_generator') and self.batch_generator and self.batch_generator.isRunning():
+            print("[调试] 批量生成正在进行，不能继续其他任务")
+            return
+        job_store = get_job_store(self.save_path)
+        batch = job_store.resume_batch(batch["id"])
+        counts = job_store.counts(batch["id"])
+        print(f"[任务表] 继续批量任务{batch['id']}: {counts}")
+        
+        self.start_chapter_spin.setValue(batch["start_chapter"])
+        self.end_chapter_spin.setValue(batch["end_chapter"])
+        self.read_previous_chapter_checkbox.setChecked(bool(batch["read_previous"]))
+        self._launch_batch_generator(batch["start_chapter"], batch["end_chapter"], bool(batch["overwrite_existing"]),
+                                     bool(batch["read_previous"]), batch["concurrency"], job_store, batch["id"])
+        self.status_bar.showMessage(f"继续批量生成章节 {batch['start_chapter']}-{batch['end_chapter']}，"
+                                    f"已完成{counts[STATE_DONE]}章")
+    
+    def check_unfinished_batch(self):
+        """启动时检查是否有被中断的批量生成任务，询问是否继续"""
+        batch = self.find_unfinished_batch()
+        if not batch:
+            return
+        counts = get_job_store(self.save_path).counts(batch["id"])
+        total = batch["end_chapter"] - batch["start_chapter"] + 1
+        reply = QMessageBox.question(
+            self, "继续批量生成",
+            f"检测到未完成的批量生成任务：《{batch['novel_title']}》第{batch['start_chapter']}章到第{batch['end_chapter']}章，"
+            f"已完成{counts[STATE_DONE]}/{total}章。\n\n是否从中断处继续？选择“否”将放弃该任务。",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply == QMessageBox.Yes:
+            self.resume_batch_generation(batch)
+        else:
+            get_job_store(self.save_path).finish_batch(batch["id"])
+            print(f"[任务表] 已放弃批量任务{batch['id']}")
 
     def stop_batch_generation(self):
         """停止批量生成"""
@@ -5621,6 +5806,8 @@ class CompactNovelGeneratorApp(QMainWindow):
                 self.batch_generator.terminate()
                 self.batch_generator.wait(1000)  # 再等待1秒确保终止
             print("[调试] 批量生成线程已停止")
+            self._end_ollama_batch()
+            self._report_batch_preview()
             
             # 断开所有信号连接，避免内存泄漏
             try:
@@ -5642,6 +5829,18 @@ class CompactNovelGeneratorApp(QMainWindow):
         else:
             print("[调试] 批量生成线程未运行或已停止")
 
+    def on_batch_concurrency_changed(self, value):
+        """记录当前服务商批量生成时同时生成的章节数"""
+        self.batch_concurrency[self.api_type] = value
+        self.trigger_auto_save_settings("user_params")
+    
+    def refresh_batch_concurrency_spin(self):
+        """切换服务商后显示该服务商的并发设置"""
+        if hasattr(self, 'batch_concurrency_spin'):
+            self.batch_concurrency_spin.blockSignals(True)
+            self.batch_concurrency_spin.setValue(self.batch_concurrency.get(self.api_type, 1))
+            self.batch_concurrency_spin.blockSignals(False)
+    
     def on_progress(self, value):
         """更新进度条"""
         self.progress_bar.setValue(value)
@@ -5676,11 +5875,6 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.save_button.setEnabled(True)
         print(f"[调试] 已启用保存按钮")
         
-        # 强制更新UI
-        self.chapter_text.update()
-        self.chapter_text.repaint()
-        print(f"[调试] 已强制更新UI")
-        
         self.status_bar.showMessage(f"第{chapter_num}章生成完成")
         print(f"[调试] 已更新状态栏")
 
@@ -5730,6 +5924,8 @@ class CompactNovelGeneratorApp(QMainWindow):
             # 清理线程对象
             self.batch_generator = None
         
+        self._end_ollama_batch()
+        self._report_batch_preview()
         self.batch_progress_label.setText("批量生成完成！")
         self.batch_generate_button.setEnabled(True)
         self.batch_stop_button.setEnabled(False)
@@ -5778,6 +5974,8 @@ class CompactNovelGeneratorApp(QMainWindow):
             # 清理线程对象
             self.batch_generator = None
         
+        self._end_ollama_batch()
+        self._report_batch_preview()
         # 可以选择继续生成后续章节
         self.status_bar.showMessage(f"第{chapter_num}章生成失败: {error_msg} - 批量生成已停止")
 
@@ -5785,6 +5983,14 @@ class CompactNovelGeneratorApp(QMainWindow):
         """处理大纲生成完成的回调函数"""
         self.generate_button.setEnabled(True)  # 生成完成后重新启用生成按钮
         self.stop_button.setEnabled(False)  # 生成完成后禁用停止按钮
+        # 下面直接显示完整内容，渲染器中尚未显示的片段不再需要
+        self.outline_renderer.discard()
+        
+        if status != "success":
+            # 出错或被停止时不覆盖大纲文件
+            self.status_bar.showMessage("大纲生成已停止" if status == "cancelled" else "大纲生成失败，大纲文件未修改")
+            self.set_app_status("正常")
+            return
         
         try:
             self.outline_text.setPlainText(response)
@@ -5849,43 +6055,25 @@ class CompactNovelGeneratorApp(QMainWindow):
             outline_content = "大纲生成失败，请检查API配置和网络连接"
         
         try:
-            with open(outline_file, 'w', encoding='utf-8') as file:
-                file.write(outline_content)
-            print(f"大纲已保存到: {outline_file}")
+            if content_cache.write_text(outline_file, outline_content):
+                print(f"大纲已保存到: {outline_file}")
+                store = get_project_store(self.save_path)
+                if store is not None:
+                    store.put_outline(title, outline_content)
+            else:
+                print(f"[调试] 大纲内容未变化，跳过写入: {outline_file}")
         except Exception as e:
             print(f"保存大纲失败: {e}")
             
     def check_and_load_saved_outline(self):
         """检查并加载已保存的大纲"""
-        # 检查outlines目录是否存在
-        outlines_dir = os.path.join(self.save_path, "outlines")
-        if not os.path.exists(outlines_dir):
-            print(f"[调试] outlines目录不存在: {outlines_dir}")
-            return
-            
-        # 获取所有大纲文件
-        outline_files = [f for f in os.listdir(outlines_dir) if f.endswith("_outline.txt") or f.endswith("大纲.txt")]
-        if not outline_files:
-            print("[调试] 没有找到已保存的大纲文件")
+        # 查找最近修改的大纲文件，文件名中包含小说标题
+        title, latest_outline = self.project_catalog().latest_outline()
+        if latest_outline is None:
+            print(f"[调试] 没有找到已保存的大纲文件: {os.path.join(self.save_path, 'outlines')}")
             return
-            
-        # 如果有多个大纲文件，选择最新的一个
-        if len(outline_files) > 1:
-            # 按修改时间排序，选择最新的
-            outline_files.sort(key=lambda f: os.path.getmtime(os.path.join(outlines_dir, f)), reverse=True)
-            
-        # 获取最新大纲文件的完整路径
-        latest_outline = os.path.join(outlines_dir, outline_files[0])
         print(f"[调试] 找到最新大纲文件: {latest_outline}")
         
-        # 从文件名提取小说标题
-        if latest_outline.endswith("_outline.txt"):
-            title = os.path.basename(latest_outline).replace("_outline.txt", "")
-        elif latest_outline.endswith("大纲.txt"):
-            title = os.path.basename(latest_outline).replace("大纲.txt", "")
-        else:
-            title = os.path.basename(latest_outline).split('.')[0]  # 默认去除扩展名
-        
         # 设置小说标题
         self.novel_title_input.setText(title)
         
@@ -6003,47 +6191,84 @@ class CompactNovelGeneratorApp(QMainWindow):
             print(f"加载大纲失败: {e}")
             return False
 
-    def on_content_update(self, content):
-        """处理API返回的内容更新，实现实时显示"""
-        # 直接设置章节内容到文本框
-        self.chapter_text.setPlainText(content)
-        # 保存当前内容，确保UI更新时能正确显示
-        self.current_chapter_content = content
-        # 强制更新UI
-        self.chapter_text.update()
-        self.chapter_text.repaint()
-        # 更新状态栏，显示当前生成字数
-        self.status_bar.showMessage(f"正在生成第{self.chapter_number.value()}章... 已生成 {len(content)} 字")
-        # 滚动到底部，显示最新内容
-        self.chapter_text.verticalScrollBar().setValue(self.chapter_text.verticalScrollBar().maximum())
-        
-    def on_outline_content_update(self, content):
-        """处理大纲生成时的内容更新，实现实时显示"""
-        # 更新大纲文本框内容，实现实时显示效果
-        self.outline_text.setPlainText(content)
-        # 强制更新UI
-        self.outline_text.update()
-        self.outline_text.repaint()
-        # 更新状态栏，显示当前生成字数
-        self.status_bar.showMessage(f"正在生成大纲... 已生成 {len(content)} 字")
-        # 滚动到底部，显示最新内容
-        self.outline_text.verticalScrollBar().setValue(self.outline_text.verticalScrollBar().maximum())
-        
-    def on_batch_content_update(self, chapter_num, content):
-        """处理批量生成时的内容更新，实现实时显示"""
-        # 切换到当前生成的章节
+    def on_content_update(self, chunk, offset):
+        """处理API返回的内容增量，由渲染器按帧合并显示"""
+        self.chapter_renderer.append(chunk, offset,
+                                     f"正在生成第{self.chapter_number.value()}章... 已生成 {offset + len(chunk)} 字")
+        
+    def on_outline_content_update(self, chunk, offset):
+        """处理大纲生成时的内容增量，由渲染器按帧合并显示"""
+        self.outline_renderer.append(chunk, offset, f"正在生成大纲... 已生成 {offset + len(chunk)} 字")
+        
+    def on_batch_content_update(self, chapter_num, chunk, offset):
+        """处理批量生成时的内容增量，实现实时显示"""
+        perf.incr("batch_preview_deltas")
+        # 每章只在收到第一个片段时切换一次，之后的片段直接追加，不读取章节文件
+        if chapter_num != self.batch_preview_chapter:
+            self._switch_batch_preview(chapter_num)
+        self.chapter_renderer.append(chunk, offset,
+                                     f"正在批量生成第{chapter_num}章... 已生成 {offset + len(chunk)} 字")
+
+    def _switch_batch_preview(self, chapter_num):
+        """批量生成实时预览切换到新的章节
+
+        屏蔽章节号控件的信号，避免on_chapter_number_changed去磁盘查找并读取章节文件，
+        预览内容完全来自生成线程转发的增量。
+        """
+        self.batch_preview_chapter = chapter_num
+        perf.incr("batch_preview_switches")
+        self.chapter_number.blockSignals(True)
         self.chapter_number.setValue(chapter_num)
-        # 直接设置章节内容到文本框
-        self.chapter_text.setPlainText(content)
-        # 保存当前内容，确保UI更新时能正确显示
-        self.current_chapter_content = content
-        # 强制更新UI
-        self.chapter_text.update()
-        self.chapter_text.repaint()
-        # 更新状态栏，显示当前生成字数
-        self.status_bar.showMessage(f"正在批量生成第{chapter_num}章... 已生成 {len(content)} 字")
-        # 滚动到底部，显示最新内容
-        self.chapter_text.verticalScrollBar().setValue(self.chapter_text.verticalScrollBar().maximum())
+        self.chapter_number.blockSignals(False)
+        # 上一章尚未显示的片段直接丢弃
+        self.chapter_renderer.reset()
+    
+    def _reset_batch_preview(self):
+        """开始批量生成时清空实时预览状态，并记录性能计数的起点"""
+        self.batch_preview_chapter = None
+        self.batch_preview_perf_start = perf.snapshot()
+    
+    def _begin_ollama_batch(self):
+        """Ollama：批量生成开始时预热模型，批量生成期间保持加载"""
+        self.ollama_batch_session = None
+        if self.api_type == "Ollama":
+            self.ollama_batch_session = get_ollama_session(self.api_url, self.model_name)
+            self.ollama_batch_session.begin_batch()
+    
+    def _end_ollama_batch(self):
+        """Ollama：批量生成结束（完成、停止或出错）时恢复保活时间，输出延迟统计"""
+        ollama_session = getattr(self, 'ollama_batch_session', None)
+        if ollama_session is None:
+            return
+        self.ollama_batch_session = None
+        report = ollama_session.end_batch()
+        if report:
+            print(f"[Ollama] 本次批量生成: {report}")
+    
+    def _report_batch_preview(self):
+        """批量生成结束时输出实时预览期间的性能计数"""
+        start = getattr(self, 'batch_preview_perf_start', None)
+        if start is None:
+            return
+        now = perf.snapshot()
+        delta = {name: now.get(name, 0) - start.get(name, 0)
+                 for name in ("batch_preview_deltas", "batch_preview_switches",
+                              "chapter_view_loads", "chapter_view_file_reads")}
+        deltas = delta["batch_preview_deltas"]
+        reads_per_delta = delta["chapter_view_file_reads"] / deltas if deltas else 0.0
+        print(f"[性能] 批量实时预览: 片段 {deltas}, 切换章节 {delta['batch_preview_switches']}, "
+              f"界面查找章节文件 {delta['chapter_view_loads']} 次, 读取章节文件 {delta['chapter_view_file_reads']} 次, "
+              f"每片段读取 {reads_per_delta:.3f} 次")
+        report = prefix_report(start)
+        if report:
+            print(f"[提示词] 本次批量生成: {report}")
+        self.batch_preview_chapter = None
+        self.batch_preview_perf_start = None
+
+    def on_write_failed(self, file_path, error):
+        """后台写盘失败"""
+        self.status_bar.showMessage(f"保存文件失败: {os.path.basename(file_path)}: {error}")
+        self.set_app_status("异常")
 
     def on_show_overwrite_dialog(self, chapter_num, file_path):
         """显示覆盖对话框，让用户选择是否覆盖已存在的章节文件"""
@@ -6057,8 +6282,9 @@ class CompactNovelGeneratorApp(QMainWindow):
             # 如果设置为"覆盖"，直接保存
             if self.file_behavior == "覆盖":
                 try:
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        file.write(content)
+                    self.record_chapter_version(file_path, chapter_num, content, KIND_GENERATE)
+                    get_write_queue().write(file_path, content, fsync=True)
+                    record_chapter_write(file_path, content)
                     self.status_bar.showMessage(f"第{chapter_num}章已覆盖保存")
                     print(f"章节已覆盖保存到: {file_path}")
                 except Exception as e:
@@ -6114,8 +6340,9 @@ class CompactNovelGeneratorApp(QMainWindow):
         if confirm_box.clickedButton() == yes_button:
             # 用户选择覆盖，保存文件
             try:
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    file.write(content)
+                self.record_chapter_version(file_path, chapter_num, content, KIND_GENERATE)
+                get_write_queue().write(file_path, content, fsync=True)
+                record_chapter_write(file_path, content)
                 self.status_bar.showMessage(f"第{chapter_num}章已保存")
                 print(f"章节已保存到: {file_path}")
             except Exception as e:
@@ -6135,8 +6362,20 @@ class CompactNovelGeneratorApp(QMainWindow):
         print(f"response内容预览: {response[:100] if response else 'None'}...")
         print(f"当前章节号: {self.chapter_number.value()}")
         
+        self.streaming_chapter = None
         self.generate_chapter_button.setEnabled(True)
         self.stop_button.setEnabled(False)
+        # 下面直接显示完整内容，渲染器中尚未显示的片段不再需要
+        self.chapter_renderer.discard()
+        
+        if status != "success":
+            # 出错或被停止时不写入章节文件，保留生成日志，下次启动可以恢复或续写已生成的部分
+            self.end_generation_journal(self.api_thread, saved=False)
+            message = "已停止" if status == "cancelled" else "失败，章节文件未修改"
+            self.status_bar.showMessage(f"第{self.chapter_number.value()}章生成{message}")
+            self.progress_label.setText(f"第{self.chapter_number.value()}章生成{message}")
+            self.set_app_status("正常")
+            return
         
         try:
             # 检查response是否为空
@@ -6147,6 +6386,7 @@ class CompactNovelGeneratorApp(QMainWindow):
                 # 保存当前章节内容，确保UI更新时能正确显示
                 self.current_chapter_content = empty_msg
                 self.status_bar.showMessage("生成的内容为空，请检查API设置或重试。")
+                saved = False
             else:
                 print(f"设置章节内容到UI，长度: {len(response)}")
                 self.chapter_text.setPlainText(response)
@@ -6156,8 +6396,10 @@ class CompactNovelGeneratorApp(QMainWindow):
                 print(f"[调试] 设置后立即检查UI内容长度: {len(self.chapter_text.toPlainText())}")
                 
                 # 自动保存章节内容
-                self.auto_save_chapter()
-                
+                saved = self.auto_save_chapter()
+            
+            # 内容已经保存时生成日志不再需要（生成出错或保存失败时保留，下次启动可以恢复）
+            self.end_generation_journal(self.api_thread, saved=saved)
             self.status_bar.showMessage(f"第{self.chapter_number.value()}章生成完成")
             self.save_button.setEnabled(True)
             self.set_app_status("正常")
@@ -6189,15 +6431,18 @@ class CompactNovelGeneratorApp(QMainWindow):
             self.on_api_error(f"解析API响应失败: {str(e)}")
     
     def auto_save_chapter(self):
-        """自动保存当前章节内容"""
+        """自动保存当前章节内容到保存目录，提交了写盘时返回True；没有内容、出错或文件是用户已有的章节时返回False
+
+        本次运行中生成并保存过的章节文件直接覆盖（覆盖前记录版本），只跳过之前就存在的文件。
+        """
         try:
             # 获取章节内容
             content = self.chapter_text.toPlainText()
             if not content:
-                return
+                return False
                 
-            # 设置章节保存目录为：D:\桌面\xiexs\novels\zhangjie
-            chapter_save_path = r"D:\桌面\xiexs\novels\zhangjie"
+            # 与save_current_content一样保存到保存目录，版本历史、故事记忆和检索索引都按这个目录记录
+            chapter_save_path = self.save_path
             if not os.path.exists(chapter_save_path):
                 os.makedirs(chapter_save_path)
                 print(f"[调试] 创建章节目录: {chapter_save_path}")
@@ -6214,28 +6459,32 @@ class CompactNovelGeneratorApp(QMainWindow):
             file_name = f"第{chapter_num}章.txt"
             file_path = os.path.join(chapter_save_path, file_name)
             
-            # 检查文件是否已存在
-            if os.path.exists(file_path):
-                # 如果文件已存在，直接跳过保存，不询问用户
+            # 检查文件是否已存在（包括已提交、还在写盘队列中的）
+            if get_write_queue().exists(file_path) and os.path.abspath(file_path) not in self.generated_chapter_paths:
+                # 用户已有的章节直接跳过保存，不询问用户；生成的内容没有写盘，保留生成日志
                 self.status_bar.showMessage(f"第{chapter_num}章已存在，跳过保存")
-                return
+                return False
             
             # 格式化文本，每行约30字或按句号分行
             formatted_content = self.format_text_for_save(content)
             
             # 移除小说标题（如**《你是我唯一的解药》**）
-            formatted_content = self._remove_novel_title_from_content(formatted_content, title)
+            formatted_content = remove_novel_title_from_content(formatted_content, title)
             
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(formatted_content)
+            self.record_chapter_version(file_path, chapter_num, formatted_content, KIND_GENERATE)
+            get_write_queue().write(file_path, formatted_content, fsync=True)
+            record_chapter_write(file_path, formatted_content)
+            self.generated_chapter_paths.add(os.path.abspath(file_path))
                 
             self.status_bar.showMessage(f"已自动保存: {file_path}")
             self.chapter_counter += 1  # 计数器递增
             self.set_app_status("正常")
+            return True
         except Exception as e:
             print(f"自动保存失败: {str(e)}")
             self.status_bar.showMessage(f"自动保存失败: {str(e)}")
             self.set_app_status("异常")
+            return False
 
     def _update_ui_later(self):
         """延迟更新UI，避免阻塞"""
@@ -6254,8 +6503,6 @@ class CompactNovelGeneratorApp(QMainWindow):
             print(f"[调试] current_chapter_content存在: {hasattr(self, 'current_chapter_content')}")
             if hasattr(self, 'current_chapter_content'):
                 print(f"[调试] current_chapter_content内容: '{self.current_chapter_content}'")
-        self.chapter_text.update()
-        self.chapter_text.repaint()
         print(f"[调试] UI已更新，最终文本框内容长度: {len(self.chapter_text.toPlainText())}")
     
     def on_outline_ready(self, response, status):
@@ -6264,23 +6511,32 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         self.generate_button.setEnabled(True)
         self.stop_button.setEnabled(False)
+        # 下面直接显示完整内容，渲染器中尚未显示的片段不再需要
+        self.outline_renderer.discard()
+        
+        if status != "success":
+            # 出错或被停止时不覆盖大纲文件，保留生成日志，下次启动可以恢复或续写已生成的部分
+            self.end_generation_journal(self.api_thread, saved=False)
+            self.status_bar.showMessage("大纲生成已停止" if status == "cancelled" else "大纲生成失败，大纲文件未修改")
+            self.progress_label.setText("大纲生成已停止" if status == "cancelled" else "大纲生成失败")
+            self.set_app_status("正常")
+            return
         
         try:
             # 检查response是否为空
             if not response or not response.strip():
                 print("警告：response为空")
-                empty_msg = "警告：生成的大纲为空，请检查API设置或重试。"
-                self.outline_text.setPlainText(empty_msg)
+                self.outline_text.setPlainText("警告：生成的大纲为空，请检查API设置或重试。")
                 self.status_bar.showMessage("生成的大纲为空，请检查API设置或重试。")
-                # 保存空大纲到文件
-                self.save_outline(empty_msg)
+                # 空大纲不写入文件，保留原有大纲
             else:
                 print(f"设置大纲内容到UI，长度: {len(response)}")
                 self.outline_text.setPlainText(response)
                 print(f"大纲内容已设置到UI")
                 # 保存大纲到文件
                 self.save_outline(response)
-                
+            
+            self.end_generation_journal(self.api_thread, saved=bool(response and response.strip()))
             self.status_bar.showMessage("大纲生成完成")
             self.save_button.setEnabled(True)
             self.set_app_status("正常")
@@ -6424,122 +6680,187 @@ class CompactNovelGeneratorApp(QMainWindow):
         # 首先去除重复内容
         text = self._remove_duplicate_content(text)
             
-        # 使用列表存储格式化后的行，比字符串拼接更高效
-        formatted_lines = []
-        current_line = []
-        current_length = 0
-        line_limit = 30
-        
-        # 使用迭代器处理文本，避免多次字符串操作
-        for char in text:
-            current_line.append(char)
-            current_length += 1
-            
-            # 遇到句号、问号、感叹号或达到行长度限制时换行
-            if char in '。！？' or current_length >= line_limit:
-                formatted_lines.append(''.join(current_line))
-                current_line = []
-                current_length = 0
-        
-        # 添加最后一行
-        if current_line:
-            formatted_lines.append(''.join(current_line))
-            
-        return "\n".join(formatted_lines)
+        # 遇到句号、问号、感叹号或达到行长度限制时换行
+        return wrap_text(text, width=30)
     
     def _remove_duplicate_content(self, text):
-        """去除文本中的重复内容"""
-        # 首先按段落分割文本
-        paragraphs = text.split('\n')
-        
-        # 去除空段落
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
-        
-        # 使用字典记录已经出现过的段落
-        seen_paragraphs = {}
-        unique_paragraphs = []
-        
-        for paragraph in paragraphs:
-            # 计算段落的哈希值作为唯一标识
-            paragraph_hash = hash(paragraph)
-            
-            # 如果段落长度太短（小于10个字符），可能是标题或特殊格式，保留
-            if len(paragraph) < 10:
-                unique_paragraphs.append(paragraph)
-                continue
-                
-            # 如果段落已经出现过，跳过
-            if paragraph_hash in seen_paragraphs:
-                # 移除了调试日志输出
-                continue
-                
-            # 否则记录并保留
-            seen_paragraphs[paragraph_hash] = True
-            unique_paragraphs.append(paragraph)
-        
-        # 重新组合段落
-        deduplicated_text = '\n'.join(unique_paragraphs)
-        
-        # 进一步检测并去除句子级别的重复
-        deduplicated_text = self._remove_duplicate_sentences(deduplicated_text)
-        
-        return deduplicated_text
-    
-    def _remove_duplicate_sentences(self, text):
-        """检测并去除文本中重复的句子"""
-        # 按句子分割文本（保留句号等标点）
-        sentences = re.split(r'([。！？])', text)
-        
-        # 重新组合句子和标点
-        processed_sentences = []
-        i = 0
-        while i < len(sentences):
-            if i + 1 < len(sentences):
-                sentence = sentences[i] + sentences[i+1]  # 句子+标点
-                i += 2
-            else:
-                sentence = sentences[i]
-                i += 1
-                
-            # 跳过空句子
-            if not sentence.strip():
-                continue
-                
-            # 检查是否与前面的句子重复
-            is_duplicate = False
-            for j in range(len(processed_sentences) - 1, max(-1, len(processed_sentences) - 5), -1):
-                # 计算相似度
-                similarity = self._calculate_similarity(sentence, processed_sentences[j])
-                if similarity > 0.8:  # 相似度阈值
-                    # 移除了调试日志输出
-                    is_duplicate = True
-                    break
-                    
-            if not is_duplicate:
-                processed_sentences.append(sentence)
-                
-        return ''.join(processed_sentences)
-    
-    def _calculate_similarity(self, text1, text2):
-        """计算两个文本的相似度（基于共同的词汇比例）"""
-        # 简单的相似度计算，基于共同的词汇比例
-        words1 = set(text1)
-        words2 = set(text2)
-        
-        if not words1 or not words2:
-            return 0
-            
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
-        
-        return len(intersection) / len(union)
-        
-
+        """去除文本中的重复段落和近似重复的句子"""
+        return remove_duplicate_content(text)
     
     def get_current_content(self):
         """获取当前编辑的内容，用于自动保存"""
         return self.chapter_text.toPlainText()
     
+    def record_chapter_version(self, file_path, chapter_num, text, kind, note=None):
+        """在提交章节写入之前记录一个版本（第一次记录时先保存文件现有的内容），失败时不影响保存"""
+        try:
+            get_chapter_history(os.path.dirname(file_path) or ".").record(chapter_num, text, kind,
+                                                                           existing_path=file_path, note=note)
+        except Exception as e:
+            print(f"[版本历史] 记录第{chapter_num}章版本失败: {e}")
+
+    def show_chapter_history(self):
+        """打开当前章节的版本历史"""
+        chapter_num = self.chapter_number.value()
+        history = get_chapter_history(self.save_path)
+        if not history.versions(chapter_num):
+            QMessageBox.information(self, "版本历史", f"第{chapter_num}章还没有历史版本")
+            return
+        dialog = ChapterHistoryDialog(history, chapter_num, self.chapter_text.toPlainText(), self)
+        if dialog.exec_() == QDialog.Accepted and dialog.restore_version is not None:
+            self.restore_chapter_version(history, chapter_num, dialog.restore_version)
+
+    def restore_chapter_version(self, history, chapter_num, version):
+        """把章节恢复为某个历史版本：记为一个新的“恢复”版本并保存到章节文件"""
+        text = history.text(chapter_num, version)
+        file_path = os.path.join(self.save_path, f"第{chapter_num}章.txt")
+        history.record(chapter_num, text, KIND_RESTORE, note=f"恢复自版本{version}")
+        # 按原样写入恢复的版本，不经过format_text_for_save；编辑器内容就是这份时格式化结果也是它本身，
+        # 之后的自动保存发现文件内容相同直接跳过，不会再记一个手动修改的版本
+        content_cache.processed(file_path, "format", text, lambda content: content)
+        if content_cache.write_text(file_path, text, fsync=True):
+            record_chapter_write(file_path, text)
+        self.chapter_text.setPlainText(text)
+        self.status_bar.showMessage(f"第{chapter_num}章已恢复为版本{version}")
+
+    def story_context(self, chapter, previous_text=None):
+        """生成第chapter章时附上的前文上下文（故事记忆），出错时返回空字符串，由调用方退回到上一章结尾"""
+        try:
+            context = build_story_context(self.save_path, chapter, previous_text)
+        except Exception as e:
+            print(f"[故事记忆] 构建第{chapter}章上下文失败: {e}")
+            return ""
+        try:
+            # 按本章大纲概要和主角名从更早的章节中检索相关片段，避免伏笔、人物关系前后矛盾
+            passages = related_passages(self.save_path, chapter, self.outline_text.toPlainText(),
+                                        (self.hero_name.text(), self.heroine_name.text()))
+        except Exception as e:
+            print(f"[检索] 检索第{chapter}章相关前文失败: {e}")
+            passages = ""
+        if passages:
+            context = f"{passages}\n\n{context}" if context else passages
+        print(f"[故事记忆] 第{chapter}章上下文约{estimate_tokens(context)} tokens")
+        return context
+
+    def warm_up_ollama(self):
+        """使用Ollama时在后台预热模型，第一次请求不必等模型加载"""
+        if self.api_type == "Ollama":
+            get_ollama_session(self.api_url, self.model_name).warm_up()
+
+    def start_generation_journal(self, api_call, kind, chapter, prompt, text=""):
+        """把这次生成的流式内容同时记录到保存目录的.partial日志中，程序崩溃后可以恢复
+
+        prompt为原始提示词，继续生成时在它的基础上构建续写提示词；text为继续生成时已有的内容。
+        """
+        title = self.novel_title_input.text().strip() or "未命名小说"
+        journal = open_generation_journal(self.save_path, kind, chapter, text=text, title=title,
+                                          api_type=self.api_type, model=self.model_name, prompt=prompt)
+        api_call.journal = journal
+        # 出错时在生成线程中标记，生成结束后保留日志
+        api_call.error.connect(journal.mark_failed)
+        return journal
+
+    def end_generation_journal(self, api_call, saved):
+        """生成结束：内容已保存时删除日志（生成出错的除外），否则保留供下次启动恢复"""
+        journal = getattr(api_call, 'journal', None)
+        if journal is None:
+            return
+        api_call.journal = None
+        if saved:
+            journal.finish()
+        else:
+            journal.close()
+
+    def recover_partial_generations(self):
+        """启动时检查上次没有生成完的章节和大纲（程序崩溃或被强制关闭时留下的日志），逐个询问如何处理"""
+        partials = find_partial_generations(self.save_path)
+        if not partials:
+            return
+        print(f"[生成日志] 发现{len(partials)}个未完成的生成")
+        to_continue = None
+        for partial in partials:
+            name = "大纲" if partial.get("kind") == JOURNAL_OUTLINE else f"第{partial.get('chapter', 0)}章"
+            updated = datetime.fromtimestamp(partial["updated_at"]).strftime("%Y-%m-%d %H:%M")
+            box = QMessageBox(self)
+            box.setWindowTitle("恢复未完成的生成")
+            box.setIcon(QMessageBox.Question)
+            box.setText(f"{name}上次没有生成完（{updated}，已生成{len(partial['text'])}字）")
+            box.setInformativeText("继续生成：接着已生成的内容往下写\n"
+                                   f"保留：把已生成的部分保存为{name}\n"
+                                   "丢弃：删除已生成的部分\n"
+                                   "稍后处理：下次启动时再询问")
+            # 一次只继续生成一个，其余的可以保留、丢弃或下次再处理
+            continue_button = None
+            if to_continue is None and partial.get("prompt"):
+                continue_button = box.addButton("继续生成", QMessageBox.AcceptRole)
+            keep_button = box.addButton("保留", QMessageBox.YesRole)
+            discard_button = box.addButton("丢弃", QMessageBox.DestructiveRole)
+            box.addButton("稍后处理", QMessageBox.RejectRole)
+            box.exec_()
+            clicked = box.clickedButton()
+            if continue_button is not None and clicked == continue_button:
+                to_continue = partial
+            elif clicked == keep_button:
+                self._keep_partial_generation(partial)
+            elif clicked == discard_button:
+                discard_partial(partial)
+                print(f"[生成日志] 已丢弃{name}未完成的内容")
+        if to_continue is not None:
+            self._continue_partial_generation(to_continue)
+
+    def _keep_partial_generation(self, partial):
+        """把未完成生成的内容直接保存：大纲显示并保存，章节写入章节文件（不改变编辑器中的内容）"""
+        text = partial["text"]
+        if partial.get("kind") == JOURNAL_OUTLINE:
+            self.outline_text.setPlainText(text)
+            self.save_outline(text)
+            self.status_bar.showMessage("已保留上次未生成完的大纲")
+        else:
+            chapter_num = partial.get("chapter", 0)
+            file_path = os.path.join(self.save_path, f"第{chapter_num}章.txt")
+            # 覆盖已有章节前先记录版本，可以从版本历史中找回
+            self.record_chapter_version(file_path, chapter_num, text, KIND_GENERATE)
+            get_write_queue().write(file_path, text, fsync=True)
+            record_chapter_write(file_path, text)
+            self.status_bar.showMessage(f"已保留第{chapter_num}章未生成完的内容: {file_path}")
+        discard_partial(partial)
+
+    def _continue_partial_generation(self, partial):
+        """接着未完成的内容继续生成，结束后与已有内容合并，按正常生成完成的流程显示和保存"""
+        partial_text = partial["text"]
+        chapter_num = partial.get("chapter", 0)
+        if partial.get("kind") == JOURNAL_OUTLINE:
+            name = "大纲"
+            text_edit, renderer, button, on_ready = (self.outline_text, self.outline_renderer,
+                                                     self.generate_button, self.on_outline_ready)
+        else:
+            name = f"第{chapter_num}章"
+            self.chapter_number.setValue(chapter_num)
+            self.streaming_chapter = chapter_num
+            text_edit, renderer, button, on_ready = (self.chapter_text, self.chapter_renderer,
+                                                     self.generate_chapter_button, self.on_chapter_ready)
+        renderer.discard()
+        text_edit.setPlainText(partial_text)
+        button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.set_app_status("忙碌")
+        self.status_bar.showMessage(f"正在继续生成{name}...")
+        
+        prompt = build_continue_prompt(partial["prompt"], partial_text)
+        self.api_thread = create_api_call(self.api_type, self.api_url, self.api_key, prompt, self.model_name,
+                                          api_format=self.api_format, custom_headers=self.custom_headers,
+                                          max_chapter_length=self.max_chapter_length)
+        # 日志从已有内容开始记录，再次中断时不会丢失前半部分
+        self.start_generation_journal(self.api_thread, partial["kind"], chapter_num, partial["prompt"], text=partial_text)
+        self.api_thread.finished.connect(lambda response, status: on_ready(partial_text + response, status))
+        self.api_thread.error.connect(self.on_api_error)
+        self.api_thread.progress.connect(self.on_progress)
+        # 偏移加上已有内容的长度，渲染器不会清空已显示的前半部分
+        self.api_thread.content_delta.connect(
+            lambda chunk, offset: renderer.append(chunk, len(partial_text) + offset,
+                                                  f"正在继续生成{name}... 已生成 {len(partial_text) + offset + len(chunk)} 字"))
+        self.api_thread.start()
+
     def save_current_content(self):
         """保存当前编辑的内容，用于自动保存"""
         # 获取小说标题
@@ -6556,6 +6877,9 @@ class CompactNovelGeneratorApp(QMainWindow):
         
         # 自动生成文件名
         chapter_num = self.chapter_number.value()
+        if chapter_num == self.streaming_chapter:
+            # 这一章还在流式生成，编辑器中是未完成的内容，生成完成后由auto_save_chapter保存
+            return False
         
         # 从章节内容中提取章节标题
         content = self.chapter_text.toPlainText()
@@ -6570,12 +6894,15 @@ class CompactNovelGeneratorApp(QMainWindow):
             if not content:
                 return False
             
-            # 格式化文本
-            formatted_content = self.format_text_for_save(content)
+            # 格式化文本，内容与上次相同时直接使用上次的结果
+            formatted_content = content_cache.processed(file_path, "format", content, self.format_text_for_save)
             
-            # 保存到文件
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(formatted_content)
+            # 保存到文件，与文件现有内容相同时跳过写盘
+            if not content_cache.is_current(file_path, formatted_content):
+                # 内容有变化时记录一个手动修改的版本（连续修改会合并）
+                self.record_chapter_version(file_path, chapter_num, formatted_content, KIND_EDIT)
+            if content_cache.write_text(file_path, formatted_content):
+                record_chapter_write(file_path, formatted_content)
             
             return file_path
         except Exception as e:
@@ -6721,8 +7048,8 @@ class CompactNovelGeneratorApp(QMainWindow):
             file_name = f"第{chapter_num}章.txt"
             file_path = os.path.join(self.save_path, file_name)
             
-            # 检查文件是否已存在
-            if os.path.exists(file_path):
+            # 检查文件是否已存在（包括已提交、还在写盘队列中的）
+            if get_write_queue().exists(file_path):
                 # 如果文件已存在，直接跳过保存，不询问用户
                 self.status_bar.showMessage(f"第{chapter_num}章已存在，跳过保存")
                 return
@@ -6730,8 +7057,9 @@ class CompactNovelGeneratorApp(QMainWindow):
             # 格式化文本，每行约30字或按句号分行
             formatted_content = self.format_text_for_save(content)
             
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(formatted_content)
+            self.record_chapter_version(file_path, chapter_num, formatted_content, KIND_GENERATE)
+            get_write_queue().write(file_path, formatted_content, fsync=True)
+            record_chapter_write(file_path, formatted_content)
                 
             self.status_bar.showMessage(f"已保存: {file_path}")
             self.chapter_counter += 1  # 计数器递增
@@ -6775,48 +7103,9 @@ class CompactNovelGeneratorApp(QMainWindow):
         """保存当前参数到配置文件"""
         print("开始保存参数...")
         
-        # 使用绝对路径
-        user_params_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_params.json")
-        
-        # 首先尝试加载现有的参数
-        existing_params = {}
-        if os.path.exists(user_params_path):
-            try:
-                with open(user_params_path, "r", encoding="utf-8") as f:
-                    existing_params = json.load(f)
-                print("已加载现有参数")
-            except Exception as e:
-                print(f"加载现有参数失败: {e}")
-        
-        # 创建多API配置结构
-        if "api_configs" not in existing_params:
-            existing_params["api_configs"] = {}
-            print("创建新的api_configs结构")
-        
-        # 保存当前API配置
-        print(f"保存 {self.api_type} 的配置...")
-        existing_params["api_configs"][self.api_type] = {
-            "api_url": self.api_url,
-            "api_key": self.api_key,
-            "model_name": self.model_name,
-            "api_format": self.api_format,
-            "custom_headers": self.custom_headers
-        }
-        print(f"已保存 {self.api_type} 的配置: {existing_params['api_configs'][self.api_type]}")
-        
-        # 保存当前选中的API类型和其他通用参数
-        params = {
-            "current_api_type": self.api_type,
-            "api_configs": existing_params["api_configs"],
-            "min_chapter_length": self.min_chapter_length,
-            "max_chapter_length": self.max_chapter_length,
-            "save_path": self.save_path,
-            "file_behavior": self.file_behavior
-        }
-        
         try:
-            with open(user_params_path, "w", encoding="utf-8") as f:
-                json.dump(params, f, ensure_ascii=False, indent=4)
+            self.update_user_config()
+            self.user_config.flush(force=True)
             print("参数保存成功")
             self.status_bar.showMessage("设置已保存")
             # 创建自定义信息消息框
@@ -6888,85 +7177,112 @@ class CompactNovelGeneratorApp(QMainWindow):
             self.status_bar.showMessage("保存设置失败")
             self.set_app_status("异常")
 
+    def update_user_config(self):
+        """把当前参数写入内存中的用户参数，值有变化时才标记为需要保存"""
+        # 保存当前API配置
+        self.user_config.update_api_config(
+            self.api_type,
+            api_url=self.api_url,
+            api_key=self.api_key,
+            model_name=self.model_name,
+            api_format=self.api_format,
+            custom_headers=self.custom_headers,
+        )
+        # 保存当前选中的API类型和其他通用参数
+        self.user_config.set("current_api_type", self.api_type)
+        self.user_config.set("min_chapter_length", self.min_chapter_length)
+        self.user_config.set("max_chapter_length", self.max_chapter_length)
+        self.user_config.set("save_path", self.save_path)
+        self.user_config.set("file_behavior", self.file_behavior)
+        self.user_config.set("batch_concurrency", self.batch_concurrency)
+
+    def save_user_config(self):
+        """自动保存用户参数，内容没有变化时不写盘"""
+        self.update_user_config()
+        if self.user_config.flush():
+            print("用户参数已自动保存")
+
     def load_parameters(self):
         """从配置文件加载参数"""
         print("开始加载参数...")
         try:
-            # 使用绝对路径
-            user_params_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_params.json")
-            if os.path.exists(user_params_path):
-                with open(user_params_path, "r", encoding="utf-8") as f:
-                    params = json.load(f)
-                    print("已加载参数文件")
-                    
-                    # 检查是否是新的配置格式（包含api_configs）
-                    if "api_configs" in params:
-                        # 新格式：加载当前选中的API类型
-                        self.api_type = params.get("current_api_type", "Ollama")
-                        print(f"当前API类型: {self.api_type}")
-                        
-                        # 加载当前API类型的配置
-                        current_api_config = params["api_configs"].get(self.api_type, {})
-                        self.api_url = current_api_config.get("api_url", "http://localhost:11434/api/generate")
-                        self.api_key = current_api_config.get("api_key", "")
-                        self.model_name = current_api_config.get("model_name", "deepseek-r1:latest")
-                        self.api_format = current_api_config.get("api_format", None)
-                        self.custom_headers = current_api_config.get("custom_headers", None)
-                        print(f"已加载 {self.api_type} 的配置: URL={self.api_url}, Model={self.model_name}")
-                    else:
-                        # 旧格式：直接加载参数
-                        self.api_type = params.get("api_type", "Ollama")
-                        self.api_url = params.get("api_url", "http://localhost:11434/api/generate")
-                        self.api_key = params.get("api_key", "")
-                        self.model_name = params.get("model_name", "deepseek-r1:latest")
-                        self.api_format = params.get("api_format", None)
-                        self.custom_headers = params.get("custom_headers", None)
-                        print(f"已加载旧格式参数: API={self.api_type}, Model={self.model_name}")
-                    
-                    # 加载通用参数
-                    self.min_chapter_length = params.get("min_chapter_length", 3500)
-                    self.max_chapter_length = params.get("max_chapter_length", 5000)
-                    self.save_path = params.get("save_path", "novels")
-                    self.file_behavior = params.get("file_behavior", "询问")
-                    print(f"已加载通用参数: 章节长度={self.min_chapter_length}-{self.max_chapter_length}, 保存路径={self.save_path}, 文件行为={self.file_behavior}")
+            # 从文件重新读取内存中的用户参数
+            self.user_config.reload()
+            if self.user_config.exists():
+                params = self.user_config.data()
+                print("已加载参数文件")
+                
+                # 检查是否是新的配置格式（包含api_configs）
+                if "api_configs" in params:
+                    # 新格式：加载当前选中的API类型
+                    self.api_type = params.get("current_api_type", "Ollama")
+                    print(f"当前API类型: {self.api_type}")
                     
-                    # 根据API类型更新模型选择下拉框
-                    if self.api_type == "SiliconFlow":
-                        self.model_combo.clear()
-                        self.model_combo.addItems(["Qwen/Qwen3-8B", "Qwen/Qwen2.5-7B"])
-                        print("已加载SiliconFlow模型列表")
-                    elif self.api_type == "Ollama":
-                        # 加载默认模型和自定义模型
-                        self.model_combo.clear()
-                        default_models = ["qwen:latest"]
-                        custom_models = self.load_custom_models()
-                        all_models = default_models + custom_models
-                        self.model_combo.addItems(all_models)
-                        print(f"已加载Ollama模型列表: {all_models}")
-                    elif self.api_type == "ModelScope":
-                        # 加载默认模型和自定义ModelScope模型
-                        self.model_combo.clear()
-                        default_models = ["Qwen/Qwen3-VL-30B-A3B-Instruct"]
-                        custom_models = self.load_custom_modelscope_models()
-                        all_models = default_models + custom_models
-                        self.model_combo.addItems(all_models)
-                        print(f"已加载ModelScope模型列表: {all_models}")
+                    # 加载当前API类型的配置
+                    current_api_config = params["api_configs"].get(self.api_type, {})
+                    self.api_url = current_api_config.get("api_url", "http://localhost:11434/api/generate")
+                    self.api_key = current_api_config.get("api_key", "")
+                    self.model_name = current_api_config.get("model_name", "deepseek-r1:latest")
+                    self.api_format = current_api_config.get("api_format", None)
+                    self.custom_headers = current_api_config.get("custom_headers", None)
+                    print(f"已加载 {self.api_type} 的配置: URL={self.api_url}, Model={self.model_name}")
+                else:
+                    # 旧格式：直接加载参数
+                    self.api_type = params.get("api_type", "Ollama")
+                    self.api_url = params.get("api_url", "http://localhost:11434/api/generate")
+                    self.api_key = params.get("api_key", "")
+                    self.model_name = params.get("model_name", "deepseek-r1:latest")
+                    self.api_format = params.get("api_format", None)
+                    self.custom_headers = params.get("custom_headers", None)
+                    print(f"已加载旧格式参数: API={self.api_type}, Model={self.model_name}")
+                
+                # 加载通用参数
+                self.min_chapter_length = params.get("min_chapter_length", 3500)
+                self.max_chapter_length = params.get("max_chapter_length", 5000)
+                self.save_path = params.get("save_path", "novels")
+                self.file_behavior = params.get("file_behavior", "询问")
+                self.batch_concurrency = dict(DEFAULT_BATCH_CONCURRENCY)
+                self.batch_concurrency.update(params.get("batch_concurrency", {}))
+                self.refresh_batch_concurrency_spin()
+                print(f"已加载通用参数: 章节长度={self.min_chapter_length}-{self.max_chapter_length}, 保存路径={self.save_path}, 文件行为={self.file_behavior}")
+                
+                # 根据API类型更新模型选择下拉框
+                if self.api_type == "SiliconFlow":
+                    self.model_combo.clear()
+                    self.model_combo.addItems(["Qwen/Qwen3-8B", "Qwen/Qwen2.5-7B"])
+                    print("已加载SiliconFlow模型列表")
+                elif self.api_type == "Ollama":
+                    # 加载默认模型和自定义模型
+                    self.model_combo.clear()
+                    default_models = ["qwen:latest"]
+                    custom_models = self.load_custom_models()
+                    all_models = default_models + custom_models
+                    self.model_combo.addItems(all_models)
+                    print(f"已加载Ollama模型列表: {all_models}")
+                elif self.api_type == "ModelScope":
+                    # 加载默认模型和自定义ModelScope模型
+                    self.model_combo.clear()
+                    default_models = ["Qwen/Qwen3-VL-30B-A3B-Instruct"]
+                    custom_models = self.load_custom_modelscope_models()
+                    all_models = default_models + custom_models
+                    self.model_combo.addItems(all_models)
+                    print(f"已加载ModelScope模型列表: {all_models}")
+                else:
+                    # 其他API类型使用默认模型列表
+                    self.model_combo.clear()
+                    self.model_combo.addItems(["deepseek-r1:latest", "llama2:latest", "mistral:latest", "qwen:latest"])
+                    print("已加载默认模型列表")
+                
+                # 设置当前选中的模型
+                if self.model_name:
+                    index = self.model_combo.findText(self.model_name)
+                    if index >= 0:
+                        self.model_combo.setCurrentIndex(index)
+                        print(f"已设置当前模型: {self.model_name}")
                     else:
-                        # 其他API类型使用默认模型列表
-                        self.model_combo.clear()
-                        self.model_combo.addItems(["deepseek-r1:latest", "llama2:latest", "mistral:latest", "qwen:latest"])
-                        print("已加载默认模型列表")
-                    
-                    # 设置当前选中的模型
-                    if self.model_name:
-                        index = self.model_combo.findText(self.model_name)
-                        if index >= 0:
-                            self.model_combo.setCurrentIndex(index)
-                            print(f"已设置当前模型: {self.model_name}")
-                        else:
-                            print(f"警告: 未找到模型 {self.model_name}，使用默认模型")
-                    
-                    print("参数加载完成")
+                        print(f"警告: 未找到模型 {self.model_name}，使用默认模型")
+                
+                print("参数加载完成")
             else:
                 print("参数文件不存在，使用默认参数")
         except Exception as e:
@@ -7195,7 +7511,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.title_result_list.addItem("正在生成标题，请稍候...")
         
         # 创建API调用线程
-        self.title_thread = ApiCallThread(
+        self.title_thread = create_api_call(
             self.api_type, 
             self.api_url, 
             self.api_key, 
@@ -7484,7 +7800,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.bg_result_text.setPlainText("正在生成背景设定，请稍候...")
         
         # 创建API调用线程
-        self.bg_thread = ApiCallThread(
+        self.bg_thread = create_api_call(
             self.api_type, 
             self.api_url, 
             self.api_key, 
@@ -7784,7 +8100,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.hero_result_text.setPlainText("正在生成男主角设定，请稍候...")
         
         # 创建API调用线程
-        self.hero_thread = ApiCallThread(
+        self.hero_thread = create_api_call(
             self.api_type, 
             self.api_url, 
             self.api_key, 
@@ -8114,7 +8430,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.heroine_result_text.setPlainText("正在生成女主角设定，请稍候...")
         
         # 创建API调用线程
-        self.heroine_thread = ApiCallThread(
+        self.heroine_thread = create_api_call(
             self.api_type, 
             self.api_url, 
             self.api_key, 
@@ -8437,7 +8753,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.rel_result_text.setPlainText("正在生成角色关系描述，请稍候...")
         
         # 创建API调用线程
-        self.rel_thread = ApiCallThread(
+        self.rel_thread = create_api_call(
             self.api_type, 
             self.api_url, 
             self.api_key, 
@@ -8698,7 +9014,8 @@ class CompactNovelGeneratorApp(QMainWindow):
         plot_twist = self.plot_twist_input.toPlainText().strip()
         
         # 获取前面章节的内容作为上下文
-        previous_chapters_content = self._get_previous_chapters_content()
+        previous_chapters_content = self._get_previous_chapters_content(
+            "\n".join([plot_events, plot_twist, self.hero_name.text(), self.heroine_name.text()]))
         
         # 构建提示词
         prompt = f"请根据前面章节的内容，生成一段核心剧情描述，剧情类型为{plot_type}，剧情节奏为{plot_rhythm}"
@@ -8731,7 +9048,7 @@ class CompactNovelGeneratorApp(QMainWindow):
         self.plot_result_text.setPlainText("正在生成核心剧情描述，请稍候...")
         
         # 创建API调用线程
-        self.plot_thread = ApiCallThread(
+        self.plot_thread = create_api_call(
             self.api_type, 
             self.api_url, 
             self.api_key, 
@@ -8785,8 +9102,21 @@ class CompactNovelGeneratorApp(QMainWindow):
             # 关闭对话框
             dialog.accept()
     
-    def _get_previous_chapters_content(self):
-        """获取前面章节的内容作为上下文"""
+    def _get_previous_chapters_content(self, query=""):
+        """获取前面章节的内容作为上下文
+
+        有查询内容（关键事件、转折、主角名）时从保存目录的检索索引中取最相关的片段，
+        没有结果时退回到novels目录前3章的开头。
+        """
+        if query.strip():
+            try:
+                results = get_search_index(self.save_path).search(query, k=5)
+            except Exception as e:
+                print(f"[检索] 检索前面章节失败: {e}")
+                results = []
+            if results:
+                results.sort(key=lambda result: result[1])
+                return "\n".join(f"第{chapter}章：{text}" for _, chapter, text in results)
         try:
             chapters_content = []
             
@@ -8874,6 +9204,7 @@ class CompactNovelGeneratorApp(QMainWindow):
                 # 保持save_path向后兼容
                 self.save_path = self.chapter_path
             self.file_behavior = settings["file_behavior"]
+            self.refresh_batch_concurrency_spin()
             
             print(f"已更新设置: API={self.api_type}, Model={self.model_name}")
             
@@ -8978,38 +9309,36 @@ class CompactNovelGeneratorApp(QMainWindow):
             print(f"加载小说参数失败: {e}")
 
     def save_all_settings(self):
-        """自动保存所有设置和输入内容"""
+        """自动保存有修改的设置和输入内容，没有修改的产物不会重新生成和写盘"""
         try:
-            # 保存应用程序参数
-            self.save_parameters()
-            
-            # 保存小说参数
-            self.save_novel_params()
-            
-            # 保存大纲内容（如果有）
-            outline_content = self.outline_text.toPlainText()
-            if outline_content:
-                self.save_outline(outline_content)
-            
-            # 保存当前章节内容（如果有）
-            chapter_content = self.chapter_text.toPlainText()
-            if chapter_content:
-                self.save_current_content()
+            # 设置对话框等直接修改了内存中的用户参数
+            if self.user_config.dirty:
+                self.persistence.mark_dirty("user_params")
+            saved = self.persistence.flush()
+            if not saved:
+                return
                 
-            print("所有设置和内容已自动保存")
+            print(f"已自动保存: {', '.join(saved)}")
+            print(f"[性能] 内容缓存: {content_cache.stats()}")
             self.status_bar.showMessage("所有设置和内容已自动保存")
         except Exception as e:
             print(f"自动保存设置失败: {e}")
             self.status_bar.showMessage(f"自动保存失败: {str(e)}")
 
+    def save_outline_from_editor(self):
+        """保存大纲编辑框中的内容（如果有）"""
+        outline_content = self.outline_text.toPlainText()
+        if outline_content:
+            self.save_outline(outline_content)
+
+    def save_chapter_from_editor(self):
+        """保存当前章节内容（如果有）"""
+        if self.chapter_text.toPlainText():
+            self.save_current_content()
+
     def auto_save_novel_params(self):
-        """自动保存小说参数到JSON文件"""
-        try:
-            # 使用已有的save_novel_params方法保存参数
-            self.save_novel_params()
-            print("小说参数已自动保存")
-        except Exception as e:
-            print(f"自动保存小说参数失败: {e}")
+        """小说参数有修改，由自动保存定时器合并保存到JSON文件"""
+        self.trigger_auto_save_settings("novel_params")
 
     def save_novel_params(self):
         """保存小说参数到JSON文件"""
@@ -9039,9 +9368,8 @@ class CompactNovelGeneratorApp(QMainWindow):
             "chapter_number": self.chapter_number.value()
         }
         try:
-            with open('novel_params.json', 'w', encoding='utf-8') as f:
-                json.dump(novel_params, f, ensure_ascii=False, indent=4)
-            print("小说参数已自动保存")
+            if content_cache.write_text('novel_params.json', json.dumps(novel_params, ensure_ascii=False, indent=4)):
+                print("小说参数已自动保存")
         except Exception as e:
             print(f"保存小说参数失败: {e}")
 
@@ -9843,6 +10171,17 @@ class CompactNovelGeneratorApp(QMainWindow):
         if hasattr(self, 'auto_save_thread') and self.auto_save_thread is not None:
             print("[调试] 正在停止自动保存线程")
             self.stop_auto_save()
+        # 正在生成的内容写入生成日志并保留，下次启动时可以恢复（须在停止生成引擎之前）
+        close_journal_writer()
+        # 写完后台写盘队列中剩余的内容
+        close_write_queue()
+        close_project_stores()
+        close_chapter_histories()
+        close_story_memories()
+        # 停止异步生成引擎（取消未完成的请求），关闭共享连接池中的keep-alive连接
+        shutdown_engine()
+        session_pool.close_all()
+        close_job_stores()
         print("[调试] 应用程序关闭事件处理完成")
         # 调用父类的closeEvent
         super().closeEvent(event)
@@ -9879,8 +10218,9 @@ if __name__ == "__main__":
     def save_on_exit():
         print("程序退出前保存参数...")
         if novel_app:
-            novel_app.save_parameters()
-            novel_app.save_novel_params()
+            novel_app.save_all_settings()
+        close_journal_writer()
+        close_write_queue()
     
     # 连接退出事件
     print("连接退出事件...")